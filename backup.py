@@ -0,0 +1,159 @@
+import gzip
+import hashlib
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import datetime
+import db
+
+BACKUP_DIR = os.path.join(os.path.dirname(db.DATABASE), "backups")
+BACKUP_PREFIX = "bot-"
+BACKUP_SUFFIX = ".db.gz"
+
+def snapshot(dest_path):
+    """
+    Write a consistent copy of the live DB to dest_path without stopping writers.
+    """
+    src = sqlite3.connect(db.DATABASE)
+    dst = sqlite3.connect(dest_path)
+    try:
+        # All pages in one step, i.e. one read transaction. In WAL mode that
+        # doesn't block writers, whereas a step-by-step copy starts over
+        # whenever another connection writes and may never finish.
+        src.backup(dst)
+        # The copy inherits WAL mode from bot.db; keep the file self-contained.
+        dst.execute("PRAGMA journal_mode=DELETE")
+    finally:
+        dst.close()
+        src.close()
+
+def compressed_snapshot():
+    """
+    Return a gzip-compressed snapshot of the live DB as bytes.
+    """
+    fd, path = tempfile.mkstemp(suffix=".db", dir=os.path.dirname(db.DATABASE))
+    os.close(fd)
+    try:
+        snapshot(path)
+        with open(path, "rb") as f:
+            return gzip.compress(f.read())
+    finally:
+        os.remove(path)
+
+def validate_db_file(path):
+    """
+    Return (ok, message) for a candidate restore: the schema version must be
+    supported and PRAGMA integrity_check must pass.
+    """
+    ok, detail = db.check_db_file(path)
+    if not ok:
+        return ok, detail
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        result = conn.execute("PRAGMA integrity_check").fetchone()[0]
+    except sqlite3.DatabaseError as e:
+        result = str(e)
+    finally:
+        conn.close()
+    if result != "ok":
+        return False, f"Integrity check failed: {result}"
+    return True, detail
+
+def restore(data):
+    """
+    Replace the live DB with `data` (a raw or gzip-compressed DB file).
+
+    The upload is written to a temp file and validated first. It is then
+    copied over the live DB with the backup API as one write transaction.
+    That waits for open transactions to finish, and other connections see
+    either the old DB or the new one, never a half-written file.
+    Returns (ok, message).
+    """
+    if data[:2] == b"\x1f\x8b":
+        try:
+            data = gzip.decompress(data)
+        except OSError as e:
+            return False, f"Could not decompress backup: {e}"
+    fd, path = tempfile.mkstemp(suffix=".db", dir=os.path.dirname(db.DATABASE))
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        ok, detail = validate_db_file(path)
+        if not ok:
+            return ok, detail
+        # Queued audit rows belong to the DB being replaced.
+        db.flush_writes()
+        src = sqlite3.connect(path)
+        dst = sqlite3.connect(db.DATABASE, timeout=30)
+        try:
+            src.backup(dst)
+        finally:
+            dst.close()
+            src.close()
+    finally:
+        for leftover in (path, path + "-wal", path + "-shm"):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+    # An older backup may predate some migrations.
+    db.init_db()
+    db.bump_content_version()
+    return True, detail
+
+def list_backups():
+    """
+    Return the paths of stored backups, newest first.
+    """
+    if not os.path.isdir(BACKUP_DIR):
+        return []
+    names = [n for n in os.listdir(BACKUP_DIR) if n.startswith(BACKUP_PREFIX) and n.endswith(BACKUP_SUFFIX)]
+    return [os.path.join(BACKUP_DIR, n) for n in sorted(names, reverse=True)]
+
+def _latest_digest():
+    backups = list_backups()
+    if not backups:
+        return None
+    with gzip.open(backups[0], "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+def write_backup(keep=7, force=False):
+    """
+    Store a compressed snapshot in BACKUP_DIR and prune all but the newest
+    `keep`. A snapshot identical to the newest stored one is skipped unless
+    force is set. Returns the new path, or None if nothing changed.
+    """
+    fd, path = tempfile.mkstemp(suffix=".db", dir=os.path.dirname(db.DATABASE))
+    os.close(fd)
+    try:
+        snapshot(path)
+        with open(path, "rb") as f:
+            raw = f.read()
+    finally:
+        os.remove(path)
+    if not force and hashlib.sha256(raw).hexdigest() == _latest_digest():
+        return None
+    os.makedirs(BACKUP_DIR, exist_ok=True)
+    target = os.path.join(BACKUP_DIR, f"{BACKUP_PREFIX}{datetime.now().strftime('%Y%m%d-%H%M%S')}{BACKUP_SUFFIX}")
+    with open(target + ".tmp", "wb") as f:
+        f.write(gzip.compress(raw))
+    os.replace(target + ".tmp", target)
+    for old in list_backups()[keep:]:
+        os.remove(old)
+    return target
+
+def start_backup_scheduler(interval=6 * 3600, keep=7):
+    """
+    Write a backup every `interval` seconds in a daemon thread, keeping the
+    newest `keep`. Intervals with no changes to the DB are skipped.
+    """
+    def loop():
+        while True:
+            time.sleep(interval)
+            try:
+                write_backup(keep=keep)
+            except Exception as e:
+                print(f"Error writing scheduled backup: {e}")
+    thread = threading.Thread(target=loop, name="db-backup", daemon=True)
+    thread.start()
+    return thread
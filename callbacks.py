@@ -0,0 +1,97 @@
+import queue
+import threading
+from collections import OrderedDict
+
+# Immediate acknowledgement of callback queries. install() wraps the bot's
+# process_new_callback_query so every query is answered by an ack thread as
+# soon as it arrives, before its handler runs on the worker pool. The
+# client's spinner stops at once, however slow the handler is.
+#
+# Telegram takes one answer per query. Handlers whose answer carries text
+# (a toast or an alert) register their callback_data prefixes with
+# answers_itself(): they answer through answer(), and call finish() when
+# done so a path that had nothing to say still stops the spinner.
+
+ACK_THREADS = 2
+MAX_TRACKED = 10000
+
+_self_answering = set()
+_AWAITING = object()   # a self-answering query its handler hasn't answered yet
+_acks = OrderedDict()  # query id -> answer kwargs while queued, _AWAITING, or None once answered
+_lock = threading.Lock()
+_queue = queue.Queue()
+
+def answers_itself(*prefixes):
+    """
+    Skip the automatic ack for callback data starting with any of `prefixes`.
+    Their handlers answer the query with answer() and call finish() after.
+    """
+    _self_answering.update(prefixes)
+
+def _is_self_answering(call):
+    return (call.data or "").startswith(tuple(_self_answering))
+
+def _ack_worker(bot):
+    while True:
+        query_id = _queue.get()
+        with _lock:
+            kwargs = _acks.get(query_id) or {}
+            _acks[query_id] = None
+        try:
+            bot.answer_callback_query(query_id, **kwargs)
+        except Exception as e:
+            print(f"Error acknowledging callback query: {e}")
+
+def install(bot, threads=ACK_THREADS):
+    """
+    Acknowledge every incoming callback query before it is dispatched.
+    """
+    process = bot.process_new_callback_query
+
+    def acknowledge_first(callback_queries):
+        for call in callback_queries:
+            self_answering = _is_self_answering(call)
+            with _lock:
+                _acks[call.id] = _AWAITING if self_answering else {}
+                while len(_acks) > MAX_TRACKED:
+                    _acks.popitem(last=False)
+            if not self_answering:
+                _queue.put(call.id)
+        process(callback_queries)
+
+    bot.process_new_callback_query = acknowledge_first
+    for i in range(threads):
+        threading.Thread(target=_ack_worker, args=(bot,), name=f"callback-ack-{i}", daemon=True).start()
+
+def answer(bot, call, text=None, show_alert=False):
+    """
+    Answer a callback query from a handler. A query that was acknowledged
+    automatically gets `text` in its ack if that has not gone out yet, or as
+    a chat message if it has, so the user still sees it.
+    """
+    with _lock:
+        tracked = call.id in _acks
+        pending = _acks.get(call.id)
+        if pending is _AWAITING:
+            _acks[call.id] = None
+        elif pending is not None:
+            if text:
+                pending.update(text=text, show_alert=show_alert)
+            return
+    if not tracked or pending is _AWAITING:
+        bot.answer_callback_query(call.id, text, show_alert=show_alert)
+    elif text:
+        bot.send_message(call.message.chat.id, text)
+
+def finish(bot, call):
+    """
+    Answer a self-answering query without text if its handler didn't.
+    """
+    with _lock:
+        if _acks.get(call.id) is not _AWAITING:
+            return
+        _acks[call.id] = None
+    try:
+        bot.answer_callback_query(call.id)
+    except Exception as e:
+        print(f"Error acknowledging callback query: {e}")
@@ -0,0 +1,112 @@
+import threading
+from collections import OrderedDict
+import db
+
+# Queued claims for hot platforms. With the queue switched on for a platform
+# (admin stock screen), claims don't race each other for the DB: each one
+# joins a FIFO line and gets its position back, and a worker serves the line
+# in batches of up to BATCH_SIZE, one transaction per batch
+# (db.claim_batch). Admission is checked against the stock not yet promised
+# to someone in line, so once that runs out a claim is told it's sold out
+# straight away instead of waiting for nothing.
+
+BATCH_SIZE = 50
+
+# platform name -> (db.content_version("platforms") it was read at, queued),
+# so a claim doesn't read the config table just to learn which path to take.
+# A restore bumps every content version, which drops these.
+_flags = {}
+
+def is_queued(platform_name):
+    version = db.content_version("platforms")
+    cached = _flags.get(platform_name)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    queued = db.get_config_value(f"claim_queue:{platform_name}") == "on"
+    _flags[platform_name] = (version, queued)
+    return queued
+
+def set_queued(platform_name, enabled):
+    db.set_config_value(f"claim_queue:{platform_name}", "on" if enabled else "off")
+    _flags[platform_name] = (db.content_version("platforms"), enabled)
+
+class _Line:
+
+    def __init__(self, platform_name):
+        self.platform_name = platform_name
+        self.lock = threading.Lock()
+        self.waiting = OrderedDict()  # telegram id -> (count, on_done), oldest first
+        self.available = None  # stock not promised to anyone waiting; None until counted
+        self.version = None    # db.content_version("stock") it was counted at
+        self.working = False
+
+    def _waiting_count(self):
+        return sum(count for count, _ in self.waiting.values())
+
+    def submit(self, telegram_id, count, on_done):
+        with self.lock:
+            if telegram_id in self.waiting:
+                position = list(self.waiting).index(telegram_id) + 1
+                return None, f"You're already in line (#{position})."
+            version = db.content_version("stock")
+            if self.available is None or self.version != version:
+                self.available = db.get_stock_count(self.platform_name) - self._waiting_count()
+                self.version = version
+            if self.available < count:
+                if self.available > 0:
+                    return None, f"Only {self.available} accounts left."
+                return None, "❌ Sold out."
+            self.available -= count
+            self.waiting[telegram_id] = (count, on_done)
+            position = len(self.waiting)
+            start = not self.working
+            self.working = True
+        if start:
+            threading.Thread(target=self._work, name=f"claimqueue-{self.platform_name}", daemon=True).start()
+        return position, None
+
+    def _work(self):
+        while True:
+            with self.lock:
+                if not self.waiting:
+                    self.working = False
+                    return
+                batch = [self.waiting.popitem(last=False) for _ in range(min(BATCH_SIZE, len(self.waiting)))]
+            try:
+                results = db.claim_batch(self.platform_name, [(telegram_id, count) for telegram_id, (count, _) in batch])
+            except Exception as e:
+                print(f"Error serving claim queue for {self.platform_name}: {e}")
+                results = [(None, "Something went wrong, please try again.")] * len(batch)
+            try:
+                stock = db.get_stock_count(self.platform_name)
+            except Exception as e:
+                print(f"Error counting stock for {self.platform_name}: {e}")
+                stock = None
+            with self.lock:
+                # Recount rather than adding failed requests back, so the
+                # admission count can't drift from the real stock.
+                self.available = None if stock is None else stock - self._waiting_count()
+            threading.Thread(target=_deliver, args=(batch, results), daemon=True).start()
+
+def _deliver(batch, results):
+    for (telegram_id, (count, on_done)), (accounts, result) in zip(batch, results):
+        try:
+            on_done(accounts, result)
+        except Exception as e:
+            print(f"Error delivering queued claim for {telegram_id}: {e}")
+
+_lines = {}
+_lock = threading.Lock()
+
+def submit(telegram_id, platform_name, count, on_done):
+    """
+    Put a claim for `count` items in the platform's line. on_done(accounts,
+    result) is called from another thread once it has been served, with the
+    same results as reservoir.claim. Returns (position, None), or
+    (None, error_message) if it was turned away.
+    """
+    line = _lines.get(platform_name)
+    if line is None:
+        with _lock:
+            line = _lines.setdefault(platform_name, _Line(platform_name))
+    return line.submit(telegram_id, count, on_done)
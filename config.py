@@ -14,3 +14,7 @@ LOGS_CHANNEL = "@ShadowBotLogs"
 
 DEFAULT_ACCOUNT_CLAIM_COST = 2 
 DEFAULT_REFERRAL_BONUS = 4    
+
+# Seconds between refreshes of the in-memory copy used by stale-tolerant
+# reports (dashboard, key list); 0 reads them from bot.db directly.
+READ_REPLICA_INTERVAL = 0
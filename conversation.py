@@ -0,0 +1,72 @@
+import threading
+import time
+import db
+
+# Replaces bot.register_next_step_handler. A prompt stores the name of the
+# state that should receive the chat's next message, plus any JSON-able data
+# the handler needs, in the conversation_states table. States survive
+# restarts, and flows that are abandoned expire instead of piling up in memory.
+
+DEFAULT_TTL = 600  # seconds a prompt waits for its answer
+
+# Message types a prompt can be answered with (reports and stock uploads take files).
+CONTENT_TYPES = ["text", "photo", "document", "video", "audio", "voice", "sticker"]
+
+_handlers = {}
+
+def handler(name):
+    """
+    Register the decorated function as the handler for state `name`.
+    It is called as fn(bot, message, **data).
+    """
+    def register(fn):
+        if name in _handlers:
+            raise ValueError(f"Conversation state '{name}' is already registered.")
+        _handlers[name] = fn
+        return fn
+    return register
+
+def expect(msg, name, ttl=DEFAULT_TTL, **data):
+    """
+    Send the next message in msg's chat to the handler for state `name`.
+    """
+    if name not in _handlers:
+        raise KeyError(f"Unknown conversation state: {name}")
+    db.set_conversation_state(str(msg.chat.id), name, data, time.time() + ttl)
+
+def cancel(chat_id):
+    db.clear_conversation_state(str(chat_id))
+
+def is_waiting(message):
+    return db.has_conversation_state(str(message.chat.id))
+
+def dispatch(bot, message):
+    """
+    Hand the message to the handler of its chat's pending state.
+    Returns False if the chat had no (unexpired) state.
+    """
+    pending = db.pop_conversation_state(str(message.chat.id))
+    if pending is None:
+        return False
+    name, data = pending
+    fn = _handlers.get(name)
+    if fn is None:
+        print(f"No handler registered for conversation state '{name}'.")
+        return False
+    fn(bot, message, **data)
+    return True
+
+def start_state_expiry(interval=600):
+    """
+    Delete expired states every `interval` seconds in a daemon thread.
+    """
+    def loop():
+        while True:
+            time.sleep(interval)
+            try:
+                db.delete_expired_conversation_states()
+            except Exception as e:
+                print(f"Error expiring conversation states: {e}")
+    thread = threading.Thread(target=loop, name="conversation-expiry", daemon=True)
+    thread.start()
+    return thread
@@ -1,7 +1,16 @@
 import sqlite3
 import os
+import atexit
+import queue
+import threading
+import time
 from datetime import datetime
 import json
+import hashlib
+import zlib
+from collections import Counter
+from pathlib import Path
+import telebot
 import config
 from handlers.logs import log_event
 
@@ -12,10 +21,127 @@ def get_connection():
     con.row_factory = sqlite3.Row
     return con
 
-def init_db():
-    conn = get_connection()
-    c = conn.cursor()
-    # Create users table
+# ----------------- READ-ONLY CONNECTIONS -----------------
+# Reporting queries (leaderboards, user and key listings, dashboard) use these.
+# With the DB in WAL mode a reader never blocks the claim and redeem writers,
+# and a read-only connection can't take a write lock by accident.
+
+_replica_uri = None     # set while start_read_replica() is running
+_replica_holder = None  # keeps the current in-memory replica alive
+_retired_holder = None  # the one before, kept for a reader that picked up its URI late
+
+def get_read_connection(stale_ok=False):
+    """
+    Read-only connection to bot.db. With stale_ok, reads may come from the
+    in-memory replica instead, which lags by up to its refresh interval.
+    """
+    uri = _replica_uri if stale_ok and _replica_uri else f"{Path(DATABASE).resolve().as_uri()}?mode=ro"
+    con = sqlite3.connect(uri, uri=True)
+    con.row_factory = sqlite3.Row
+    return con
+
+def refresh_read_replica():
+    """
+    Copy bot.db into a fresh shared in-memory DB and point stale_ok readers
+    at it. The previous copy is kept until the next refresh, so a reader that
+    read the old URI just before the swap still finds it; after that it is
+    freed once its last reader closes.
+    """
+    global _replica_uri, _replica_holder, _retired_holder
+    uri = f"file:bot-replica-{time.monotonic_ns()}?mode=memory&cache=shared"
+    holder = sqlite3.connect(uri, uri=True, check_same_thread=False)
+    src = sqlite3.connect(DATABASE)
+    try:
+        # In one step: see backup.snapshot.
+        src.backup(holder)
+    finally:
+        src.close()
+    old, _retired_holder, _replica_holder = _retired_holder, _replica_holder, holder
+    _replica_uri = uri
+    if old is not None:
+        old.close()
+
+def start_read_replica(interval=60):
+    """
+    Build the in-memory replica now and refresh it every `interval` seconds
+    in a daemon thread.
+    """
+    refresh_read_replica()
+    def loop():
+        while True:
+            time.sleep(interval)
+            try:
+                refresh_read_replica()
+            except Exception as e:
+                print(f"Error refreshing read replica: {e}")
+    thread = threading.Thread(target=loop, name="read-replica", daemon=True)
+    thread.start()
+    return thread
+
+# ----------------- RECORD TYPES -----------------
+
+class Record:
+    """
+    Base for the row types below. Columns are slot attributes, and records
+    also answer record["column"] and record.get("column") like the dicts they
+    replace. Columns a projected query didn't select are simply unset.
+    """
+    __slots__ = ()
+
+    def __getitem__(self, name):
+        try:
+            return getattr(self, name)
+        except AttributeError:
+            raise KeyError(name) from None
+
+    def get(self, name, default=None):
+        return getattr(self, name, default)
+
+    def keys(self):
+        return [name for name in self.__slots__ if hasattr(self, name)]
+
+    def __eq__(self, other):
+        return type(self) is type(other) and dict(self) == dict(other)
+
+    __hash__ = None
+
+    def __repr__(self):
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.keys())
+        return f"{type(self).__name__}({fields})"
+
+class User(Record):
+    __slots__ = ("telegram_id", "username", "join_date", "points", "referrals", "banned", "pending_referrer", "verified")
+
+class Platform(Record):
+    __slots__ = ("platform_name", "stock", "price", "platform_type", "stock_count")
+
+class Key(Record):
+    __slots__ = ("key", "type", "points", "claimed", "claimed_by", "timestamp")
+
+class Admin(Record):
+    __slots__ = ("user_id", "username", "role", "banned")
+
+class Report(Record):
+    __slots__ = ("id", "user_id", "chat_id", "text", "media_type", "file_id", "status",
+                 "claimed_by", "created_at", "claimed_at", "closed_at")
+
+def _row_factory(cls):
+    """
+    Connection.row_factory that builds `cls` records from the selected columns.
+    """
+    def factory(cursor, row):
+        record = cls.__new__(cls)
+        for column, value in zip(cursor.description, row):
+            setattr(record, column[0], value)
+        return record
+    return factory
+
+# ----------------- SCHEMA MIGRATIONS -----------------
+# The schema version lives in PRAGMA user_version. Each migration brings the
+# DB from version - 1 to version; append new ones, never edit shipped ones.
+# They must also cope with DBs created before versioning (user_version 0).
+
+def _migration_base_schema(c):
     c.execute('''
     CREATE TABLE IF NOT EXISTS users (
         telegram_id TEXT PRIMARY KEY,
@@ -28,7 +154,6 @@ def init_db():
         verified INTEGER DEFAULT 0
     )
     ''')
-    # Create referrals table
     c.execute('''
         CREATE TABLE IF NOT EXISTS referrals (
             user_id TEXT,
@@ -36,7 +161,6 @@ def init_db():
             PRIMARY KEY (user_id, referred_id)
         )
     ''')
-    # Create platforms table with the new column in the schema.
     c.execute(f'''
         CREATE TABLE IF NOT EXISTS platforms (
             platform_name TEXT PRIMARY KEY,
@@ -45,7 +169,6 @@ def init_db():
             platform_type TEXT DEFAULT 'account'
         )
     ''')
-    # Create other tables...
     c.execute('''
         CREATE TABLE IF NOT EXISTS reviews (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -92,37 +215,266 @@ def init_db():
             config_value TEXT
         )
     ''')
-    conn.commit()
-    c.close()
-    conn.close()
-    migrate_db()
+    # DB files from before these columns existed.
+    c.execute("PRAGMA table_info(platforms)")
+    if 'platform_type' not in [col[1] for col in c.fetchall()]:
+        c.execute("ALTER TABLE platforms ADD COLUMN platform_type TEXT DEFAULT 'account'")
+    c.execute("PRAGMA table_info(users)")
+    if 'verified' not in [col[1] for col in c.fetchall()]:
+        c.execute("ALTER TABLE users ADD COLUMN verified INTEGER DEFAULT 0")
+
+def _migration_points_ledger(c):
+    # Append-only history of every points change; users.points is a cached sum of it.
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS points_ledger (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT NOT NULL,
+            delta INTEGER NOT NULL,
+            reason TEXT NOT NULL,
+            ref TEXT,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_points_ledger_user ON points_ledger (user_id, id)")
+    # Seed the ledger with each user's current balance, so the ledger totals
+    # match users.points from the start.
+    c.execute("SELECT 1 FROM points_ledger LIMIT 1")
+    if not c.fetchone():
+        c.execute("""
+            INSERT INTO points_ledger (user_id, delta, reason, ref, timestamp)
+            SELECT telegram_id, points, 'opening', NULL, ? FROM users
+        """, (datetime.now(),))
+
+def _migration_leaderboard_indexes(c):
+    # Serves the leaderboards straight from the index instead of sorting users.
+    c.execute("CREATE INDEX IF NOT EXISTS idx_users_points ON users (points)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_users_referrals ON users (referrals)")
+
+def _migration_unique_referrals(c):
+    # A user can only ever be referred once; enforce it and let add_referral()
+    # look the referred user up by index. Older DBs may hold duplicates, so keep
+    # the first referral for each referred user before creating the index.
+    c.execute("""
+        DELETE FROM referrals WHERE rowid NOT IN
+            (SELECT MIN(rowid) FROM referrals GROUP BY referred_id)
+    """)
+    c.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_referrals_referred ON referrals (referred_id)")
+
+def _migration_lookup_indexes(c):
+    # Partial indexes keep the banned-user and outstanding-key lookups off the full tables.
+    c.execute("CREATE INDEX IF NOT EXISTS idx_users_banned ON users (telegram_id) WHERE banned = 1")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_keys_unclaimed ON keys (type) WHERE claimed = 0")
+    # Case-insensitive username prefix search in the admin user browser.
+    c.execute("CREATE INDEX IF NOT EXISTS idx_users_username ON users (username COLLATE NOCASE)")
+
+def _migration_stats_counters(c):
+    # Single-row totals for the admin dashboard, updated in the same transactions
+    # as the rows they count. Rebuild with rebuild_stats_counters() if they drift.
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS stats_counters (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            total_users INTEGER DEFAULT 0,
+            banned_users INTEGER DEFAULT 0,
+            total_points INTEGER DEFAULT 0,
+            total_claims INTEGER DEFAULT 0,
+            total_stock INTEGER DEFAULT 0,
+            keys_outstanding INTEGER DEFAULT 0
+        )
+    ''')
+    _write_stats_counters(c)
+
+def _migration_conversation_states(c):
+    # Pending next-step prompts (see conversation.py), one per chat.
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS conversation_states (
+            chat_id TEXT PRIMARY KEY,
+            state TEXT NOT NULL,
+            data TEXT,
+            expires_at REAL NOT NULL
+        )
+    ''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_conversation_states_expires ON conversation_states (expires_at)")
+
+def _migration_reports(c):
+    # User reports as tickets. status is 'open', 'claimed' or 'closed'; a claim
+    # is one conditional UPDATE, so only one owner can win it.
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS reports (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT NOT NULL,
+            chat_id TEXT NOT NULL,
+            text TEXT,
+            media_type TEXT,
+            file_id TEXT,
+            status TEXT NOT NULL DEFAULT 'open',
+            claimed_by TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            claimed_at DATETIME,
+            closed_at DATETIME
+        )
+    ''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_reports_status ON reports (status, id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_reports_claimed_by ON reports (claimed_by, status, id)")
+    # Which report a bot message in an owner's chat belongs to, so replies to
+    # it can be routed without parsing the message text.
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS report_messages (
+            chat_id TEXT NOT NULL,
+            message_id INTEGER NOT NULL,
+            report_id INTEGER NOT NULL,
+            PRIMARY KEY (chat_id, message_id)
+        ) WITHOUT ROWID
+    ''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_report_messages_report ON report_messages (report_id)")
+
+def _migration_cookie_blobs(c):
+    # Cookie files live here, zlib-compressed and keyed by the sha256 of their
+    # contents; stock items only hold {"type": "cookie", "blob": <hash>}.
+    # refs counts the stock items pointing at a blob, so identical uploads
+    # share one row and the row goes away with the last of them.
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS cookie_blobs (
+            hash TEXT PRIMARY KEY,
+            data BLOB NOT NULL,
+            size INTEGER NOT NULL,
+            refs INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    c.execute("SELECT platform_name, stock FROM platforms")
+    for platform_name, stock_json in c.fetchall():
+        stock = json.loads(stock_json or "[]")
+        if not any(_is_inline_cookie(item) for item in stock):
+            continue
+        for i, item in enumerate(stock):
+            if _is_inline_cookie(item):
+                stock[i] = {"type": "cookie", "blob": _store_cookie_blob(c, item["content"].encode("utf-8"))}
+        c.execute("UPDATE platforms SET stock = ? WHERE platform_name = ?", (json.dumps(stock), platform_name))
+
+def _migration_stock_items(c):
+    # One row per stock item instead of a JSON array on the platform row, so a
+    # claim deletes just the items it takes. item holds the JSON of the old
+    # array entry (a login string or a cookie blob reference); platforms.stock
+    # is no longer used.
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS stock_items (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            platform_name TEXT NOT NULL,
+            item TEXT NOT NULL
+        )
+    ''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_stock_items_platform ON stock_items (platform_name, id)")
+    c.execute("SELECT platform_name, stock FROM platforms")
+    for platform_name, stock_json in c.fetchall():
+        c.executemany("INSERT INTO stock_items (platform_name, item) VALUES (?, ?)",
+                      [(platform_name, json.dumps(item)) for item in json.loads(stock_json or "[]")])
+    c.execute("UPDATE platforms SET stock = NULL")
+    # Recount, now that total_stock comes from stock_items.
+    _write_stats_counters(c)
+
+def _migration_claims(c):
+    # One row per claimed item, written in the claim transaction. item is the
+    # stock item as it was (a login string or cookie blob reference) and
+    # claimed_at is unix seconds. The index covers the "My Claims" and admin
+    # refund lists, newest first. Older claims only exist in points_ledger.
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS claims (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT NOT NULL,
+            platform_name TEXT NOT NULL,
+            item TEXT NOT NULL,
+            price INTEGER NOT NULL,
+            claimed_at INTEGER NOT NULL,
+            refunded INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_claims_user_time "
+              "ON claims (user_id, claimed_at, id, platform_name, price, refunded, item)")
 
-def migrate_db():
+MIGRATIONS = [
+    (1, "base tables", _migration_base_schema),
+    (2, "points ledger", _migration_points_ledger),
+    (3, "leaderboard indexes", _migration_leaderboard_indexes),
+    (4, "unique referred user", _migration_unique_referrals),
+    (5, "banned, unclaimed key and username indexes", _migration_lookup_indexes),
+    (6, "dashboard stats counters", _migration_stats_counters),
+    (7, "conversation states", _migration_conversation_states),
+    (8, "reports", _migration_reports),
+    (9, "compressed cookie blobs", _migration_cookie_blobs),
+    (10, "one row per stock item", _migration_stock_items),
+    (11, "claim history", _migration_claims),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+def get_schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def migrate_db(dry_run=False):
     """
-    Check if the 'platforms' table has the 'platform_type' column.
-    If not, add it via an ALTER TABLE command.
+    Bring the DB up to SCHEMA_VERSION. All pending migrations run in one
+    transaction, so a failure leaves the DB at its old version.
+    Returns the (version, description) pairs applied, or just listed when dry_run.
     """
-    conn = get_connection()
+    conn = sqlite3.connect(DATABASE, isolation_level=None)
+    conn.row_factory = sqlite3.Row
     c = conn.cursor()
-    c.execute("PRAGMA table_info(platforms)")
-    columns = [col[1] for col in c.fetchall()]
-    if 'platform_type' not in columns:
-        c.execute("ALTER TABLE platforms ADD COLUMN platform_type TEXT DEFAULT 'account'")
-        conn.commit()
-    c.close()
-    conn.close()
+    try:
+        version = get_schema_version(conn)
+        if version > SCHEMA_VERSION:
+            raise RuntimeError(f"Database schema version {version} is newer than this bot supports ({SCHEMA_VERSION}).")
+        pending = [m for m in MIGRATIONS if m[0] > version]
+        if not pending or dry_run:
+            return [(v, description) for v, description, _ in pending]
+        c.execute("BEGIN IMMEDIATE")
+        # Another process may have migrated while we waited for the lock.
+        version = get_schema_version(conn)
+        pending = [m for m in MIGRATIONS if m[0] > version]
+        try:
+            for v, description, migration in pending:
+                migration(c)
+            c.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            c.execute("COMMIT")
+        except Exception:
+            c.execute("ROLLBACK")
+            raise
+        return [(v, description) for v, description, _ in pending]
+    finally:
+        c.close()
+        conn.close()
 
-def add_verified_column():
+def init_db():
+    """
+    Create or upgrade the schema and make sure the DB is in WAL mode.
+    On a current DB this is two PRAGMAs and no DDL.
+    """
+    for version, description in migrate_db():
+        print(f"Applied DB migration {version}: {description}")
+    # Stored in the file, so this is a no-op after the first run; it also
+    # covers DBs restored from a non-WAL copy.
     conn = get_connection()
-    c = conn.cursor()
-    c.execute("PRAGMA table_info(users)")
-    columns = [column[1] for column in c.fetchall()]
-    if 'verified' not in columns:
-        c.execute("ALTER TABLE users ADD COLUMN verified INTEGER DEFAULT 0")
-        conn.commit()
-    c.close()
+    conn.execute("PRAGMA journal_mode=WAL")
     conn.close()
 
+def check_db_file(path):
+    """
+    Check that `path` is a bot DB this code can open, e.g. before restoring it.
+    Returns (ok, message). Older versions are fine; they are migrated on start.
+    """
+    try:
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            version = get_schema_version(conn)
+            has_users = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'users'").fetchone()
+        finally:
+            conn.close()
+    except sqlite3.DatabaseError as e:
+        return False, f"Not a valid database file: {e}"
+    if version > SCHEMA_VERSION:
+        return False, f"Schema version {version} is newer than supported ({SCHEMA_VERSION})."
+    if not has_users:
+        return False, "Database has no users table."
+    return True, f"Schema version {version} (current {SCHEMA_VERSION})."
+
 def update_user_verified(telegram_id):
     conn = get_connection()
     c = conn.cursor()
@@ -139,10 +491,12 @@ def set_config_value(key, value):
     c.close()
     conn.close()
 
+_GET_CONFIG_VALUE_SQL = "SELECT config_value FROM configurations WHERE config_key = ?"
+
 def get_config_value(key):
     conn = get_connection()
     c = conn.cursor()
-    c.execute("SELECT config_value FROM configurations WHERE config_key = ?", (key,))
+    c.execute(_GET_CONFIG_VALUE_SQL, (key,))
     row = c.fetchone()
     c.close()
     conn.close()
@@ -150,6 +504,7 @@ def get_config_value(key):
 
 def set_account_claim_cost(cost):
     set_config_value("account_claim_cost", cost)
+    bump_content_version("platforms")  # the rewards menu shows the default price
 
 def get_account_claim_cost():
     cost = get_config_value("account_claim_cost")
@@ -162,68 +517,354 @@ def get_referral_bonus():
     bonus = get_config_value("referral_bonus")
     return int(bonus) if bonus is not None else config.DEFAULT_REFERRAL_BONUS
 
+_GET_USER_SQL = "SELECT * FROM users WHERE telegram_id = ?"
+
 def add_user(telegram_id, username, join_date, pending_referrer=None):
     conn = get_connection()
     c = conn.cursor()
-    c.execute("SELECT * FROM users WHERE telegram_id = ?", (telegram_id,))
+    c.execute(_GET_USER_SQL, (telegram_id,))
     user = c.fetchone()
+    created = None
     if not user:
         c.execute("""
             INSERT INTO users (telegram_id, username, join_date, pending_referrer)
             VALUES (?, ?, ?, ?)
         """, (telegram_id, username, join_date, pending_referrer))
-        conn.commit()
+        # Record the starting balance so the ledger sums to users.points.
+        c.execute("""
+            INSERT INTO points_ledger (user_id, delta, reason, ref, timestamp)
+            SELECT telegram_id, points, 'signup', NULL, ? FROM users WHERE telegram_id = ?
+        """, (datetime.now(), telegram_id))
+        c.execute("SELECT points, referrals FROM users WHERE telegram_id = ?", (telegram_id,))
+        created = c.fetchone()
+        _bump_stats(c, total_users=1, total_points=created[0])
+        _commit_score_changes(conn,
+                              points=[(telegram_id, username, None, created[0])],
+                              referrals=[(telegram_id, username, None, created[1])])
+        bump_content_version("users")
     c.close()
     conn.close()
     return get_user(telegram_id)
 
 def get_user(telegram_id):
     conn = get_connection()
-    conn.row_factory = sqlite3.Row
+    conn.row_factory = _row_factory(User)
     c = conn.cursor()
-    c.execute("SELECT * FROM users WHERE telegram_id = ?", (telegram_id,))
+    c.execute(_GET_USER_SQL, (telegram_id,))
     user = c.fetchone()
     c.close()
     conn.close()
-    return dict(user) if user else None
+    return user
+
+_IS_USER_BANNED_SQL = "SELECT banned FROM users WHERE telegram_id = ?"
 
-def update_user_points(telegram_id, new_points):
+def is_user_banned(telegram_id):
     conn = get_connection()
     c = conn.cursor()
-    c.execute("UPDATE users SET points = ? WHERE telegram_id = ?", (new_points, telegram_id))
-    conn.commit()
+    c.execute(_IS_USER_BANNED_SQL, (telegram_id,))
+    row = c.fetchone()
+    c.close()
+    conn.close()
+    return bool(row and row[0])
+
+_USERS_PAGE_SQL = ("SELECT telegram_id, username, banned FROM users "
+                   "WHERE telegram_id > ? ORDER BY telegram_id LIMIT ?")
+_USERS_PAGE_BACK_SQL = ("SELECT telegram_id, username, banned FROM users "
+                        "WHERE telegram_id < ? ORDER BY telegram_id DESC LIMIT ?")
+
+def get_users_page(after_id=None, before_id=None, limit=10):
+    """
+    Keyset-paginated user list ordered by telegram_id. Pass the last id of
+    the current page as after_id for the next page, or its first id as
+    before_id for the previous one. Each page costs O(limit) via the primary key.
+    Returns (users, has_prev, has_next).
+    """
+    conn = get_read_connection()
+    conn.row_factory = _row_factory(User)
+    c = conn.cursor()
+    if before_id is not None:
+        c.execute(_USERS_PAGE_BACK_SQL, (before_id, limit + 1))
+        rows = c.fetchall()
+        has_prev, has_next = len(rows) > limit, True
+        rows = list(reversed(rows[:limit]))
+    else:
+        c.execute(_USERS_PAGE_SQL, (after_id or "", limit + 1))
+        rows = c.fetchall()
+        has_prev, has_next = after_id is not None, len(rows) > limit
+        rows = rows[:limit]
     c.close()
     conn.close()
+    return rows, has_prev, has_next
+
+def _prefix_upper_bound(prefix):
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+_SEARCH_USER_ID_SQL = ("SELECT telegram_id, username, banned FROM users "
+                       "WHERE telegram_id >= ? AND telegram_id < ? ORDER BY telegram_id LIMIT ?")
+_SEARCH_USERNAME_SQL = ("SELECT telegram_id, username, banned FROM users "
+                        "WHERE username COLLATE NOCASE >= ? AND username COLLATE NOCASE < ? "
+                        "ORDER BY username COLLATE NOCASE LIMIT ?")
+
+def search_users(query, limit=10):
+    """
+    Find users whose ID or username starts with `query` (case-insensitive for
+    usernames). Both lookups are index range scans on the prefix.
+    """
+    query = query.strip().lstrip("@")
+    if not query:
+        return []
+    conn = get_read_connection()
+    conn.row_factory = _row_factory(User)
+    c = conn.cursor()
+    results = []
+    if query.isdigit():
+        c.execute(_SEARCH_USER_ID_SQL, (query, _prefix_upper_bound(query), limit))
+        results.extend(c.fetchall())
+    lowered = query.lower()
+    c.execute(_SEARCH_USERNAME_SQL, (lowered, _prefix_upper_bound(lowered), limit))
+    seen = {r["telegram_id"] for r in results}
+    results.extend(r for r in c.fetchall() if r["telegram_id"] not in seen)
+    c.close()
+    conn.close()
+    return results[:limit]
+
+# ----------------- POINTS LEDGER -----------------
+
+LEDGER_REASONS = ("opening", "signup", "claim", "key", "referral", "lend", "refund", "adjust")
+
+# Callables notified after a score change is committed, used to keep the
+# in-memory leaderboards current without re-querying the users table.
+_score_listeners = []
+# Held while committing + publishing score changes and while get_sorted_scores()
+# opens its snapshot, so a change is either in a snapshot or published after it.
+_score_lock = threading.Lock()
+
+def add_score_listener(listener):
+    """
+    Register listener(board, telegram_id, username, old_score, new_score).
+    board is the users column that changed; old_score is None for new users.
+    """
+    _score_listeners.append(listener)
+
+def _commit_score_changes(conn, **boards):
+    """
+    Commit conn and notify the listeners of its score changes, e.g.
+    _commit_score_changes(conn, points=[change]). Falsy changes are skipped.
+    """
+    with _score_lock:
+        conn.commit()
+        for board, changes in boards.items():
+            for change in changes:
+                if not change:
+                    continue
+                for listener in _score_listeners:
+                    try:
+                        listener(board, *change)
+                    except Exception as e:
+                        print(f"Error in score listener: {e}")
+
+_POINTS_DELTA_SQL = "UPDATE users SET points = points + ? WHERE telegram_id = ?"
+_POINTS_DELTA_MIN_SQL = "UPDATE users SET points = points + ? WHERE telegram_id = ? AND points + ? >= ?"
+
+def _apply_points_delta(c, telegram_id, delta, reason, ref=None, min_balance=None):
+    """
+    Apply a signed points delta on an open cursor and record it in the ledger.
+    The caller owns the transaction. If min_balance is given, the update only
+    happens when the resulting balance stays at or above it.
+    Returns (telegram_id, username, old_points, new_points) if the balance
+    was changed, otherwise None. Commit with _commit_score_changes() so the
+    change reaches the leaderboards.
+    """
+    if reason not in LEDGER_REASONS:
+        raise ValueError(f"Unknown ledger reason: {reason}")
+    if min_balance is None:
+        c.execute(_POINTS_DELTA_SQL, (delta, telegram_id))
+    else:
+        c.execute(_POINTS_DELTA_MIN_SQL, (delta, telegram_id, delta, min_balance))
+    if c.rowcount == 0:
+        return None
+    c.execute("INSERT INTO points_ledger (user_id, delta, reason, ref, timestamp) VALUES (?, ?, ?, ?, ?)",
+              (telegram_id, delta, reason, None if ref is None else str(ref), datetime.now()))
+    _bump_stats(c, total_points=delta)
+    c.execute("SELECT username, points FROM users WHERE telegram_id = ?", (telegram_id,))
+    username, new_points = c.fetchone()
+    return (telegram_id, username, new_points - delta, new_points)
+
+def change_user_points(telegram_id, delta, reason, ref=None, min_balance=None):
+    """
+    Add (or subtract) points for a user and write the matching ledger entry
+    in the same transaction. Returns the new balance, or None if the user
+    doesn't exist or the balance would drop below min_balance.
+    """
+    conn = get_connection()
+    c = conn.cursor()
+    change = _apply_points_delta(c, telegram_id, delta, reason, ref, min_balance)
+    if not change:
+        conn.rollback()
+        c.close()
+        conn.close()
+        return None
+    _commit_score_changes(conn, points=[change])
+    c.close()
+    conn.close()
+    return change[3]
+
+_POINTS_HISTORY_SQL = ("SELECT id, delta, reason, ref, timestamp FROM points_ledger "
+                       "WHERE user_id = ? ORDER BY id DESC LIMIT ?")
+_POINTS_HISTORY_BACK_SQL = ("SELECT id, delta, reason, ref, timestamp FROM points_ledger "
+                            "WHERE user_id = ? AND id < ? ORDER BY id DESC LIMIT ?")
+
+def get_points_history(telegram_id, limit=10, before_id=None):
+    """
+    Return the user's most recent ledger entries, newest first.
+    Pass the smallest id of the previous page as before_id to page back.
+    """
+    conn = get_read_connection()
+    c = conn.cursor()
+    if before_id is None:
+        c.execute(_POINTS_HISTORY_SQL, (telegram_id, limit))
+    else:
+        c.execute(_POINTS_HISTORY_BACK_SQL, (telegram_id, before_id, limit))
+    rows = c.fetchall()
+    c.close()
+    conn.close()
+    return [dict(r) for r in rows]
+
+def reconcile_points_ledger():
+    """
+    Compare every cached users.points balance with its ledger total and
+    rewrite the ones that drifted. The ledger is the source of truth.
+    Returns a list of (telegram_id, cached, ledger_total) for corrected users.
+    The full comparison runs on a read connection; the write lock is only
+    taken to re-check and fix the users it flagged.
+    """
+    conn = get_read_connection()
+    c = conn.cursor()
+    c.execute("""
+        SELECT u.telegram_id
+        FROM users u
+        LEFT JOIN (SELECT user_id, SUM(delta) AS total FROM points_ledger GROUP BY user_id) l
+            ON l.user_id = u.telegram_id
+        WHERE u.points != COALESCE(l.total, 0)
+    """)
+    suspects = [row[0] for row in c.fetchall()]
+    c.close()
+    conn.close()
+    if not suspects:
+        return []
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute("BEGIN IMMEDIATE")
+    rows = []
+    for telegram_id in suspects:
+        # A points change may have landed since the scan.
+        c.execute("SELECT points, username FROM users WHERE telegram_id = ?", (telegram_id,))
+        user = c.fetchone()
+        if user is None:
+            continue
+        c.execute("SELECT COALESCE(SUM(delta), 0) FROM points_ledger WHERE user_id = ?", (telegram_id,))
+        total = c.fetchone()[0]
+        if user[0] != total:
+            c.execute("UPDATE users SET points = ? WHERE telegram_id = ?", (total, telegram_id))
+            rows.append((telegram_id, user[0], total, user[1]))
+    _bump_stats(c, total_points=sum(r[2] - r[1] for r in rows))
+    _commit_score_changes(conn, points=[(r[0], r[3], r[1], r[2]) for r in rows])
+    c.close()
+    conn.close()
+    return [(r[0], r[1], r[2]) for r in rows]
+
+def start_ledger_reconciler(interval=3600):
+    """
+    Run reconcile_points_ledger() every `interval` seconds in a daemon thread.
+    """
+    def loop():
+        while True:
+            time.sleep(interval)
+            try:
+                drifted = reconcile_points_ledger()
+                if drifted:
+                    details = ", ".join(f"{uid}: {old} -> {new}" for uid, old, new in drifted[:20])
+                    log_event(telebot.TeleBot(config.TOKEN), "ledger",
+                              f"Reconciled {len(drifted)} drifted balance(s). {details}")
+            except Exception as e:
+                print(f"Error reconciling points ledger: {e}")
+    thread = threading.Thread(target=loop, name="ledger-reconciler", daemon=True)
+    thread.start()
+    return thread
 
 def ban_user(telegram_id):
     conn = get_connection()
     c = conn.cursor()
-    c.execute("UPDATE users SET banned = 1 WHERE telegram_id = ?", (telegram_id,))
+    c.execute("UPDATE users SET banned = 1 WHERE telegram_id = ? AND banned = 0", (telegram_id,))
+    changed = c.rowcount
+    if changed:
+        _bump_stats(c, banned_users=1)
     conn.commit()
     c.close()
     conn.close()
+    if changed:
+        bump_content_version("users")
 
 def unban_user(telegram_id):
     conn = get_connection()
     c = conn.cursor()
-    c.execute("UPDATE users SET banned = 0 WHERE telegram_id = ?", (telegram_id,))
+    c.execute("UPDATE users SET banned = 0 WHERE telegram_id = ? AND banned = 1", (telegram_id,))
+    changed = c.rowcount
+    if changed:
+        _bump_stats(c, banned_users=-1)
     conn.commit()
     c.close()
     conn.close()
+    if changed:
+        bump_content_version("users")
+
+_ADD_REFERRAL_SQL = "INSERT OR IGNORE INTO referrals (user_id, referred_id) VALUES (?, ?)"
 
 def add_referral(referrer_id, referred_id):
+    bonus = get_referral_bonus()
     conn = get_connection()
     c = conn.cursor()
-    c.execute("SELECT * FROM referrals WHERE referred_id = ?", (referred_id,))
-    if not c.fetchone():
-        c.execute("INSERT INTO referrals (user_id, referred_id) VALUES (?, ?)", (referrer_id, referred_id))
-        conn.commit()
-        bonus = get_referral_bonus()
-        c.execute("UPDATE users SET points = points + ?, referrals = referrals + 1 WHERE telegram_id = ?", (bonus, referrer_id))
-        conn.commit()
+    c.execute("BEGIN IMMEDIATE")
+    # idx_referrals_referred makes this a no-op if the user was already referred.
+    c.execute(_ADD_REFERRAL_SQL, (referrer_id, referred_id))
+    change = None
+    referral_change = None
+    if c.rowcount:
+        c.execute("UPDATE users SET referrals = referrals + 1 WHERE telegram_id = ?", (referrer_id,))
+        change = _apply_points_delta(c, referrer_id, bonus, "referral", ref=referred_id)
+        if change:
+            c.execute("SELECT referrals FROM users WHERE telegram_id = ?", (referrer_id,))
+            referrals = c.fetchone()[0]
+            referral_change = (referrer_id, change[1], referrals - 1, referrals)
+    _commit_score_changes(conn, points=[change], referrals=[referral_change])
     c.close()
     conn.close()
 
+def repair_referral_counters():
+    """
+    Recompute every users.referrals counter from the referrals table and fix
+    the ones that drifted. Meant to be run offline (python db.py repair-referrals)
+    or from a maintenance job.
+    Returns a list of (telegram_id, cached, actual) for corrected users.
+    """
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute("BEGIN IMMEDIATE")
+    c.execute("""
+        SELECT u.telegram_id, u.referrals, COALESCE(r.total, 0), u.username
+        FROM users u
+        LEFT JOIN (SELECT user_id, COUNT(*) AS total FROM referrals GROUP BY user_id) r
+            ON r.user_id = u.telegram_id
+        WHERE u.referrals != COALESCE(r.total, 0)
+    """)
+    rows = c.fetchall()
+    for row in rows:
+        c.execute("UPDATE users SET referrals = ? WHERE telegram_id = ?", (row[2], row[0]))
+    _commit_score_changes(conn, referrals=[(r[0], r[3], r[1], r[2]) for r in rows])
+    c.close()
+    conn.close()
+    return [(r[0], r[1], r[2]) for r in rows]
+
 def clear_pending_referral(telegram_id):
     conn = get_connection()
     c = conn.cursor()
@@ -232,47 +873,365 @@ def clear_pending_referral(telegram_id):
     c.close()
     conn.close()
 
-def add_review(user_id, review_text):
+# ----------------- REPORTS -----------------
+
+REPORT_STATUSES = ("open", "claimed", "closed")
+
+def create_report(user_id, chat_id, text, media_type=None, file_id=None):
     conn = get_connection()
     c = conn.cursor()
-    c.execute("INSERT INTO reviews (user_id, review, timestamp) VALUES (?, ?, ?)", (user_id, review_text, datetime.now()))
+    c.execute("""
+        INSERT INTO reports (user_id, chat_id, text, media_type, file_id, created_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, (user_id, chat_id, text, media_type, file_id, datetime.now()))
+    report_id = c.lastrowid
     conn.commit()
     c.close()
     conn.close()
+    return report_id
 
-def log_admin_action(admin_id, action):
+_GET_REPORT_SQL = "SELECT * FROM reports WHERE id = ?"
+
+def get_report_by_id(report_id):
+    conn = get_connection()
+    conn.row_factory = _row_factory(Report)
+    c = conn.cursor()
+    c.execute(_GET_REPORT_SQL, (report_id,))
+    report = c.fetchone()
+    c.close()
+    conn.close()
+    return report
+
+def claim_report_by_admin(admin_id, report_id):
+    """
+    Claim an open report. Returns False if it was already claimed or closed.
+    """
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute("""
+        UPDATE reports SET status = 'claimed', claimed_by = ?, claimed_at = ?
+        WHERE id = ? AND status = 'open'
+    """, (str(admin_id), datetime.now(), report_id))
+    claimed = c.rowcount == 1
+    conn.commit()
+    c.close()
+    conn.close()
+    return claimed
+
+def close_report_in_db(report_id):
+    """
+    Close a report. Returns False if it was already closed or doesn't exist.
+    """
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute("UPDATE reports SET status = 'closed', closed_at = ? WHERE id = ? AND status != 'closed'",
+              (datetime.now(), report_id))
+    closed = c.rowcount == 1
+    conn.commit()
+    c.close()
+    conn.close()
+    return closed
+
+def add_report_messages(report_id, messages):
+    """
+    Remember which report each sent (chat_id, message_id) belongs to.
+    """
+    conn = get_connection()
+    c = conn.cursor()
+    c.executemany("INSERT OR REPLACE INTO report_messages (chat_id, message_id, report_id) VALUES (?, ?, ?)",
+                  [(str(chat_id), message_id, report_id) for chat_id, message_id in messages])
+    conn.commit()
+    c.close()
+    conn.close()
+
+_REPORT_FOR_MESSAGE_SQL = "SELECT report_id FROM report_messages WHERE chat_id = ? AND message_id = ?"
+
+def get_report_id_for_message(chat_id, message_id):
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute(_REPORT_FOR_MESSAGE_SQL, (str(chat_id), message_id))
+    row = c.fetchone()
+    c.close()
+    conn.close()
+    return row[0] if row else None
+
+def get_report_messages(report_id):
+    """
+    Return the (chat_id, message_id) pairs of the owner messages for a report.
+    """
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute("SELECT chat_id, message_id FROM report_messages WHERE report_id = ?", (report_id,))
+    messages = [(row[0], row[1]) for row in c.fetchall()]
+    c.close()
+    conn.close()
+    return messages
+
+_REPORT_QUEUE_SQL = ("SELECT id, user_id, text, media_type, status, claimed_by, created_at FROM reports "
+                     "WHERE status = ? AND id > ? ORDER BY id LIMIT ?")
+_REPORT_QUEUE_MINE_SQL = ("SELECT id, user_id, text, media_type, status, claimed_by, created_at FROM reports "
+                          "WHERE claimed_by = ? AND status = ? AND id > ? ORDER BY id LIMIT ?")
+
+def get_reports_page(status, after_id=None, limit=10, claimed_by=None):
+    """
+    Oldest-first page of reports with the given status, optionally only those
+    claimed by one owner. Pass the last id of a page as after_id for the next.
+    Returns (reports, has_next).
+    """
+    if status not in REPORT_STATUSES:
+        raise ValueError(f"Unknown report status: {status}")
+    conn = get_read_connection()
+    conn.row_factory = _row_factory(Report)
+    c = conn.cursor()
+    if claimed_by is None:
+        c.execute(_REPORT_QUEUE_SQL, (status, after_id or 0, limit + 1))
+    else:
+        c.execute(_REPORT_QUEUE_MINE_SQL, (str(claimed_by), status, after_id or 0, limit + 1))
+    rows = c.fetchall()
+    c.close()
+    conn.close()
+    return rows[:limit], len(rows) > limit
+
+# ----------------- CONVERSATION STATES -----------------
+
+def set_conversation_state(chat_id, state, data, expires_at):
     conn = get_connection()
     c = conn.cursor()
-    c.execute("INSERT INTO admin_logs (admin_id, action, timestamp) VALUES (?, ?, ?)", (admin_id, action, datetime.now()))
+    c.execute("REPLACE INTO conversation_states (chat_id, state, data, expires_at) VALUES (?, ?, ?, ?)",
+              (chat_id, state, json.dumps(data), expires_at))
     conn.commit()
     c.close()
     conn.close()
 
+_CONVERSATION_STATE_SQL = "SELECT 1 FROM conversation_states WHERE chat_id = ? AND expires_at > ?"
+
+def has_conversation_state(chat_id):
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute(_CONVERSATION_STATE_SQL, (chat_id, time.time()))
+    found = c.fetchone() is not None
+    c.close()
+    conn.close()
+    return found
+
+def pop_conversation_state(chat_id):
+    """
+    Remove the chat's state and return (state, data), or None if it has
+    none or it has expired.
+    """
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute("BEGIN IMMEDIATE")
+    c.execute("SELECT state, data, expires_at FROM conversation_states WHERE chat_id = ?", (chat_id,))
+    row = c.fetchone()
+    if row:
+        c.execute("DELETE FROM conversation_states WHERE chat_id = ?", (chat_id,))
+    conn.commit()
+    c.close()
+    conn.close()
+    if not row or row["expires_at"] <= time.time():
+        return None
+    return row["state"], json.loads(row["data"] or "{}")
+
+def clear_conversation_state(chat_id):
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute("DELETE FROM conversation_states WHERE chat_id = ?", (chat_id,))
+    conn.commit()
+    c.close()
+    conn.close()
+
+def delete_expired_conversation_states():
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute("DELETE FROM conversation_states WHERE expires_at <= ?", (time.time(),))
+    deleted = c.rowcount
+    conn.commit()
+    c.close()
+    conn.close()
+    return deleted
+
+# ----------------- WRITE-BEHIND INSERTS -----------------
+
+class _WriteBehind:
+    """
+    Batches append-only inserts (reviews, admin logs) off the request path.
+    Rows are committed together every `max_delay` seconds or `max_rows` rows.
+    At most `max_queued` rows wait in memory; past that, callers write their
+    row themselves.
+    """
+
+    def __init__(self, max_rows=200, max_delay=0.5, max_queued=10000, warn_after=30):
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        self.warn_after = warn_after
+        self._queue = queue.Queue(maxsize=max_queued)
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_started(self):
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+                self._thread.start()
+
+    def submit(self, sql, params):
+        self._ensure_started()
+        try:
+            self._queue.put_nowait((sql, params))
+        except queue.Full:
+            self._write([(sql, params)])
+
+    def _write(self, rows):
+        """
+        Commit rows in one transaction. If that keeps failing, write them one
+        at a time so a bad row can't take the others with it; a row that
+        fails even alone is printed in full rather than lost without a trace.
+        """
+        error = self._commit(rows)
+        if error is None:
+            return
+        if len(rows) > 1:
+            print(f"Error writing {len(rows)} queued rows ({error}); retrying them one by one.")
+            for row in rows:
+                self._write([row])
+        else:
+            print(f"Error writing queued row, dropped: {rows[0]!r}: {error}")
+
+    def _commit(self, rows):
+        """
+        Execute and commit rows. While the DB is locked (busy claim traffic)
+        keep backing off and retrying, so the rows wait instead of being
+        dropped; the bounded queue makes callers write their own rows
+        meanwhile. Returns None, or any other error.
+        """
+        delay = 0.1
+        warn_at = time.monotonic() + self.warn_after
+        while True:
+            conn = get_connection()
+            c = conn.cursor()
+            try:
+                for sql, params in rows:
+                    c.execute(sql, params)
+                conn.commit()
+                return None
+            except sqlite3.OperationalError as e:
+                if "locked" not in str(e) and "busy" not in str(e):
+                    return e
+            except Exception as e:
+                return e
+            finally:
+                c.close()
+                conn.close()
+            if time.monotonic() >= warn_at:
+                print(f"Database still locked; {len(rows)} queued row(s) waiting to be written.")
+                warn_at = time.monotonic() + self.warn_after
+            time.sleep(delay)
+            delay = min(delay * 2, 2)
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.max_rows:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._write(batch)
+            for _ in batch:
+                self._queue.task_done()
+
+    def flush(self):
+        """
+        Block until every queued row is committed.
+        """
+        if self._thread is not None:
+            self._queue.join()
+
+_write_behind = _WriteBehind()
+
+def flush_writes():
+    """
+    Commit queued reviews and admin logs now. Runs at interpreter exit too;
+    call it before reading those tables if the latest rows must be there.
+    """
+    _write_behind.flush()
+
+atexit.register(flush_writes)
+
+def add_review(user_id, review_text):
+    _write_behind.submit("INSERT INTO reviews (user_id, review, timestamp) VALUES (?, ?, ?)",
+                         (user_id, review_text, datetime.now()))
+
+def get_last_review_id():
+    conn = get_read_connection()
+    c = conn.cursor()
+    c.execute("SELECT MAX(id) FROM reviews")
+    last_id = c.fetchone()[0]
+    c.close()
+    conn.close()
+    return last_id or 0
+
+_REVIEWS_AFTER_SQL = ("SELECT r.id, r.user_id, u.username, r.review, r.timestamp FROM reviews r "
+                      "LEFT JOIN users u ON u.telegram_id = r.user_id WHERE r.id > ? ORDER BY r.id LIMIT ?")
+
+def get_reviews_after(review_id, limit=1000):
+    """
+    Reviews with an id above review_id, oldest first, with the reviewer's username.
+    """
+    conn = get_read_connection()
+    c = conn.cursor()
+    c.execute(_REVIEWS_AFTER_SQL, (review_id, limit))
+    reviews = [dict(row) for row in c.fetchall()]
+    c.close()
+    conn.close()
+    return reviews
+
+def log_admin_action(admin_id, action):
+    _write_behind.submit("INSERT INTO admin_logs (admin_id, action, timestamp) VALUES (?, ?, ?)",
+                         (admin_id, action, datetime.now()))
+
 def get_admins():
     conn = get_connection()
-    conn.row_factory = sqlite3.Row
+    conn.row_factory = _row_factory(Admin)
     c = conn.cursor()
     c.execute("SELECT * FROM admins")
     admins = c.fetchall()
     c.close()
     conn.close()
-    return [dict(a) for a in admins]
+    return admins
+
+def get_admin_ids():
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute("SELECT user_id FROM admins")
+    admin_ids = {row[0] for row in c.fetchall()}
+    c.close()
+    conn.close()
+    return admin_ids
+
+_GET_KEY_SQL = "SELECT * FROM keys WHERE \"key\" = ?"
+_CLAIM_KEY_SQL = "UPDATE keys SET claimed = 1, claimed_by = ?, timestamp = ? WHERE \"key\" = ? AND claimed = 0"
 
 def get_key(key_str):
     conn = get_connection()
-    conn.row_factory = sqlite3.Row
+    conn.row_factory = _row_factory(Key)
     c = conn.cursor()
-    c.execute("SELECT * FROM keys WHERE \"key\" = ?", (key_str,))
+    c.execute(_GET_KEY_SQL, (key_str,))
     key_doc = c.fetchone()
     c.close()
     conn.close()
-    return dict(key_doc) if key_doc else None
+    return key_doc
 
 def claim_key_in_db(key_str, telegram_id):
     conn = get_connection()
     conn.row_factory = sqlite3.Row
     c = conn.cursor()
-    c.execute("SELECT * FROM keys WHERE \"key\" = ?", (key_str,))
+    c.execute(_GET_KEY_SQL, (key_str,))
     key_doc = c.fetchone()
     if not key_doc:
         c.close()
@@ -283,11 +1242,21 @@ def claim_key_in_db(key_str, telegram_id):
         conn.close()
         return "Key already claimed."
     points_awarded = key_doc["points"]
-    c.execute("UPDATE keys SET claimed = 1, claimed_by = ?, timestamp = ? WHERE \"key\" = ?",
-              (telegram_id, datetime.now(), key_str))
-    conn.commit()
-    c.execute("UPDATE users SET points = points + ? WHERE telegram_id = ?", (points_awarded, telegram_id))
-    conn.commit()
+    # Guard on claimed = 0 so two concurrent redeems can't both succeed.
+    c.execute(_CLAIM_KEY_SQL, (telegram_id, datetime.now(), key_str))
+    if c.rowcount == 0:
+        conn.rollback()
+        c.close()
+        conn.close()
+        return "Key already claimed."
+    _bump_stats(c, keys_outstanding=-1)
+    change = _apply_points_delta(c, telegram_id, points_awarded, "key", ref=key_str)
+    if not change:
+        conn.rollback()
+        c.close()
+        conn.close()
+        return "User not found. Please /start the bot first."
+    _commit_score_changes(conn, points=[change])
     c.close()
     conn.close()
     return f"Key redeemed successfully. You've been awarded {points_awarded} points."
@@ -297,69 +1266,414 @@ def add_key(key_str, key_type, points):
     c = conn.cursor()
     c.execute("INSERT INTO keys (\"key\", type, points, claimed, claimed_by, timestamp) VALUES (?, ?, ?, 0, NULL, ?)",
               (key_str, key_type, points, datetime.now()))
+    _bump_stats(c, keys_outstanding=1)
     conn.commit()
     c.close()
     conn.close()
 
 def get_keys():
-    conn = get_connection()
-    conn.row_factory = sqlite3.Row
+    return list(iter_keys())
+
+def iter_keys():
+    """
+    Yield every key as a Key record, one row at a time.
+    """
+    conn = get_read_connection(stale_ok=True)
+    conn.row_factory = _row_factory(Key)
     c = conn.cursor()
-    c.execute("SELECT * FROM keys")
-    keys = c.fetchall()
+    try:
+        c.execute("SELECT * FROM keys")
+        yield from c
+    finally:
+        c.close()
+        conn.close()
+
+_POINTS_LEADERBOARD_SQL = "SELECT telegram_id, username, points FROM users ORDER BY points DESC LIMIT ?"
+
+def get_leaderboard(limit=10):
+    """
+    Top users by points, read in order from idx_users_points.
+    Handlers should use the cached copy in leaderboard.py instead.
+    """
+    conn = get_read_connection()
+    conn.row_factory = _row_factory(User)
+    c = conn.cursor()
+    c.execute(_POINTS_LEADERBOARD_SQL, (limit,))
+    leaderboard = c.fetchall()
     c.close()
     conn.close()
-    return [dict(k) for k in keys]
+    return leaderboard
 
-def get_leaderboard(limit=10):
-    conn = get_connection()
-    conn.row_factory = sqlite3.Row
+_REFERRAL_LEADERBOARD_SQL = "SELECT telegram_id, username, referrals FROM users ORDER BY referrals DESC LIMIT ?"
+
+def get_referral_leaderboard(limit=10):
+    """
+    Top users by the maintained users.referrals counter, read from idx_users_referrals.
+    Handlers should use the cached copy in leaderboard.py instead.
+    """
+    conn = get_read_connection()
+    conn.row_factory = _row_factory(User)
     c = conn.cursor()
-    c.execute("SELECT telegram_id, username, points FROM users ORDER BY points DESC LIMIT ?", (limit,))
+    c.execute(_REFERRAL_LEADERBOARD_SQL, (limit,))
     leaderboard = c.fetchall()
     c.close()
     conn.close()
-    return [dict(row) for row in leaderboard]
+    return leaderboard
+
+def get_sorted_scores(column, on_snapshot=None):
+    """
+    Every user's points or referrals in ascending order, read from the
+    column's index. Used to (re)build the rank index in leaderboard.py.
+    on_snapshot() is called once the read snapshot is open; score changes
+    published after it are guaranteed not to be part of the result.
+    """
+    if column not in ("points", "referrals"):
+        raise ValueError(f"Unknown score column: {column}")
+    conn = get_read_connection()
+    c = conn.cursor()
+    with _score_lock:
+        c.execute(f"SELECT {column} FROM users ORDER BY {column}")
+        first = c.fetchone()
+        if on_snapshot:
+            on_snapshot()
+    scores = [] if first is None else [first[0]]
+    scores.extend(row[0] for row in c)
+    c.close()
+    conn.close()
+    return scores
+
+# ----------------- CONTENT VERSIONS -----------------
+
+# In-process change counters for data that cached menus are built from (see
+# render.versioned). Writers bump them after committing. "stock" moves only
+# when items are added or reassigned, not when they are claimed; the claim
+# reservoirs (see reservoir.py) refetch when it does.
+CONTENT_KINDS = ("platforms", "users", "stock")
+_content_versions = dict.fromkeys(CONTENT_KINDS, 0)
+_content_versions_lock = threading.Lock()
+
+def content_version(kind):
+    return _content_versions[kind]
+
+def bump_content_version(*kinds):
+    """
+    Invalidate menus built from `kinds`, or from everything if none are given.
+    """
+    with _content_versions_lock:
+        for kind in kinds or CONTENT_KINDS:
+            _content_versions[kind] += 1
 
-def get_admin_dashboard():
+# ----------------- DASHBOARD COUNTERS -----------------
+
+STATS_COUNTERS = ("total_users", "banned_users", "total_points", "total_claims", "total_stock", "keys_outstanding")
+
+def _bump_stats(c, **deltas):
+    """
+    Add the given deltas to stats_counters on an open cursor; the caller owns
+    the transaction, so the counters move together with the rows they count.
+    """
+    deltas = {name: delta for name, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    for name in deltas:
+        if name not in STATS_COUNTERS:
+            raise ValueError(f"Unknown stats counter: {name}")
+    assignments = ", ".join(f"{name} = {name} + ?" for name in deltas)
+    c.execute(f"UPDATE stats_counters SET {assignments} WHERE id = 1", tuple(deltas.values()))
+
+_STATS_COUNTERS_SQL = f"SELECT {', '.join(STATS_COUNTERS)} FROM stats_counters WHERE id = 1"
+
+def get_stats_counters():
+    conn = get_read_connection(stale_ok=True)
+    c = conn.cursor()
+    c.execute(_STATS_COUNTERS_SQL)
+    row = c.fetchone()
+    c.close()
+    conn.close()
+    return dict(row) if row else {name: 0 for name in STATS_COUNTERS}
+
+def rebuild_stats_counters():
+    """
+    Recompute every dashboard counter from the underlying tables and
+    overwrite stats_counters. Returns the new counters.
+    """
     conn = get_connection()
     c = conn.cursor()
-    c.execute("SELECT COUNT(*) FROM users")
-    total_users = c.fetchone()[0]
+    c.execute("BEGIN IMMEDIATE")
+    stats = _write_stats_counters(c)
+    conn.commit()
+    c.close()
+    conn.close()
+    return stats
+
+def _write_stats_counters(c):
+    c.execute("SELECT COUNT(*), COALESCE(SUM(points), 0) FROM users")
+    total_users, total_points = c.fetchone()
     c.execute("SELECT COUNT(*) FROM users WHERE banned = 1")
     banned_users = c.fetchone()[0]
-    c.execute("SELECT SUM(points) FROM users")
-    total_points = c.fetchone()[0] or 0
+    c.execute("SELECT COUNT(*) FROM points_ledger WHERE reason = 'claim'")
+    total_claims = c.fetchone()[0]
+    c.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'stock_items'")
+    if c.fetchone():
+        c.execute("SELECT COUNT(*) FROM stock_items")
+        total_stock = c.fetchone()[0]
+    else:
+        # Migrating a database from before stock_items (migration 10).
+        c.execute("SELECT stock FROM platforms")
+        total_stock = sum(len(json.loads(row["stock"] or "[]")) for row in c.fetchall())
+    c.execute("SELECT COUNT(*) FROM keys WHERE claimed = 0")
+    keys_outstanding = c.fetchone()[0]
+    stats = {
+        "total_users": total_users,
+        "banned_users": banned_users,
+        "total_points": total_points,
+        "total_claims": total_claims,
+        "total_stock": total_stock,
+        "keys_outstanding": keys_outstanding,
+    }
+    c.execute(f"REPLACE INTO stats_counters (id, {', '.join(stats)}) VALUES (1, {', '.join('?' for _ in stats)})",
+              tuple(stats.values()))
+    return stats
+
+def get_platforms():
+    return list(iter_platforms())
+
+def iter_platforms():
+    """
+    Yield every platform as a Platform record, one row at a time, with the
+    number of items in stock as stock_count.
+    """
+    conn = get_connection()
+    conn.row_factory = _row_factory(Platform)
+    c = conn.cursor()
+    try:
+        c.execute("SELECT p.*, (SELECT COUNT(*) FROM stock_items s WHERE s.platform_name = p.platform_name) "
+                  "AS stock_count FROM platforms p")
+        yield from c
+    finally:
+        c.close()
+        conn.close()
+
+# ----------------- STOCK ITEMS -----------------
+
+class StockGone(Exception):
+    """
+    Raised by claim_stock_items when some of the requested items were taken
+    in the meantime; nothing was changed.
+    """
+
+_STOCK_COUNT_SQL = "SELECT COUNT(*) FROM stock_items WHERE platform_name = ?"
+
+def get_stock_count(platform_name):
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute(_STOCK_COUNT_SQL, (platform_name,))
+    count = c.fetchone()[0]
     c.close()
     conn.close()
-    return total_users, banned_users, total_points
+    return count
 
-def get_platforms():
+_STOCK_IDS_SQL = "SELECT id FROM stock_items WHERE platform_name = ? AND id > ? ORDER BY id LIMIT ?"
+
+def get_stock_item_ids(platform_name, after_id=0, limit=200):
+    """
+    Ids of a platform's stock items above after_id, oldest first.
+    """
     conn = get_connection()
-    conn.row_factory = sqlite3.Row
     c = conn.cursor()
-    c.execute("SELECT * FROM platforms")
-    platforms = c.fetchall()
+    c.execute(_STOCK_IDS_SQL, (platform_name, after_id, limit))
+    ids = [row[0] for row in c.fetchall()]
     c.close()
     conn.close()
-    return [dict(p) for p in platforms]
+    return ids
 
-def update_stock_for_platform(platform_name, stock):
+def _add_stock_items(c, platform_name, items):
+    c.executemany("INSERT INTO stock_items (platform_name, item) VALUES (?, ?)",
+                  [(platform_name, json.dumps(item)) for item in items])
+    _bump_stats(c, total_stock=len(items))
+    c.execute(_STOCK_COUNT_SQL, (platform_name,))
+    return c.fetchone()[0]
+
+def add_stock_items(platform_name, items):
+    """
+    Append login items (strings) to a platform's stock. Returns the new stock
+    size, or None if the platform is gone.
+    """
     conn = get_connection()
     c = conn.cursor()
-    c.execute("UPDATE platforms SET stock = ? WHERE platform_name = ?", (json.dumps(stock), platform_name))
+    c.execute("BEGIN IMMEDIATE")
+    c.execute("SELECT 1 FROM platforms WHERE platform_name = ?", (platform_name,))
+    if not c.fetchone():
+        conn.rollback()
+        c.close()
+        conn.close()
+        return None
+    total = _add_stock_items(c, platform_name, items)
     conn.commit()
     c.close()
     conn.close()
-    log_event(telebot.TeleBot(config.TOKEN), "stock", f"Platform '{platform_name}' stock updated to {len(stock)} items.")
+    bump_content_version("platforms", "stock")
+    log_event(telebot.TeleBot(config.TOKEN), "stock", f"Platform '{platform_name}' stock updated to {total} items.")
+    return total
+
+def _delete_stock_items(c, platform_name):
+    """
+    Delete all of a platform's stock items and return them. Cookie refs are
+    the caller's business.
+    """
+    c.execute("SELECT item FROM stock_items WHERE platform_name = ?", (platform_name,))
+    items = [json.loads(row[0]) for row in c.fetchall()]
+    c.execute("DELETE FROM stock_items WHERE platform_name = ?", (platform_name,))
+    _bump_stats(c, total_stock=-len(items))
+    return items
+
+_CLAIM_STOCK_ITEMS_SQL = "SELECT id, item FROM stock_items WHERE platform_name = ? AND id IN ({})"
+_PLATFORM_PRICE_SQL = "SELECT price FROM platforms WHERE platform_name = ?"
+
+def claim_stock_items(telegram_id, platform_name, item_ids):
+    """
+    Claim exactly the stock items `item_ids` (handed out by reservoir.py) and
+    charge the user for them in one transaction. Only those rows are deleted,
+    so claims on the same platform don't rewrite each other's data.
+    Returns (accounts, new_balance) or (None, error_message); raises
+    StockGone if any of the items no longer exists. A cookie item comes back
+    with its compressed file under "data".
+    """
+    default_price = get_account_claim_cost()
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute("BEGIN IMMEDIATE")
+    c.execute(_CLAIM_STOCK_ITEMS_SQL.format(", ".join("?" for _ in item_ids)), (platform_name, *item_ids))
+    rows = c.fetchall()
+    if len(rows) < len(item_ids):
+        conn.rollback()
+        c.close()
+        conn.close()
+        raise StockGone(platform_name)
+    return _claim_rows(conn, c, telegram_id, platform_name, rows, default_price)
+
+def _claim_rows(conn, c, telegram_id, platform_name, rows, default_price):
+    """
+    Finish a claim of the selected (id, item) rows inside the transaction
+    opened by the caller. Commits or rolls back, and closes the connection.
+    """
+    c.execute(_PLATFORM_PRICE_SQL, (platform_name,))
+    platform = c.fetchone()
+    if platform:
+        accounts, result = _take_rows(c, telegram_id, platform_name, rows, platform["price"] or default_price)
+    else:
+        accounts, result = None, "Platform not found."
+    if accounts is None:
+        conn.rollback()
+        c.close()
+        conn.close()
+        return None, result
+    _commit_score_changes(conn, points=[result])
+    c.close()
+    conn.close()
+    bump_content_version("platforms")
+    return accounts, result[3]
+
+def _take_rows(c, telegram_id, platform_name, rows, price):
+    """
+    Check the user can pay for the selected (id, item) rows, then delete them
+    and charge for them on an open cursor. Returns (accounts, points change)
+    or (None, error_message), in which case nothing was changed.
+    """
+    count = len(rows)
+    c.execute("SELECT points FROM users WHERE telegram_id = ?", (telegram_id,))
+    user = c.fetchone()
+    if not user:
+        return None, "User not found. Please /start the bot first."
+    if not rows:
+        return None, "No accounts available."
+    if user["points"] < price * count:
+        if count == 1:
+            return None, f"Insufficient points (each account costs {price} pts). Earn more via referrals or keys."
+        return None, f"Insufficient points ({count} accounts cost {price * count} pts). Earn more via referrals or keys."
+    accounts = [json.loads(row["item"]) for row in rows]
+    c.execute(f"DELETE FROM stock_items WHERE id IN ({', '.join('?' for _ in rows)})", [row["id"] for row in rows])
+    blobs = _cookie_refs(accounts)
+    if blobs:
+        # Read the files before this claim possibly drops their last reference.
+        c.execute(f"SELECT hash, data FROM cookie_blobs WHERE hash IN ({', '.join('?' for _ in blobs)})", list(blobs))
+        data = dict(c.fetchall())
+        accounts = [dict(item, data=data.get(item["blob"])) if isinstance(item, dict) and "blob" in item else item
+                    for item in accounts]
+        _adjust_cookie_refs(c, {digest: -n for digest, n in blobs.items()})
+    # One ledger entry per item, so points history and the claim count line up.
+    changes = [_apply_points_delta(c, telegram_id, -price, "claim", ref=platform_name, min_balance=0)
+               for _ in range(count)]
+    _bump_stats(c, total_claims=count, total_stock=-count)
+    now = int(time.time())
+    c.executemany("INSERT INTO claims (user_id, platform_name, item, price, claimed_at) VALUES (?, ?, ?, ?, ?)",
+                  [(telegram_id, platform_name, row["item"], price, now) for row in rows])
+    return accounts, (telegram_id, changes[0][1], changes[0][2], changes[-1][3])
+
+_CLAIM_BATCH_SQL = "SELECT id, item FROM stock_items WHERE platform_name = ? ORDER BY id LIMIT ?"
+
+def claim_batch(platform_name, requests):
+    """
+    Serve queued claims [(telegram_id, count), ...] in order, all in one
+    transaction (see claimqueue.py); each gets the oldest items left.
+    Returns one (accounts, new_balance) or (None, error_message) per request.
+    """
+    default_price = get_account_claim_cost()
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute("BEGIN IMMEDIATE")
+    c.execute(_PLATFORM_PRICE_SQL, (platform_name,))
+    platform = c.fetchone()
+    if not platform:
+        conn.rollback()
+        c.close()
+        conn.close()
+        return [(None, "Platform not found.")] * len(requests)
+    price = platform["price"] or default_price
+    results = []
+    changes = []
+    for telegram_id, count in requests:
+        c.execute(_CLAIM_BATCH_SQL, (platform_name, count))
+        rows = c.fetchall()
+        if rows and len(rows) < count:
+            results.append((None, f"Only {len(rows)} accounts available."))
+            continue
+        accounts, result = _take_rows(c, telegram_id, platform_name, rows, price)
+        if accounts is None:
+            results.append((None, result))
+        else:
+            changes.append(result)
+            results.append((accounts, result[3]))
+    _commit_score_changes(conn, points=changes)
+    c.close()
+    conn.close()
+    if changes:
+        bump_content_version("platforms")
+    return results
+
+def delete_platform(platform_name):
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute("BEGIN IMMEDIATE")
+    c.execute("SELECT 1 FROM platforms WHERE platform_name = ?", (platform_name,))
+    if c.fetchone():
+        c.execute("DELETE FROM platforms WHERE platform_name = ?", (platform_name,))
+        stock = _delete_stock_items(c, platform_name)
+        _adjust_cookie_refs(c, {digest: -n for digest, n in _cookie_refs(stock).items()})
+    conn.commit()
+    c.close()
+    conn.close()
+    bump_content_version("platforms", "stock")
 
 def rename_platform(old_name, new_name):
     conn = get_connection()
     c = conn.cursor()
     c.execute("UPDATE platforms SET platform_name = ? WHERE platform_name = ?", (new_name, old_name))
+    c.execute("UPDATE stock_items SET platform_name = ? WHERE platform_name = ?", (new_name, old_name))
     conn.commit()
     c.close()
     conn.close()
+    bump_content_version("platforms", "stock")
     log_event(telebot.TeleBot(config.TOKEN), "platform", f"Platform renamed from '{old_name}' to '{new_name}'.")
 
 def update_platform_price(platform_name, new_price):
@@ -369,8 +1683,200 @@ def update_platform_price(platform_name, new_price):
     conn.commit()
     c.close()
     conn.close()
+    bump_content_version("platforms")
     log_event(telebot.TeleBot(config.TOKEN), "platform", f"Platform '{platform_name}' price updated to {new_price} pts.")
 
+# ----------------- CLAIM HISTORY -----------------
+
+_CLAIMS_PAGE_SQL = ("SELECT id, platform_name, item, price, claimed_at, refunded FROM claims "
+                    "WHERE user_id = ? ORDER BY claimed_at DESC, id DESC LIMIT ?")
+_CLAIMS_PAGE_BACK_SQL = ("SELECT id, platform_name, item, price, claimed_at, refunded FROM claims "
+                         "WHERE user_id = ? AND (claimed_at, id) < (?, ?) ORDER BY claimed_at DESC, id DESC LIMIT ?")
+
+def get_claims_page(telegram_id, before=None, limit=10):
+    """
+    Return (claims, has_more): the user's claims, newest first, straight from
+    idx_claims_user_time. Pass the (claimed_at, id) of the last claim on the
+    previous page as before to page back.
+    """
+    conn = get_read_connection()
+    c = conn.cursor()
+    if before is None:
+        c.execute(_CLAIMS_PAGE_SQL, (telegram_id, limit + 1))
+    else:
+        c.execute(_CLAIMS_PAGE_BACK_SQL, (telegram_id, before[0], before[1], limit + 1))
+    rows = [dict(r) for r in c.fetchall()]
+    c.close()
+    conn.close()
+    return rows[:limit], len(rows) > limit
+
+_GET_CLAIM_SQL = "SELECT id, user_id, platform_name, price, refunded FROM claims WHERE id = ?"
+
+def refund_claim(claim_id):
+    """
+    Give a claim's price back to its user with a 'refund' ledger entry and
+    mark it refunded; a claim can only be refunded once.
+    Returns (claim, new_balance) on success, or (None, error_message).
+    """
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute("BEGIN IMMEDIATE")
+    c.execute(_GET_CLAIM_SQL, (claim_id,))
+    claim = c.fetchone()
+    if not claim or claim["refunded"]:
+        conn.rollback()
+        c.close()
+        conn.close()
+        return None, "Claim not found." if not claim else f"Claim #{claim_id} was already refunded."
+    change = _apply_points_delta(c, claim["user_id"], claim["price"], "refund", ref=f"claim:{claim_id}")
+    if change is None:
+        conn.rollback()
+        c.close()
+        conn.close()
+        return None, f"User '{claim['user_id']}' not found."
+    c.execute("UPDATE claims SET refunded = 1 WHERE id = ?", (claim_id,))
+    _commit_score_changes(conn, points=[change])
+    c.close()
+    conn.close()
+    return dict(claim), change[3]
+
+# ----------------- COOKIE BLOBS -----------------
+
+def _is_inline_cookie(item):
+    return isinstance(item, dict) and item.get("type") == "cookie" and "content" in item
+
+def _cookie_refs(stock):
+    return Counter(item["blob"] for item in stock if isinstance(item, dict) and "blob" in item)
+
+def _store_cookie_blob(c, content):
+    """
+    Store `content` (bytes) if it isn't stored yet, take a reference to it
+    and return its hash.
+    """
+    digest = hashlib.sha256(content).hexdigest()
+    c.execute("INSERT OR IGNORE INTO cookie_blobs (hash, data, size) VALUES (?, ?, ?)",
+              (digest, zlib.compress(content, 9), len(content)))
+    c.execute("UPDATE cookie_blobs SET refs = refs + 1 WHERE hash = ?", (digest,))
+    return digest
+
+def _adjust_cookie_refs(c, deltas):
+    """
+    Apply {hash: delta} to the blob reference counts and drop blobs that are
+    no longer referenced.
+    """
+    for digest, delta in deltas.items():
+        if delta:
+            c.execute("UPDATE cookie_blobs SET refs = refs + ? WHERE hash = ?", (delta, digest))
+    gone = [digest for digest, delta in deltas.items() if delta < 0]
+    if gone:
+        c.execute(f"DELETE FROM cookie_blobs WHERE refs <= 0 AND hash IN ({', '.join('?' for _ in gone)})", gone)
+
+def add_cookie_stock(platform_name, contents):
+    """
+    Add one cookie stock item per file in `contents` (bytes each) to a
+    platform. Returns the new stock size, or None if the platform is gone.
+    """
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute("BEGIN IMMEDIATE")
+    c.execute("SELECT 1 FROM platforms WHERE platform_name = ?", (platform_name,))
+    if not c.fetchone():
+        conn.rollback()
+        c.close()
+        conn.close()
+        return None
+    items = [{"type": "cookie", "blob": _store_cookie_blob(c, content)} for content in contents]
+    total = _add_stock_items(c, platform_name, items)
+    conn.commit()
+    c.close()
+    conn.close()
+    bump_content_version("platforms", "stock")
+    return total
+
+# ----------------- QUERY PLAN CHECK -----------------
+
+# Queries on the request path, with sample parameters. None of them may scan
+# a whole table or sort in a temp b-tree; check with `python db.py check-plans`.
+# The functions above run these same constants, so the check sees the SQL
+# that is actually executed.
+HOT_QUERIES = {
+    "get_user": (_GET_USER_SQL, ("1",)),
+    "is_user_banned": (_IS_USER_BANNED_SQL, ("1",)),
+    "report": (_GET_REPORT_SQL, (1,)),
+    "report_queue": (_REPORT_QUEUE_SQL, ("open", 0, 11)),
+    "report_queue_mine": (_REPORT_QUEUE_MINE_SQL, ("1", "claimed", 0, 11)),
+    "report_for_message": (_REPORT_FOR_MESSAGE_SQL, ("1", 1)),
+    "reviews_after": (_REVIEWS_AFTER_SQL, (0, 1000)),
+    "conversation_state": (_CONVERSATION_STATE_SQL, ("1", 0)),
+    "add_referral": (_ADD_REFERRAL_SQL, ("1", "2")),
+    "points_delta": (_POINTS_DELTA_SQL, (1, "1")),
+    "points_delta_min": (_POINTS_DELTA_MIN_SQL, (1, "1", 1, 0)),
+    "points_history": (_POINTS_HISTORY_SQL, ("1", 10)),
+    "points_history_back": (_POINTS_HISTORY_BACK_SQL, ("1", 100, 10)),
+    "get_key": (_GET_KEY_SQL, ("K",)),
+    "claim_key": (_CLAIM_KEY_SQL, ("1", "now", "K")),
+    "get_platform": (_PLATFORM_PRICE_SQL, ("p",)),
+    "stock_count": (_STOCK_COUNT_SQL, ("p",)),
+    "stock_ids": (_STOCK_IDS_SQL, ("p", 0, 200)),
+    "claim_batch": (_CLAIM_BATCH_SQL, ("p", 5)),
+    "claim_stock_items": (_CLAIM_STOCK_ITEMS_SQL.format("?, ?"), ("p", 1, 2)),
+    "claims_page": (_CLAIMS_PAGE_SQL, ("1", 11)),
+    "claims_page_back": (_CLAIMS_PAGE_BACK_SQL, ("1", 0, 0, 11)),
+    "claim": (_GET_CLAIM_SQL, (1,)),
+    "get_config_value": (_GET_CONFIG_VALUE_SQL, ("k",)),
+    "points_leaderboard": (_POINTS_LEADERBOARD_SQL, (10,)),
+    "referral_leaderboard": (_REFERRAL_LEADERBOARD_SQL, (10,)),
+    "dashboard": (_STATS_COUNTERS_SQL, ()),
+    "users_page": (_USERS_PAGE_SQL, ("1", 11)),
+    "users_page_back": (_USERS_PAGE_BACK_SQL, ("9", 11)),
+    "search_user_id": (_SEARCH_USER_ID_SQL, ("12", "13", 10)),
+    "search_username": (_SEARCH_USERNAME_SQL, ("ab", "ac", 10)),
+}
+
+def find_slow_query_plans():
+    """
+    Run EXPLAIN QUERY PLAN for every entry in HOT_QUERIES and return
+    {name: [plan details]} for the ones that scan a table without an index
+    or need a temporary b-tree to sort.
+    """
+    conn = get_connection()
+    c = conn.cursor()
+    slow = {}
+    for name, (sql, params) in HOT_QUERIES.items():
+        c.execute("EXPLAIN QUERY PLAN " + sql, params)
+        details = [row[3] for row in c.fetchall()]
+        bad = [d for d in details
+               if (d.startswith("SCAN") and "INDEX" not in d) or d.startswith("USE TEMP B-TREE")]
+        if bad:
+            slow[name] = bad
+    c.close()
+    conn.close()
+    return slow
+
 if __name__ == '__main__':
+    import sys
+    if len(sys.argv) > 1 and sys.argv[1] == "migrate":
+        dry_run = "--dry-run" in sys.argv[2:]
+        steps = migrate_db(dry_run=dry_run)
+        for version, description in steps:
+            print(f"{'Pending' if dry_run else 'Applied'} migration {version}: {description}")
+        if not steps:
+            print(f"Schema is current (version {SCHEMA_VERSION}).")
+        sys.exit(0)
+    if len(sys.argv) > 2 and sys.argv[1] == "check-db":
+        ok, detail = check_db_file(sys.argv[2])
+        print(detail)
+        sys.exit(0 if ok else 1)
     init_db()
+    if len(sys.argv) > 1 and sys.argv[1] == "repair-referrals":
+        fixed = repair_referral_counters()
+        print(f"Repaired {len(fixed)} referral counter(s).")
+        for telegram_id, cached, actual in fixed:
+            print(f"  {telegram_id}: {cached} -> {actual}")
+    elif len(sys.argv) > 1 and sys.argv[1] == "check-plans":
+        slow = find_slow_query_plans()
+        for name, details in slow.items():
+            print(f"{name}: {'; '.join(details)}")
+        print(f"{len(HOT_QUERIES) - len(slow)}/{len(HOT_QUERIES)} hot queries use an index.")
+        sys.exit(1 if slow else 0)
     
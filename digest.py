@@ -0,0 +1,119 @@
+import html
+import threading
+import time
+from datetime import datetime
+import config
+import db
+import notify
+
+# Optional batching of review notifications. An owner in digest mode gets one
+# summary per interval, or sooner once DIGEST_MAX_PENDING reviews pile up,
+# instead of one message per review. Each owner's position in the reviews
+# table is kept in configurations, so restarts neither lose nor repeat reviews.
+
+REVIEW_MODES = ("instant", "digest")
+DIGEST_MAX_PENDING = 50
+MAX_TEXT_LENGTH = 3500      # longer digests are sent as a .txt file
+MAX_DIGEST_REVIEWS = 5000   # per owner per run; the rest go in the next one
+SEND_TIMEOUT = 600          # seconds before an unconfirmed digest counts as lost
+
+_wake = threading.Event()
+_pending = 0
+_pending_lock = threading.Lock()
+_in_flight = {}  # owner -> time.monotonic() their queued digest was handed to notify
+_in_flight_lock = threading.Lock()
+
+def get_review_mode(owner_id):
+    return db.get_config_value(f"review_mode:{owner_id}") or "instant"
+
+def set_review_mode(owner_id, mode):
+    if mode not in REVIEW_MODES:
+        raise ValueError(f"Unknown review mode: {mode}")
+    if mode == "digest" and get_review_mode(owner_id) != "digest":
+        # Reviews up to now were already delivered one by one.
+        db.flush_writes()
+        db.set_config_value(f"review_digest_after:{owner_id}", db.get_last_review_id())
+    db.set_config_value(f"review_mode:{owner_id}", mode)
+
+def instant_owners():
+    return [owner for owner in config.OWNERS if get_review_mode(owner) == "instant"]
+
+def review_added():
+    """
+    Count a new review toward the early-send threshold.
+    """
+    global _pending
+    with _pending_lock:
+        _pending += 1
+        if _pending >= DIGEST_MAX_PENDING:
+            _wake.set()
+
+def format_digest(reviews, escape=True):
+    quote = html.escape if escape else str
+    lines = [f"📢 Review digest: {len(reviews)} review(s)", ""]
+    for review in reviews:
+        name = review["username"] or review["user_id"]
+        lines.append(f"[{review['timestamp']}] {quote(str(name))} ({review['user_id']}): {quote(review['review'] or '')}")
+    return "\n".join(lines)
+
+def _digest_sent(owner, last_id):
+    """
+    Move the owner's position past a digest once Telegram has accepted it.
+    """
+    def on_sent(result):
+        with _in_flight_lock:
+            _in_flight.pop(owner, None)
+            # A digest that outlived SEND_TIMEOUT may land after a newer one.
+            if last_id > int(db.get_config_value(f"review_digest_after:{owner}") or 0):
+                db.set_config_value(f"review_digest_after:{owner}", last_id)
+    return on_sent
+
+def send_digests(bot):
+    """
+    Queue one digest for every digest-mode owner with unseen reviews. The
+    owner's position only moves once the digest is delivered, so a failed
+    one is sent again next run; until then no second digest is queued.
+    """
+    global _pending
+    with _pending_lock:
+        _pending = 0
+    db.flush_writes()
+    for owner in config.OWNERS:
+        if get_review_mode(owner) != "digest":
+            continue
+        with _in_flight_lock:
+            queued = _in_flight.get(owner)
+            if queued is not None and time.monotonic() - queued < SEND_TIMEOUT:
+                continue
+        after = int(db.get_config_value(f"review_digest_after:{owner}") or 0)
+        reviews = db.get_reviews_after(after, MAX_DIGEST_REVIEWS)
+        if not reviews:
+            continue
+        with _in_flight_lock:
+            _in_flight[owner] = time.monotonic()
+        on_sent = _digest_sent(owner, reviews[-1]["id"])
+        text = format_digest(reviews)
+        if len(text) <= MAX_TEXT_LENGTH:
+            notify.deliver(bot.send_message, owner, text, on_sent=on_sent, label=f"review digest to owner {owner}")
+        else:
+            notify.deliver(bot.send_document, owner, format_digest(reviews, escape=False).encode(),
+                           visible_file_name=f"reviews-{datetime.now().strftime('%Y%m%d-%H%M')}.txt",
+                           caption=f"📢 Review digest: {len(reviews)} review(s)",
+                           on_sent=on_sent, label=f"review digest file to owner {owner}")
+
+def start_review_digest(bot, interval=3600):
+    """
+    Send digests every `interval` seconds, or early once enough reviews are
+    pending, from a daemon thread.
+    """
+    def loop():
+        while True:
+            _wake.wait(interval)
+            _wake.clear()
+            try:
+                send_digests(bot)
+            except Exception as e:
+                print(f"Error sending review digests: {e}")
+    thread = threading.Thread(target=loop, name="review-digest", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,274 @@
+import heapq
+import itertools
+import random
+import threading
+import time
+from contextlib import contextmanager
+import requests
+import telebot
+import urllib3
+import config
+
+# Outbound Telegram gateway. install() makes send() pyTelegramBotAPI's
+# CUSTOM_REQUEST_SENDER, so every Bot API request from every TeleBot instance
+# passes through here. It adds:
+#   - flood control: a global send rate plus a per-chat rate, where waiting
+#     callers get the global slots in priority order;
+#   - retries: 429s wait for retry_after, 5xx and network errors back off
+#     (a send* call is only retried if it never reached Telegram, so a lost
+#     response can't deliver the same message twice);
+#   - a circuit breaker that fails fast while the API keeps failing.
+
+HIGH, NORMAL, LOW = 0, 1, 2  # user-facing replies, background notifications, logs and broadcasts
+
+GLOBAL_RATE = 30              # messages per second across all chats
+PRIVATE_CHAT_RATE = 1.0       # messages per second to one private chat...
+GROUP_CHAT_RATE = 20 / 60     # ...and to one group or channel
+CHAT_BURST = 3
+MAX_ATTEMPTS = 3
+MAX_RETRY_WAIT = 30           # give up instead of waiting longer than this for a retry_after
+BREAKER_THRESHOLD = 5         # consecutive 5xx/network failures that open the circuit
+BREAKER_COOLDOWN = 30         # seconds before a trial request is let through again
+
+# Methods that post into a chat and count toward Telegram's flood limits.
+LIMITED_METHODS = {
+    "sendmessage", "sendphoto", "senddocument", "sendvideo", "sendaudio", "sendvoice",
+    "sendanimation", "sendsticker", "sendmediagroup", "copymessage", "forwardmessage",
+    "editmessagetext", "editmessagecaption", "editmessagemedia", "editmessagereplymarkup",
+}
+
+# Methods that must not be repeated once Telegram may have received them.
+NOT_IDEMPOTENT = {"copymessage", "copymessages", "forwardmessage", "forwardmessages"}
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    pass
+
+_local = threading.local()
+
+@contextmanager
+def priority(level):
+    """
+    Send every request made inside the block at the given priority.
+    """
+    previous = getattr(_local, "priority", None)
+    _local.priority = level
+    try:
+        yield
+    finally:
+        _local.priority = previous
+
+def _priority_for(chat_id):
+    level = getattr(_local, "priority", None)
+    if level is not None:
+        return level
+    if str(chat_id) == str(config.LOGS_CHANNEL):
+        return LOW
+    return HIGH
+
+class _Bucket:
+    """
+    Token bucket. Tokens may go negative: reserve() books a slot in the
+    future and returns how long to wait for it.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.stamp = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def reserve(self, now):
+        self._refill(now)
+        self.tokens -= 1
+        return 0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def wait_time(self, now):
+        self._refill(now)
+        return 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def block(self, seconds, now):
+        self._refill(now)
+        self.tokens = min(self.tokens, 1 - seconds * self.rate)
+
+class _Limiter:
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._global = _Bucket(GLOBAL_RATE, GLOBAL_RATE)
+        self._chats = {}
+        self._waiting = []  # heap of (priority, seq)
+        self._seq = itertools.count()
+
+    def _chat_bucket(self, chat_id, now):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) > 10000:
+                # Forget chats whose bucket has refilled; they behave like new ones.
+                for key in [k for k, b in self._chats.items() if b.wait_time(now) == 0 and b.tokens >= b.burst]:
+                    del self._chats[key]
+            group = str(chat_id).startswith(("-", "@"))
+            bucket = _Bucket(GROUP_CHAT_RATE if group else PRIVATE_CHAT_RATE, CHAT_BURST)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    def acquire(self, chat_id, level):
+        with self._cond:
+            now = time.monotonic()
+            delay = self._chat_bucket(str(chat_id), now).reserve(now)
+        if delay:
+            time.sleep(delay)
+        with self._cond:
+            ticket = (level, next(self._seq))
+            heapq.heappush(self._waiting, ticket)
+            while True:
+                if self._waiting[0] == ticket:
+                    wait = self._global.wait_time(time.monotonic())
+                    if wait == 0:
+                        heapq.heappop(self._waiting)
+                        self._global.tokens -= 1
+                        self._cond.notify_all()
+                        return
+                    self._cond.wait(wait)
+                else:
+                    self._cond.wait()
+
+    def penalize(self, chat_id, seconds):
+        with self._cond:
+            now = time.monotonic()
+            self._chat_bucket(str(chat_id), now).block(seconds, now)
+
+class _Breaker:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial = False
+
+    def allow(self):
+        """
+        Returns (allowed, trial). A trial request must call end_trial() when
+        it is done, whatever the outcome.
+        """
+        with self._lock:
+            if self._opened_at is None:
+                return True, False
+            if not self._trial and time.monotonic() - self._opened_at >= BREAKER_COOLDOWN:
+                self._trial = True
+                return True, True
+            return False, False
+
+    def end_trial(self):
+        # success() and failure() already settle the trial; this covers every
+        # other way out, so the circuit can't stay closed to trials for good.
+        with self._lock:
+            self._trial = False
+
+    def success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial = False
+
+    def failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial or self._failures >= BREAKER_THRESHOLD:
+                if self._opened_at is None:
+                    print("Telegram API failing; opening the circuit.")
+                self._opened_at = time.monotonic()
+            self._trial = False
+
+_limiter = _Limiter()
+_breaker = _Breaker()
+_sessions = threading.local()
+
+def _http(method, url, **kwargs):
+    session = getattr(_sessions, "session", None)
+    if session is None:
+        session = _sessions.session = requests.Session()
+    return session.request(method, url, **kwargs)
+
+def _retry_after(response):
+    try:
+        return int(response.json().get("parameters", {}).get("retry_after", 1))
+    except Exception:
+        return 1
+
+def _rewind(files):
+    # An upload being retried must be read again from the start.
+    for value in (files or {}).values():
+        stream = value[1] if isinstance(value, tuple) else value
+        if hasattr(stream, "seek"):
+            stream.seek(0)
+
+def _never_sent(error):
+    """
+    True if the request failed before a connection to Telegram was made.
+    """
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], "reason", None) if error.args else None
+    return isinstance(reason, urllib3.exceptions.NewConnectionError)
+
+def _backoff(attempt):
+    return min(2 ** attempt, 10) + random.random()
+
+def send(method, url, **kwargs):
+    api_method = url.rsplit("/", 1)[-1].lower()
+    if api_method == "getupdates":
+        # Long polling has its own timeouts and error handling in bot.polling().
+        return _http(method, url, **kwargs)
+    chat_id = (kwargs.get("params") or {}).get("chat_id")
+    limited = api_method in LIMITED_METHODS and chat_id is not None
+    level = _priority_for(chat_id)
+    repeatable = not (api_method.startswith("send") or api_method in NOT_IDEMPOTENT)
+    for attempt in range(MAX_ATTEMPTS):
+        last = attempt == MAX_ATTEMPTS - 1
+        allowed, trial = _breaker.allow()
+        if not allowed:
+            raise CircuitOpenError(f"Telegram API circuit is open; {api_method} was not sent.")
+        try:
+            if limited:
+                _limiter.acquire(chat_id, level)
+            if attempt:
+                _rewind(kwargs.get("files"))
+            try:
+                response = _http(method, url, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                _breaker.failure()
+                if last or not (repeatable or _never_sent(e)):
+                    raise
+                time.sleep(_backoff(attempt))
+                continue
+            if response.status_code == 429:
+                # Flood control still means the API is up.
+                _breaker.success()
+                wait = _retry_after(response)
+                if limited:
+                    _limiter.penalize(chat_id, wait)
+                if last or wait > MAX_RETRY_WAIT:
+                    return response
+                if not limited:
+                    # Only this caller waits; other chats keep sending.
+                    time.sleep(wait)
+                continue
+            if response.status_code >= 500:
+                _breaker.failure()
+                if last:
+                    return response
+                time.sleep(_backoff(attempt))
+                continue
+            _breaker.success()
+            return response
+        finally:
+            if trial:
+                _breaker.end_trial()
+
+def install():
+    """
+    Route all Bot API requests through send().
+    """
+    telebot.apihelper.CUSTOM_REQUEST_SENDER = send
@@ -1,12 +1,27 @@
 # account_info.py
+import html
+import json
 import telebot
-from db import get_user, add_user
+from db import get_user, add_user, get_claims_page
+from leaderboard import get_user_ranks
 from datetime import datetime
+import navigation
+from render import static_keyboard
 
+CLAIMS_PAGE_SIZE = 10
+
+@static_keyboard
+def account_info_keyboard():
+    markup = telebot.types.InlineKeyboardMarkup()
+    markup.add(telebot.types.InlineKeyboardButton("🧾 My Claims", callback_data="menu_claims"))
+    markup.add(telebot.types.InlineKeyboardButton("🔙 Back", callback_data="back_main"))
+    return markup
+
 def send_account_info(bot, update):
     """
     Displays the user's account info in a fancy ASCII box.
-    Works for both a Message or a CallbackQuery.
+    Works for both a Message or a CallbackQuery; for a CallbackQuery the
+    tapped menu is edited in place.
     
     Make sure in your main code you do:
        send_account_info(bot, call)
@@ -16,10 +31,12 @@ def send_account_info(bot, update):
     if isinstance(update, telebot.types.CallbackQuery):
         # CallbackQuery scenario
         chat_id = update.message.chat.id
+        message_id = update.message.message_id
         user_obj = update.from_user
     elif isinstance(update, telebot.types.Message):
         # Normal message scenario
         chat_id = update.chat.id
+        message_id = None
         user_obj = update.from_user
     else:
         # Unknown update type
@@ -38,6 +55,7 @@ def send_account_info(bot, update):
     join_date = user.get("join_date", "N/A")
     balance = user.get("points", 0)
     referrals = user.get("referrals", 0)
+    points_rank, referral_rank = get_user_ranks(user)
 
     # Build the fancy UI box
     text = (
@@ -48,8 +66,48 @@ def send_account_info(bot, update):
         f"┃ ✧ Join Date: {join_date}\n"
         f"┃ ✧ Balance: {balance} pts\n"
         f"┃ ✧ Total Referrals: {referrals}\n"
+        f"┃ ✧ Points Rank: #{points_rank or '-'}\n"
+        f"┃ ✧ Referral Rank: #{referral_rank or '-'}\n"
         "┃\n"
         "╰━━━━━━━✦✧✦━━━━━━━╯"
     )
 
-    bot.send_message(chat_id, text, parse_mode="HTML")
+    navigation.show(bot, chat_id, text, account_info_keyboard(), message_id=message_id, parse_mode="HTML", new=message_id is None)
+
+def claim_line(claim):
+    """
+    One line describing a claim for the claim lists.
+    """
+    item = json.loads(claim["item"])
+    what = "cookie file" if isinstance(item, dict) else str(item)
+    if len(what) > 40:
+        what = what[:39] + "…"
+    # Claimed logins are free text; the bot sends HTML.
+    what = html.escape(what)
+    when = datetime.fromtimestamp(claim["claimed_at"]).strftime("%Y-%m-%d %H:%M")
+    refunded = " (refunded)" if claim["refunded"] else ""
+    return f"#{claim['id']} {html.escape(claim['platform_name'])} | {what} | {claim['price']} pts | {when}{refunded}"
+
+def send_my_claims(bot, call, before=None):
+    """
+    Page through the user's claims, newest first. before is the
+    (claimed_at, id) of the last claim on the previous page.
+    """
+    claims, has_more = get_claims_page(str(call.from_user.id), before, limit=CLAIMS_PAGE_SIZE)
+    if claims:
+        text = "🧾 My Claims\n\n" + "\n".join(claim_line(claim) for claim in claims)
+        text += "\n\nAccount not working? Send a report with its claim number."
+    else:
+        text = "🧾 My Claims\n\n" + ("No claims yet." if before is None else "No older claims.")
+    markup = telebot.types.InlineKeyboardMarkup(row_width=2)
+    nav = []
+    if before is not None:
+        nav.append(telebot.types.InlineKeyboardButton("⏮ Newest", callback_data="menu_claims"))
+    if has_more:
+        last = claims[-1]
+        nav.append(telebot.types.InlineKeyboardButton("Older ➡️",
+                                                      callback_data=f"menu_claims_{last['claimed_at']}_{last['id']}"))
+    if nav:
+        markup.row(*nav)
+    markup.add(telebot.types.InlineKeyboardButton("🔙 Back", callback_data="menu_info"))
+    navigation.show(bot, call.message.chat.id, text, markup, message_id=call.message.message_id)
@@ -1,5 +1,5 @@
 import sqlite3
-import json
+import html
 import config
 from datetime import datetime
 from telebot import types
@@ -8,43 +8,46 @@ from db import (
     get_user,
     ban_user,
     unban_user,
-    update_user_points,
+    change_user_points,
     get_account_claim_cost,
     get_admins,
+    get_admin_ids,
+    User,
     get_platforms,
+    get_stock_count,
     rename_platform,
     update_platform_price,
+    set_account_claim_cost,
+    bump_content_version,
+    get_claims_page,
+    refund_claim,
 )
 from handlers.logs import log_event
-
-# IMPORTANT: If you encounter an error such as "table platforms has no column named platform_type",
-# it means your existing DB file was created before adding the new column.
-# To fix this, run a migration (for example, using the sqlite3 command-line):
-#   ALTER TABLE platforms ADD COLUMN platform_type TEXT DEFAULT 'account';
-# Or delete/reinitialize your DB if possible.
+import conversation
+import callbacks
+import navigation
+import claimqueue
+import notify
+from render import static_keyboard, versioned
 
 # ----------------- ADMIN CHECK -----------------
 
 def is_admin(user_or_id):
     try:
-        if isinstance(user_or_id, dict):
+        if isinstance(user_or_id, (dict, User)):
             user_id = str(user_or_id.get("telegram_id"))
         else:
             user_id = str(user_or_id.id)
     except AttributeError:
         user_id = str(user_or_id)
-    db_admins = get_admins()
-    db_admin_ids = [admin.get("user_id") for admin in db_admins]
-    return user_id in config.OWNERS or user_id in db_admin_ids
+    return user_id in config.OWNERS or user_id in get_admin_ids()
 
 # ----------------- LEND POINTS -----------------
 
 def lend_points(admin_id, user_id, points, custom_message=None):
-    user = get_user(user_id)
-    if not user:
+    new_balance = change_user_points(user_id, points, "lend", ref=admin_id)
+    if new_balance is None:
         return f"User '{user_id}' not found."
-    new_balance = user["points"] + points
-    update_user_points(user_id, new_balance)
     log_event(telebot.TeleBot(config.TOKEN), "lend", f"Admin {admin_id} lent {points} points to user {user_id}.")
     bot_instance = telebot.TeleBot(config.TOKEN)
     msg = custom_message if custom_message else f"You have been lent {points} points. Your new balance is {new_balance} points."
@@ -57,8 +60,7 @@ def lend_points(admin_id, user_id, points, custom_message=None):
 # ----------------- CONFIGURATION UPDATES -----------------
 
 def update_account_claim_cost(cost):
-    from db import set_config_value
-    set_config_value("account_claim_cost", cost)
+    set_account_claim_cost(cost)
     log_event(telebot.TeleBot(config.TOKEN), "config", f"Account claim cost updated to {cost} pts.")
 
 def update_referral_bonus(bonus):
@@ -95,26 +97,24 @@ def add_platform(platform_name, price, platform_type="account"):
         conn.close()
         return f"Platform '{platform_name}' already exists."
     c.execute(
-        "INSERT INTO platforms (platform_name, stock, price, platform_type) VALUES (?, ?, ?, ?)", 
-        (platform_name, "[]", price, platform_type)
+        "INSERT INTO platforms (platform_name, price, platform_type) VALUES (?, ?, ?)", 
+        (platform_name, price, platform_type)
     )
     conn.commit()
     c.close()
     conn.close()
+    bump_content_version("platforms")
     log_event(telebot.TeleBot(config.TOKEN), "platform", 
               f"Platform '{platform_name}' added with price {price} pts. Type: {platform_type}.")
     return None
 
 def remove_platform(platform_name):
-    conn = __import__('db').get_connection()
-    c = conn.cursor()
-    c.execute("DELETE FROM platforms WHERE platform_name = ?", (platform_name,))
-    conn.commit()
-    c.close()
-    conn.close()
+    from db import delete_platform
+    delete_platform(platform_name)
     log_event(telebot.TeleBot(config.TOKEN), "platform", f"Platform '{platform_name}' removed.")
 
-def handle_admin_platform(bot, call):
+@static_keyboard
+def platform_menu_keyboard():
     markup = types.InlineKeyboardMarkup(row_width=2)
     markup.add(
         types.InlineKeyboardButton("➕ Add Platform", callback_data="admin_platform_add"),
@@ -124,36 +124,51 @@ def handle_admin_platform(bot, call):
         types.InlineKeyboardButton("📋 Platform List", callback_data="admin_platform_list")
     )
     markup.add(types.InlineKeyboardButton("🔙 Back", callback_data="back_main"))
-    try:
-        bot.edit_message_text("Platform Management Options:", 
-                              chat_id=call.message.chat.id, 
-                              message_id=call.message.message_id, 
-                              reply_markup=markup)
-    except Exception:
-        bot.send_message(call.message.chat.id, "Platform Management Options:", reply_markup=markup)
+    return markup
+
+@versioned("platforms")
+def platform_picker(callback_prefix, back):
+    """
+    One button per platform with callback data callback_prefix + name, or
+    None if there are no platforms.
+    """
+    platforms = get_platforms()
+    if not platforms:
+        return None
+    markup = types.InlineKeyboardMarkup(row_width=2)
+    for plat in platforms:
+        plat_name = plat.get("platform_name")
+        markup.add(types.InlineKeyboardButton(plat_name, callback_data=f"{callback_prefix}{plat_name}"))
+    markup.add(types.InlineKeyboardButton("🔙 Back", callback_data=back))
+    return markup
+
+def handle_admin_platform(bot, call):
+    navigation.show(bot, call.message.chat.id, "Platform Management Options:", platform_menu_keyboard(),
+                    message_id=call.message.message_id)
 
 # ---- ADD PLATFORM FLOW (Sub-menu for Account vs Cookie) ----
 
-def handle_admin_platform_add(bot, call):
+@static_keyboard
+def platform_add_keyboard():
     markup = types.InlineKeyboardMarkup(row_width=2)
     markup.add(
         types.InlineKeyboardButton("Account Platform", callback_data="admin_platform_add_account"),
         types.InlineKeyboardButton("Cookie Platform", callback_data="admin_platform_add_cookie")
     )
     markup.add(types.InlineKeyboardButton("🔙 Back", callback_data="admin_platform"))
-    try:
-        bot.edit_message_text("Select platform type to add:", 
-                              chat_id=call.message.chat.id,
-                              message_id=call.message.message_id, 
-                              reply_markup=markup)
-    except Exception:
-        bot.send_message(call.message.chat.id, "Select platform type to add:", reply_markup=markup)
+    return markup
+
+def handle_admin_platform_add(bot, call):
+    navigation.show(bot, call.message.chat.id, "Select platform type to add:", platform_add_keyboard(),
+                    message_id=call.message.message_id)
 
+@conversation.handler("admin_account_platform_name")
 def process_account_platform_name(bot, message):
     platform_name = message.text.strip()
     msg = bot.send_message(message.chat.id, f"Enter the price for account platform '{platform_name}':")
-    bot.register_next_step_handler(msg, lambda m: process_account_platform_price(bot, m, platform_name))
+    conversation.expect(msg, "admin_account_platform_price", platform_name=platform_name)
 
+@conversation.handler("admin_account_platform_price")
 def process_account_platform_price(bot, message, platform_name):
     try:
         price = int(message.text.strip())
@@ -165,11 +180,13 @@ def process_account_platform_price(bot, message, platform_name):
     bot.send_message(message.chat.id, response)
     send_admin_menu(bot, message)
 
+@conversation.handler("admin_cookie_platform_name")
 def process_cookie_platform_name(bot, message):
     platform_name = message.text.strip()
     msg = bot.send_message(message.chat.id, f"Enter the price for cookie platform '{platform_name}':")
-    bot.register_next_step_handler(msg, lambda m: process_cookie_platform_price(bot, m, platform_name))
+    conversation.expect(msg, "admin_cookie_platform_price", platform_name=platform_name)
 
+@conversation.handler("admin_cookie_platform_price")
 def process_cookie_platform_price(bot, message, platform_name):
     try:
         price = int(message.text.strip())
@@ -184,20 +201,14 @@ def process_cookie_platform_price(bot, message, platform_name):
 # ---- Rename Platform ----
 
 def handle_admin_platform_rename(bot, call):
-    platforms = get_platforms()
-    if not platforms:
-        bot.answer_callback_query(call.id, "No platforms available.")
+    markup = platform_picker("admin_platform_rename_", "admin_platform")
+    if markup is None:
+        callbacks.answer(bot, call, "No platforms available.")
         return
-    markup = types.InlineKeyboardMarkup(row_width=2)
-    for plat in platforms:
-        plat_name = plat.get("platform_name")
-        markup.add(types.InlineKeyboardButton(plat_name, callback_data=f"admin_platform_rename_{plat_name}"))
-    markup.add(types.InlineKeyboardButton("🔙 Back", callback_data="admin_platform"))
-    bot.edit_message_text("Select a platform to rename:", 
-                          chat_id=call.message.chat.id,
-                          message_id=call.message.message_id, 
-                          reply_markup=markup)
+    navigation.show(bot, call.message.chat.id, "Select a platform to rename:", markup,
+                    message_id=call.message.message_id)
 
+@conversation.handler("admin_platform_rename")
 def process_platform_rename(bot, message, old_name):
     new_name = message.text.strip()
     rename_platform(old_name, new_name)
@@ -207,20 +218,14 @@ def process_platform_rename(bot, message, old_name):
 # ---- Change Price ----
 
 def handle_admin_platform_change_price(bot, call):
-    platforms = get_platforms()
-    if not platforms:
-        bot.answer_callback_query(call.id, "No platforms available.")
+    markup = platform_picker("admin_platform_change_price_", "admin_platform")
+    if markup is None:
+        callbacks.answer(bot, call, "No platforms available.")
         return
-    markup = types.InlineKeyboardMarkup(row_width=2)
-    for plat in platforms:
-        plat_name = plat.get("platform_name")
-        markup.add(types.InlineKeyboardButton(plat_name, callback_data=f"admin_platform_change_price_{plat_name}"))
-    markup.add(types.InlineKeyboardButton("🔙 Back", callback_data="admin_platform"))
-    bot.edit_message_text("Select a platform to change price:", 
-                          chat_id=call.message.chat.id,
-                          message_id=call.message.message_id, 
-                          reply_markup=markup)
+    navigation.show(bot, call.message.chat.id, "Select a platform to change price:", markup,
+                    message_id=call.message.message_id)
 
+@conversation.handler("admin_platform_change_price")
 def process_platform_change_price(bot, message, platform_name):
     try:
         price = int(message.text.strip())
@@ -236,34 +241,26 @@ def process_platform_change_price(bot, message, platform_name):
 def handle_admin_platform_list(bot, call):
     platforms = get_platforms()
     if not platforms:
-        bot.answer_callback_query(call.id, "No platforms available.")
+        callbacks.answer(bot, call, "No platforms available.")
         return
     text = "Platforms:\n"
     for plat in platforms:
         plat_name = plat.get("platform_name")
-        stock = json.loads(plat.get("stock") or "[]")
         price = plat.get("price")
         p_type = plat.get("platform_type", "account")
-        text += f"• {plat_name} | Type: {p_type} | Stock: {len(stock)} | Price: {price} pts\n"
+        text += f"• {plat_name} | Type: {p_type} | Stock: {plat.get('stock_count')} | Price: {price} pts\n"
     text += "\n🔙 /back to return."
     bot.edit_message_text(text, chat_id=call.message.chat.id, message_id=call.message.message_id)
 
 # ----------------- STOCK MANAGEMENT -----------------
 
 def handle_admin_stock(bot, call):
-    platforms = get_platforms()
-    if not platforms:
-        bot.answer_callback_query(call.id, "No platforms available. Add one first.")
+    markup = platform_picker("admin_stock_detail_", "back_main")
+    if markup is None:
+        callbacks.answer(bot, call, "No platforms available. Add one first.")
         return
-    markup = types.InlineKeyboardMarkup(row_width=2)
-    for plat in platforms:
-        plat_name = plat.get("platform_name")
-        markup.add(types.InlineKeyboardButton(plat_name, callback_data=f"admin_stock_detail_{plat_name}"))
-    markup.add(types.InlineKeyboardButton("🔙 Back", callback_data="back_main"))
-    bot.edit_message_text("Select a platform to manage stock:", 
-                          chat_id=call.message.chat.id,
-                          message_id=call.message.message_id, 
-                          reply_markup=markup)
+    navigation.show(bot, call.message.chat.id, "Select a platform to manage stock:", markup,
+                    message_id=call.message.message_id)
 
 def handle_admin_stock_detail(bot, call, platform_name):
     conn = __import__('db').get_connection()
@@ -277,17 +274,20 @@ def handle_admin_stock_detail(bot, call, platform_name):
         bot.send_message(call.message.chat.id, "Platform not found.")
         return
     platform = dict(platform)  # Convert row to dictionary
-    stock = json.loads(platform["stock"] or "[]")
+    stock = get_stock_count(platform_name)
     price = platform["price"]
     p_type = platform.get("platform_type", "account")
     stock_type = "Cookie file" if p_type == "cookie" else "Login pass"
     text = (f"Platform Name: {platform_name}\n"
             f"Type: {p_type}\n"
             f"Stock Type: {stock_type}\n"
-            f"Accounts Available: {len(stock)}\n"
+            f"Accounts Available: {stock}\n"
             f"Price: {price} pts")
+    queued = claimqueue.is_queued(platform_name)
     markup = types.InlineKeyboardMarkup(row_width=1)
     markup.add(types.InlineKeyboardButton("➕ Add Stock", callback_data=f"admin_stock_add_{platform_name}"))
+    markup.add(types.InlineKeyboardButton(f"🚦 Queued claims: {'ON' if queued else 'OFF'}",
+                                          callback_data=f"admin_stock_queue_{platform_name}"))
     markup.add(types.InlineKeyboardButton("🔙 Back", callback_data="admin_stock"))
     bot.edit_message_text(text, 
                           chat_id=call.message.chat.id,
@@ -310,12 +310,13 @@ def handle_admin_stock_add(bot, call, platform_name):
     p_type = platform.get("platform_type", "account")
     if p_type == "account":
         msg = bot.send_message(call.message.chat.id, f"Please send the stock text for account platform '{platform_name}':")
-        bot.register_next_step_handler(msg, lambda m: process_stock_upload_admin(bot, m, platform_name, p_type))
+        conversation.expect(msg, "admin_stock_upload", platform_name=platform_name, platform_type=p_type)
     elif p_type == "cookie":
         msg = bot.send_message(call.message.chat.id, f"Please send a TXT file or ZIP file for cookie platform '{platform_name}':")
-        bot.register_next_step_handler(msg, lambda m: process_stock_upload_admin(bot, m, platform_name, p_type))
+        conversation.expect(msg, "admin_stock_upload", platform_name=platform_name, platform_type=p_type)
 
 
+@conversation.handler("admin_stock_upload")
 def process_stock_upload_admin(bot, message, platform_name, platform_type, retries=3):
     """
     For 'account' type:
@@ -323,23 +324,12 @@ def process_stock_upload_admin(bot, message, platform_name, platform_type, retri
     For 'cookie' type:
       - We store each .txt file as a single item (no line splitting).
       - If it's a ZIP, we only parse .txt files, each one is 1 item in stock.
+      - The files go to cookie_blobs; stock items only reference them.
     Merges new items with existing stock.
     """
     import io
-    import json
     from zipfile import ZipFile, BadZipFile
-    from db import update_stock_for_platform, get_connection
-
-    # 1) Fetch existing stock from DB so we can merge instead of overwrite
-    conn = get_connection()
-    conn.row_factory = sqlite3.Row
-    c = conn.cursor()
-    c.execute("SELECT stock FROM platforms WHERE platform_name = ?", (platform_name,))
-    row = c.fetchone()
-    c.close()
-    conn.close()
-
-    current_stock = json.loads(row["stock"]) if row and row["stock"] else []
+    from db import add_stock_items, add_cookie_stock
 
     # We'll store newly parsed items in new_stock
     new_stock = []
@@ -372,13 +362,16 @@ def process_stock_upload_admin(bot, message, platform_name, platform_type, retri
             data = message.text.strip()
 
         lines = [line.strip() for line in data.splitlines() if line.strip()]
-        current_stock.extend(lines)  # Merge new lines with existing
-        update_stock_for_platform(platform_name, current_stock)
+        # New lines are appended to the existing stock
+        total = add_stock_items(platform_name, lines)
+        if total is None:
+            bot.send_message(message.chat.id, f"Platform '{platform_name}' no longer exists.")
+            return
 
         bot.send_message(
             message.chat.id,
             f"Stock for '{platform_name}' updated. "
-            f"{len(lines)} new items added. Total stock: {len(current_stock)}"
+            f"{len(lines)} new items added. Total stock: {total}"
         )
         send_admin_menu(bot, message)
         return
@@ -398,11 +391,7 @@ def process_stock_upload_admin(bot, message, platform_name, platform_type, retri
 
         # Single .txt => store entire file as one item
         if filename.endswith(".txt"):
-            try:
-                content = downloaded_file.decode('utf-8')
-            except UnicodeDecodeError:
-                content = downloaded_file.decode('latin-1', errors='replace')
-            new_stock.append({"type": "cookie", "content": content})
+            new_stock.append(downloaded_file)
 
         # ZIP => for each .txt inside, store entire file as one item
         elif filename.endswith(".zip"):
@@ -410,13 +399,8 @@ def process_stock_upload_admin(bot, message, platform_name, platform_type, retri
                 zip_file = ZipFile(io.BytesIO(downloaded_file))
                 for f_name in zip_file.namelist():
                     if f_name.lower().endswith(".txt"):
-                        with zip_file.open(f_name) as f:
-                            try:
-                                content = f.read().decode('utf-8')
-                            except UnicodeDecodeError:
-                                content = f.read().decode('latin-1', errors='replace')
-                            # Each .txt file => 1 item
-                            new_stock.append({"type": "cookie", "content": content})
+                        # Each .txt file => 1 item
+                        new_stock.append(zip_file.read(f_name))
             except BadZipFile as e:
                 bot.send_message(message.chat.id, f"Invalid ZIP file: {e}")
                 return
@@ -424,13 +408,15 @@ def process_stock_upload_admin(bot, message, platform_name, platform_type, retri
             bot.send_message(message.chat.id, "Unsupported file type. Please send a TXT or ZIP file.")
             return
 
-        # Merge new cookie items with existing stock
-        current_stock.extend(new_stock)
-        update_stock_for_platform(platform_name, current_stock)
+        # Files are stored compressed and deduplicated; stock only gets references
+        total = add_cookie_stock(platform_name, new_stock)
+        if total is None:
+            bot.send_message(message.chat.id, f"Platform '{platform_name}' no longer exists.")
+            return
 
         bot.send_message(
             message.chat.id,
-            f"Cookie stock updated. {len(new_stock)} new file(s) added. Total stock: {len(current_stock)}"
+            f"Cookie stock updated. {len(new_stock)} new file(s) added. Total stock: {total}"
         )
         send_admin_menu(bot, message)
         return
@@ -472,20 +458,25 @@ def get_channels():
     conn.close()
     return [dict(ch) for ch in channels]
 
-def handle_admin_channel(bot, call):
+@static_keyboard
+def channel_menu_keyboard():
     markup = types.InlineKeyboardMarkup(row_width=2)
     markup.add(
         types.InlineKeyboardButton("➕ Add Channel", callback_data="admin_channel_add"),
         types.InlineKeyboardButton("➖ Remove Channel", callback_data="admin_channel_remove")
     )
     markup.add(types.InlineKeyboardButton("🔙 Back", callback_data="back_main"))
-    bot.edit_message_text("Channel Management", chat_id=call.message.chat.id,
-                          message_id=call.message.message_id, reply_markup=markup)
+    return markup
+
+def handle_admin_channel(bot, call):
+    navigation.show(bot, call.message.chat.id, "Channel Management", channel_menu_keyboard(),
+                    message_id=call.message.message_id)
 
 def handle_admin_channel_add(bot, call):
     msg = bot.send_message(call.message.chat.id, "Please send the channel link to add:")
-    bot.register_next_step_handler(msg, lambda m: process_channel_add(bot, m))
+    conversation.expect(msg, "admin_channel_add")
 
+@conversation.handler("admin_channel_add")
 def process_channel_add(bot, message):
     channel_link = message.text.strip()
     add_channel(channel_link)
@@ -496,7 +487,7 @@ def process_channel_add(bot, message):
 def handle_admin_channel_remove(bot, call):
     channels = get_channels()
     if not channels:
-        bot.answer_callback_query(call.id, "No channels to remove.")
+        callbacks.answer(bot, call, "No channels to remove.")
         return
     markup = types.InlineKeyboardMarkup(row_width=1)
     for channel in channels:
@@ -509,12 +500,13 @@ def handle_admin_channel_remove(bot, call):
 
 def handle_admin_channel_rm(bot, call, channel_id):
     remove_channel(channel_id)
-    bot.answer_callback_query(call.id, "Channel removed.")
+    callbacks.answer(bot, call, "Channel removed.")
     handle_admin_channel(bot, call)
 
 # ----------------- ADMIN MANAGEMENT (User/Admin Lists) -----------------
 
-def handle_admin_manage(bot, call):
+@static_keyboard
+def admin_manage_keyboard():
     markup = types.InlineKeyboardMarkup(row_width=2)
     markup.add(
         types.InlineKeyboardButton("👥 Admin List", callback_data="admin_list"),
@@ -525,8 +517,11 @@ def handle_admin_manage(bot, call):
         types.InlineKeyboardButton("➕ Add Admin", callback_data="admin_add")
     )
     markup.add(types.InlineKeyboardButton("🔙 Back", callback_data="back_main"))
-    bot.edit_message_text("Admin Management", chat_id=call.message.chat.id,
-                          message_id=call.message.message_id, reply_markup=markup)
+    return markup
+
+def handle_admin_manage(bot, call):
+    navigation.show(bot, call.message.chat.id, "Admin Management", admin_manage_keyboard(),
+                    message_id=call.message.message_id)
 
 def handle_admin_list(bot, call):
     admins = get_admins()
@@ -541,8 +536,9 @@ def handle_admin_list(bot, call):
 
 def handle_admin_ban_unban(bot, call):
     msg = bot.send_message(call.message.chat.id, "Please send the admin UserID to ban/unban:")
-    bot.register_next_step_handler(msg, lambda m: process_admin_ban_unban(bot, m))
+    conversation.expect(msg, "admin_ban_unban")
 
+@conversation.handler("admin_ban_unban")
 def process_admin_ban_unban(bot, message):
     user_id = message.text.strip()
     from db import get_connection
@@ -567,8 +563,9 @@ def process_admin_ban_unban(bot, message):
 
 def handle_admin_remove(bot, call):
     msg = bot.send_message(call.message.chat.id, "Please send the admin UserID to remove:")
-    bot.register_next_step_handler(msg, lambda m: process_admin_remove(bot, m))
+    conversation.expect(msg, "admin_remove")
 
+@conversation.handler("admin_remove")
 def process_admin_remove(bot, message):
     user_id = message.text.strip()
     from db import get_connection
@@ -584,8 +581,9 @@ def process_admin_remove(bot, message):
 
 def handle_admin_add(bot, call):
     msg = bot.send_message(call.message.chat.id, "Please send the UserID and Username (separated by space) to add as admin:")
-    bot.register_next_step_handler(msg, lambda m: process_admin_add(bot, m))
+    conversation.expect(msg, "admin_add")
 
+@conversation.handler("admin_add")
 def process_admin_add(bot, message):
     parts = message.text.strip().split()
     if len(parts) < 2:
@@ -611,20 +609,9 @@ def process_admin_add(bot, message):
 
 # ----------------- USER MANAGEMENT (Admin Panel) -----------------
 
-def handle_user_management(bot, call):
-    from db import get_connection
-    conn = get_connection()
-    conn.row_factory = sqlite3.Row
-    c = conn.cursor()
-    c.execute("SELECT * FROM users")
-    # Convert each row to a dictionary so .get() works
-    users = [dict(u) for u in c.fetchall()]
-    c.close()
-    conn.close()
-    if not users:
-        bot.answer_callback_query(call.id, "No users found.")
-        return
-    markup = types.InlineKeyboardMarkup(row_width=1)
+USERS_PAGE_SIZE = 10
+
+def user_buttons(markup, users):
     for u in users:
         uid = u.get("telegram_id")
         username = u.get("username")
@@ -633,16 +620,63 @@ def handle_user_management(bot, call):
         btn_text = f"{username} ({uid}) - {status}"
         callback_data = f"admin_user_{uid}"
         markup.add(types.InlineKeyboardButton(btn_text, callback_data=callback_data))
+
+@versioned("users")
+def users_page_keyboard(after_id, before_id):
+    """
+    The user list page at the given cursor, or None if there are no users.
+    """
+    from db import get_users_page
+    users, has_prev, has_next = get_users_page(after_id, before_id, limit=USERS_PAGE_SIZE)
+    if not users and after_id is None and before_id is None:
+        return None
+    markup = types.InlineKeyboardMarkup(row_width=2)
+    user_buttons(markup, users)
+    nav = []
+    if has_prev and users:
+        nav.append(types.InlineKeyboardButton("⬅️ Prev", callback_data=f"admin_users_prev_{users[0]['telegram_id']}"))
+    if has_next and users:
+        nav.append(types.InlineKeyboardButton("Next ➡️", callback_data=f"admin_users_next_{users[-1]['telegram_id']}"))
+    if nav:
+        markup.row(*nav)
+    markup.add(types.InlineKeyboardButton("🔍 Search", callback_data="admin_users_search"))
     markup.add(types.InlineKeyboardButton("🔙 Back", callback_data="back_main"))
-    bot.edit_message_text("User Management\nSelect a user to manage:", 
-                            chat_id=call.message.chat.id,
-                            message_id=call.message.message_id,
-                            reply_markup=markup)
+    return markup
+
+def handle_user_management(bot, call, after_id=None, before_id=None):
+    """
+    Show one page of users. Pages are keyset-paginated on telegram_id, and the
+    Prev/Next buttons carry the boundary ID as their cursor.
+    """
+    markup = users_page_keyboard(after_id, before_id)
+    if markup is None:
+        callbacks.answer(bot, call, "No users found.")
+        return
+    navigation.show(bot, call.message.chat.id, "User Management\nSelect a user to manage:", markup,
+                    message_id=call.message.message_id)
+
+def handle_user_search(bot, call):
+    msg = bot.send_message(call.message.chat.id, "Send a user ID or username (or the start of one) to search:")
+    conversation.expect(msg, "admin_user_search")
+
+@conversation.handler("admin_user_search")
+def process_user_search(bot, message):
+    from db import search_users
+    query = (message.text or "").strip()
+    users = search_users(query, limit=USERS_PAGE_SIZE)
+    if not users:
+        bot.send_message(message.chat.id, f"No users found matching '{query}'.")
+        send_admin_menu(bot, message)
+        return
+    markup = types.InlineKeyboardMarkup(row_width=1)
+    user_buttons(markup, users)
+    markup.add(types.InlineKeyboardButton("🔙 Back", callback_data="admin_users"))
+    bot.send_message(message.chat.id, f"Users matching '{query}':", reply_markup=markup)
 
 def handle_user_management_detail(bot, call, user_id):
-    user = get_user(user_id)  # get_user returns a dictionary
+    user = get_user(user_id)
     if not user:
-        bot.answer_callback_query(call.id, "User not found.")
+        callbacks.answer(bot, call, "User not found.")
         return
     status = "Banned" if user.get("banned", 0) else "Active"
     text = (f"User Management\n\n"
@@ -657,6 +691,7 @@ def handle_user_management_detail(bot, call, user_id):
         markup.add(types.InlineKeyboardButton("Unban", callback_data=f"admin_user_{user_id}_unban"))
     else:
         markup.add(types.InlineKeyboardButton("Ban", callback_data=f"admin_user_{user_id}_ban"))
+    markup.add(types.InlineKeyboardButton("🧾 Claims", callback_data=f"admin_claims_{user_id}"))
     markup.add(types.InlineKeyboardButton("🔙 Back", callback_data="admin_users"))
     try:
         bot.edit_message_text(text, 
@@ -677,15 +712,71 @@ def handle_user_ban_action(bot, call, user_id, action):
         log_event(bot, "unban", f"User {user_id} unbanned by admin {call.from_user.id}.", user=call.from_user)
     else:
         result_text = "Invalid action."
-    bot.answer_callback_query(call.id, result_text)
+    callbacks.answer(bot, call, result_text)
     handle_user_management_detail(bot, call, user_id)
 
+def handle_admin_claims(bot, call, user_id, before=None):
+    """
+    A user's claims, newest first, with a one-tap refund for each claim that
+    hasn't been refunded yet.
+    """
+    from handlers.account_info import claim_line, CLAIMS_PAGE_SIZE
+    claims, has_more = get_claims_page(user_id, before, limit=CLAIMS_PAGE_SIZE)
+    text = f"Claims by {user_id}\n\n" + ("\n".join(claim_line(claim) for claim in claims) or "No claims.")
+    markup = types.InlineKeyboardMarkup(row_width=2)
+    refunds = [types.InlineKeyboardButton(f"💸 Refund #{claim['id']} ({claim['price']} pts)",
+                                          callback_data=f"admin_refund_{claim['id']}")
+               for claim in claims if not claim["refunded"]]
+    if refunds:
+        markup.add(*refunds)
+    if has_more:
+        last = claims[-1]
+        markup.add(types.InlineKeyboardButton("Older ➡️",
+                                              callback_data=f"admin_claims_{user_id}_{last['claimed_at']}_{last['id']}"))
+    markup.add(types.InlineKeyboardButton("🔙 Back", callback_data=f"admin_user_{user_id}"))
+    navigation.show(bot, call.message.chat.id, text, markup, message_id=call.message.message_id)
+
+def handle_admin_refund(bot, call, claim_id):
+    claim, result = refund_claim(claim_id)
+    if claim is None:
+        callbacks.answer(bot, call, result, show_alert=True)
+        return
+    user_id = claim["user_id"]
+    callbacks.answer(bot, call, f"Refunded {claim['price']} pts to {user_id}.")
+    log_event(bot, "refund", f"Admin {call.from_user.id} refunded claim #{claim_id} ({claim['platform_name']}, "
+                             f"{claim['price']} pts) to user {user_id}. New balance: {result} pts.", user=call.from_user)
+    notify.deliver(bot.send_message, user_id,
+                   f"💸 Your claim #{claim_id} ({html.escape(claim['platform_name'])}) was refunded: {claim['price']} pts. "
+                   f"Your new balance is {result} pts.",
+                   label=f"refund notice for claim #{claim_id}")
+    handle_admin_claims(bot, call, user_id)
+
+# ----------------- DASHBOARD -----------------
+
+@static_keyboard
+def dashboard_keyboard():
+    markup = types.InlineKeyboardMarkup()
+    markup.add(types.InlineKeyboardButton("🔙 Back", callback_data="menu_admin"))
+    return markup
+
+def handle_admin_dashboard(bot, call):
+    from db import get_stats_counters
+    stats = get_stats_counters()  # single-row lookup, no table scans
+    text = ("📊 Dashboard\n\n"
+            f"Total Users: {stats['total_users']}\n"
+            f"Banned Users: {stats['banned_users']}\n"
+            f"Points in Circulation: {stats['total_points']}\n"
+            f"Accounts Claimed: {stats['total_claims']}\n"
+            f"Stock Available: {stats['total_stock']}\n"
+            f"Keys Outstanding: {stats['keys_outstanding']}")
+    navigation.show(bot, call.message.chat.id, text, dashboard_keyboard(), message_id=call.message.message_id)
+
 # ----------------- ADMIN CALLBACK HANDLER -----------------
 
 def admin_callback_handler(bot, call):
     data = call.data
     if not (str(call.from_user.id) in config.OWNERS or is_admin(call.from_user)):
-        bot.answer_callback_query(call.id, "Access prohibited.")
+        callbacks.answer(bot, call, "Access prohibited.")
         return
     if data == "admin_platform":
         handle_admin_platform(bot, call)
@@ -693,14 +784,14 @@ def admin_callback_handler(bot, call):
         handle_admin_platform_add(bot, call)
     elif data == "admin_platform_add_account":
         msg = bot.send_message(call.message.chat.id, "Please send the account platform name:")
-        bot.register_next_step_handler(msg, lambda m: process_account_platform_name(bot, m))
+        conversation.expect(msg, "admin_account_platform_name")
     elif data == "admin_platform_add_cookie":
         msg = bot.send_message(call.message.chat.id, "Please send the cookie platform name:")
-        bot.register_next_step_handler(msg, lambda m: process_cookie_platform_name(bot, m))
+        conversation.expect(msg, "admin_cookie_platform_name")
     elif data == "admin_platform_remove":
         platforms = get_platforms()
         if not platforms:
-            bot.answer_callback_query(call.id, "No platforms to remove.")
+            callbacks.answer(bot, call, "No platforms to remove.")
             return
         markup = types.InlineKeyboardMarkup(row_width=2)
         for plat in platforms:
@@ -712,20 +803,20 @@ def admin_callback_handler(bot, call):
     elif data.startswith("admin_platform_rm_"):
         platform_name = data.split("admin_platform_rm_")[1]
         remove_platform(platform_name)
-        bot.answer_callback_query(call.id, f"Platform '{platform_name}' removed.")
+        callbacks.answer(bot, call, f"Platform '{platform_name}' removed.")
         handle_admin_platform(bot, call)
     elif data == "admin_platform_rename":
         handle_admin_platform_rename(bot, call)
     elif data.startswith("admin_platform_rename_"):
         old_name = data.split("admin_platform_rename_")[1]
         msg = bot.send_message(call.message.chat.id, f"Send new name for platform '{old_name}':")
-        bot.register_next_step_handler(msg, lambda m: process_platform_rename(bot, m, old_name))
+        conversation.expect(msg, "admin_platform_rename", old_name=old_name)
     elif data == "admin_platform_change_price":
         handle_admin_platform_change_price(bot, call)
     elif data.startswith("admin_platform_change_price_"):
         platform_name = data.split("admin_platform_change_price_")[1]
         msg = bot.send_message(call.message.chat.id, f"Send new price for platform '{platform_name}':")
-        bot.register_next_step_handler(msg, lambda m: process_platform_change_price(bot, m, platform_name))
+        conversation.expect(msg, "admin_platform_change_price", platform_name=platform_name)
     elif data == "admin_platform_list":
         handle_admin_platform_list(bot, call)
     elif data == "admin_stock":
@@ -736,6 +827,10 @@ def admin_callback_handler(bot, call):
     elif data.startswith("admin_stock_add_"):
         platform_name = data.split("admin_stock_add_")[1]
         handle_admin_stock_add(bot, call, platform_name)
+    elif data.startswith("admin_stock_queue_"):
+        platform_name = data.split("admin_stock_queue_")[1]
+        claimqueue.set_queued(platform_name, not claimqueue.is_queued(platform_name))
+        handle_admin_stock_detail(bot, call, platform_name)
     elif data == "admin_channel":
         handle_admin_channel(bot, call)
     elif data == "admin_channel_add":
@@ -757,6 +852,21 @@ def admin_callback_handler(bot, call):
         handle_admin_add(bot, call)
     elif data == "admin_users":
         handle_user_management(bot, call)
+    elif data.startswith("admin_users_next_"):
+        handle_user_management(bot, call, after_id=data.split("admin_users_next_")[1])
+    elif data.startswith("admin_users_prev_"):
+        handle_user_management(bot, call, before_id=data.split("admin_users_prev_")[1])
+    elif data == "admin_users_search":
+        handle_user_search(bot, call)
+    elif data == "admin_dashboard":
+        handle_admin_dashboard(bot, call)
+    elif data.startswith("admin_claims_"):
+        # admin_claims_<user id>, or ..._<claimed_at>_<id> for an older page
+        parts = data[len("admin_claims_"):].split("_")
+        before = (int(parts[1]), int(parts[2])) if len(parts) == 3 else None
+        handle_admin_claims(bot, call, parts[0], before)
+    elif data.startswith("admin_refund_"):
+        handle_admin_refund(bot, call, int(data[len("admin_refund_"):]))
     elif data.startswith("admin_user_") and data.count("_") == 2:
         user_id = data.split("_")[2]
         handle_user_management_detail(bot, call, user_id)
@@ -769,11 +879,12 @@ def admin_callback_handler(bot, call):
         from handlers.main_menu import send_main_menu
         send_main_menu(bot, call)
     else:
-        bot.answer_callback_query(call.id, "Unknown admin command.")
+        callbacks.answer(bot, call, "Unknown admin command.")
 
 # ----------------- SEND ADMIN MENU -----------------
 
-def send_admin_menu(bot, update):
+@static_keyboard
+def admin_menu_keyboard():
     markup = types.InlineKeyboardMarkup(row_width=2)
     markup.add(
         types.InlineKeyboardButton("📺 Platform Mgmt", callback_data="admin_platform"),
@@ -781,14 +892,16 @@ def send_admin_menu(bot, update):
         types.InlineKeyboardButton("🔗 Channel Mgmt", callback_data="admin_channel"),
         types.InlineKeyboardButton("👥 Admin Mgmt", callback_data="admin_manage"),
         types.InlineKeyboardButton("👤 User Mgmt", callback_data="admin_users"),
-        types.InlineKeyboardButton("➕ Add Admin", callback_data="admin_add")
+        types.InlineKeyboardButton("➕ Add Admin", callback_data="admin_add"),
+        types.InlineKeyboardButton("📊 Dashboard", callback_data="admin_dashboard"),
+        types.InlineKeyboardButton("📋 Reports", callback_data="reports_open")
     )
     markup.add(types.InlineKeyboardButton("🔙 Main Menu", callback_data="back_main"))
-    try:
-        if hasattr(update, "message") and update.message:
-            bot.edit_message_text("🛠 Admin Panel", chat_id=update.message.chat.id,
-                                  message_id=update.message.message_id, reply_markup=markup)
-        else:
-            bot.send_message(update.chat.id, "🛠 Admin Panel", reply_markup=markup)
-    except Exception:
-        bot.send_message(update.chat.id, "🛠 Admin Panel", reply_markup=markup)
+    return markup
+
+def send_admin_menu(bot, update):
+    markup = admin_menu_keyboard()
+    if hasattr(update, "message") and update.message:
+        navigation.show(bot, update.message.chat.id, "🛠 Admin Panel", markup, message_id=update.message.message_id)
+    else:
+        navigation.show(bot, update.chat.id, "🛠 Admin Panel", markup, new=True)
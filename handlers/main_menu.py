@@ -2,20 +2,13 @@ from telebot import types
 from db import get_user
 from handlers.admin import is_admin
 from bot_instance import bot  # Import bot from bot_instance
+from leaderboard import points_board, referral_board, get_user_ranks
+import conversation
+import navigation
+from render import static_keyboard
 
-def send_main_menu(bot, update):
-    # Fetch user details
-    if hasattr(update, "message") and update.message:
-        chat_id = update.message.chat.id
-        user = get_user(str(update.message.from_user.id))
-    elif hasattr(update, "from_user") and update.from_user:
-        chat_id = update.chat.id if hasattr(update, "message") and update.message else update.chat.id
-        user = get_user(str(update.from_user.id))
-    else:
-        chat_id = update.chat.id
-        user = get_user(str(update.from_user.id))
-    
-    # Create the main menu
+@static_keyboard
+def main_menu_keyboard(admin):
     markup = types.InlineKeyboardMarkup(row_width=3)
     markup.add(
         types.InlineKeyboardButton("🎉 Rewards", callback_data="menu_rewards"),
@@ -28,56 +21,83 @@ def send_main_menu(bot, update):
         types.InlineKeyboardButton("📣 Report", callback_data="menu_report"),
         types.InlineKeyboardButton("💬 Support", callback_data="menu_support")
     )
-
     # Show admin options if the user is an admin
-    if is_admin(user):
+    if admin:
         markup.add(types.InlineKeyboardButton("🔨 Admin Panel", callback_data="menu_admin"))
+    return markup
 
-    # Send the main menu
-    bot.send_message(chat_id, "Main Menu\nPlease choose an option:", reply_markup=markup)
-
-@bot.callback_query_handler(func=lambda call: call.data == "menu_leaderboard")
-def leaderboard_menu(call):
-    # Create markup for leaderboard section
+@static_keyboard
+def leaderboard_keyboard():
     markup = types.InlineKeyboardMarkup(row_width=2)
     markup.add(
         types.InlineKeyboardButton("🏅 Points Leaderboard", callback_data="leaderboard_points"),
         types.InlineKeyboardButton("📊 Referral Leaderboard", callback_data="leaderboard_referral")
     )
     markup.add(types.InlineKeyboardButton("🔙 Back", callback_data="back_main"))
-    
-    # Send the leaderboard section
-    bot.edit_message_text("Welcome to the Leaderboard Section. Choose below:", chat_id=call.message.chat.id, message_id=call.message.message_id, reply_markup=markup)
+    return markup
 
-@bot.callback_query_handler(func=lambda call: call.data == "leaderboard_points")
-def points_leaderboard(call):
-    # Fetch the points leaderboard
-    leaderboard = get_leaderboard()  # Fetch top leaderboard from DB
+@static_keyboard
+def leaderboard_back_keyboard():
+    markup = types.InlineKeyboardMarkup()
+    markup.add(types.InlineKeyboardButton("🔙 Back", callback_data="menu_leaderboard"))
+    return markup
+
+def send_main_menu(bot, update):
+    """
+    Show the main menu. For a button tap (CallbackQuery) the tapped message is
+    edited in place; for a typed command a new menu message is sent.
+    """
+    if isinstance(update, types.CallbackQuery):
+        chat_id, message_id = update.message.chat.id, update.message.message_id
+    else:
+        chat_id, message_id = update.chat.id, None
+    user = get_user(str(update.from_user.id))
+    markup = main_menu_keyboard(is_admin(user))
+    navigation.show(bot, chat_id, "Main Menu\nPlease choose an option:", markup,
+                    message_id=message_id, new=message_id is None)
+
+@bot.callback_query_handler(func=lambda call: call.data == "menu_leaderboard")
+def leaderboard_menu(call):
+    navigation.show(bot, call.message.chat.id, "Welcome to the Leaderboard Section. Choose below:", leaderboard_keyboard(),
+                    message_id=call.message.message_id)
+
+def render_points_leaderboard(leaderboard):
     text = "Points Leaderboard:\n\n"
     for rank, user in enumerate(leaderboard, 1):
         text += f"{rank}. {user['username']} - {user['points']} points\n"
-    
-    # Add back button
-    markup = types.InlineKeyboardMarkup()
-    markup.add(types.InlineKeyboardButton("🔙 Back", callback_data="menu_leaderboard"))
-    
+    return text
+
+@bot.callback_query_handler(func=lambda call: call.data == "leaderboard_points")
+def points_leaderboard(call):
+    # Top K comes from memory; only the caller's own row is read, by primary key.
+    text = points_board.text(render_points_leaderboard)
+    user = get_user(str(call.from_user.id))
+    if user:
+        text += f"\nYour rank: #{get_user_ranks(user)[0] or '-'} ({user.get('points', 0)} points)"
+
+    markup = leaderboard_back_keyboard()
+
     # Show points leaderboard
-    bot.edit_message_text(text, chat_id=call.message.chat.id, message_id=call.message.message_id, reply_markup=markup)
+    navigation.show(bot, call.message.chat.id, text, markup, message_id=call.message.message_id)
 
-@bot.callback_query_handler(func=lambda call: call.data == "leaderboard_referral")
-def referral_leaderboard(call):
-    # Fetch the referral leaderboard
-    leaderboard = get_referral_leaderboard()  # Fetch referral leaderboard
+def render_referral_leaderboard(leaderboard):
     text = "Referral Leaderboard:\n\n"
     for rank, user in enumerate(leaderboard, 1):
         text += f"{rank}. {user['username']} - {user['referrals']} referrals\n"
-    
-    # Add back button
-    markup = types.InlineKeyboardMarkup()
-    markup.add(types.InlineKeyboardButton("🔙 Back", callback_data="menu_leaderboard"))
-    
+    return text
+
+@bot.callback_query_handler(func=lambda call: call.data == "leaderboard_referral")
+def referral_leaderboard(call):
+    # Top K over users.referrals comes from memory; no GROUP BY join.
+    text = referral_board.text(render_referral_leaderboard)
+    user = get_user(str(call.from_user.id))
+    if user:
+        text += f"\nYour rank: #{get_user_ranks(user)[1] or '-'} ({user.get('referrals', 0)} referrals)"
+
+    markup = leaderboard_back_keyboard()
+
     # Show referral leaderboard
-    bot.edit_message_text(text, chat_id=call.message.chat.id, message_id=call.message.message_id, reply_markup=markup)
+    navigation.show(bot, call.message.chat.id, text, markup, message_id=call.message.message_id)
 
 @bot.callback_query_handler(func=lambda call: call.data == "menu_rewards")
 def rewards_menu(call):
@@ -89,7 +109,7 @@ def account_info(call):
 
 @bot.callback_query_handler(func=lambda call: call.data == "menu_referral")
 def referral_menu(call):
-    send_referral_menu(bot, call.message)
+    send_referral_menu(bot, call)
 
 @bot.callback_query_handler(func=lambda call: call.data == "menu_review")
 def review_menu(call):
@@ -98,7 +118,7 @@ def review_menu(call):
 @bot.callback_query_handler(func=lambda call: call.data == "menu_report")
 def report_menu(call):
     msg = bot.send_message(call.message.chat.id, "📝 Please type your report message (you may attach a photo or document):", reply_to_message_id=call.message.message_id)
-    bot.register_next_step_handler(msg, lambda m: process_report(bot, m))
+    conversation.expect(msg, "report")
 
 @bot.callback_query_handler(func=lambda call: call.data == "menu_support")
 def support_menu(call):
@@ -107,12 +127,8 @@ def support_menu(call):
 
 @bot.callback_query_handler(func=lambda call: call.data == "menu_admin")
 def admin_menu(call):
-    send_admin_menu(bot, call.message)
+    send_admin_menu(bot, call)
 
 @bot.callback_query_handler(func=lambda call: call.data == "back_main")
 def callback_back_main(call):
-    try:
-        bot.delete_message(call.message.chat.id, call.message.message_id)
-    except Exception as e:
-        print("Error deleting message:", e)
-    send_main_menu(bot, call.message)
+    send_main_menu(bot, call)
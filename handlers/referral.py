@@ -2,6 +2,8 @@ import telebot
 import config
 from db import get_user, clear_pending_referral, add_referral, update_user_verified
 from handlers.logs import log_event
+import navigation
+from render import static_keyboard
 
 def extract_referral_code(message):
     if message.text and "ref_" in message.text:
@@ -30,21 +32,24 @@ def process_verified_referral(telegram_id, bot_instance):
             print(f"Error notifying referrer: {e}")
         log_event(bot_instance, "referral", f"User {referrer_id} referred user {user.get('telegram_id')}.")
 
-def send_referral_menu(bot, message):
-    telegram_id = str(message.from_user.id)
-    text = """🔗 𝗥𝗲𝗳𝗲𝗿𝗿𝗮𝗹 𝗦𝘆𝘀𝘁𝗲𝗺 🔗
+REFERRAL_MENU_TEXT = """🔗 𝗥𝗲𝗳𝗲𝗿𝗿𝗮𝗹 𝗦𝘆𝘀𝘁𝗲𝗺 🔗
 ══════ ⌁ ══════
 💡 Your referral link is below!
 🎁 Earn 🎯 10 Points per referral!
 ══════ ⌁ ══════
 """
-    # Create the markup
+
+@static_keyboard
+def referral_keyboard():
     markup = telebot.types.InlineKeyboardMarkup()
     markup.add(telebot.types.InlineKeyboardButton("🌟 Get Referral Link", callback_data="get_ref_link"))
     markup.add(telebot.types.InlineKeyboardButton("🔙 Back", callback_data="back_main"))
+    return markup
 
-    # Send the referral message
-    bot.send_message(message.chat.id, text, reply_markup=markup, parse_mode="HTML")
+def send_referral_menu(bot, call):
+    # Show the referral menu in place of the tapped one
+    navigation.show(bot, call.message.chat.id, REFERRAL_MENU_TEXT, referral_keyboard(),
+                    message_id=call.message.message_id, parse_mode="HTML")
 
 def get_referral_link(telegram_id):
     return f"https://t.me/{config.BOT_USERNAME}?start=ref_{telegram_id}"
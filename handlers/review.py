@@ -1,34 +1,48 @@
 import telebot
 import config
-from db import add_review, get_report_by_id, claim_report_by_admin, close_report_in_db
+from db import (
+    add_review,
+    create_report,
+    get_report_by_id,
+    claim_report_by_admin,
+    close_report_in_db,
+    add_report_messages,
+    get_report_messages,
+    get_report_id_for_message,
+    get_reports_page,
+)
 from handlers.logs import log_event
+import conversation
+import notify
+import digest
+import callbacks
 
 def prompt_review(bot, message):
     """
     Prompt the user to send a review or suggestion.
     """
     msg = bot.send_message(message.chat.id, "💬 Please send your review or suggestion:")
-    bot.register_next_step_handler(msg, process_review, bot)
+    conversation.expect(msg, "review")
 
+@conversation.handler("review")
 def process_review(bot, message):
     """
     Process a review or suggestion from the user.
     """
     review_text = message.text
     add_review(str(message.from_user.id), review_text)
-    for owner in config.OWNERS:
-        try:
-            bot.send_message(owner,
-                             f"📢 Review from {message.from_user.username or message.from_user.first_name} ({message.from_user.id}):\n\n{review_text}",
-                             parse_mode="Markdown")
-        except Exception as e:
-            print(f"Error sending review to owner {owner}: {e}")
     bot.send_message(message.chat.id, "✅ Thank you for your feedback!", parse_mode="Markdown")
+    text = f"📢 Review from {message.from_user.username or message.from_user.first_name} ({message.from_user.id}):\n\n{review_text}"
+    # Owners in digest mode get this review in their next digest instead.
+    for owner in digest.instant_owners():
+        notify.deliver(bot.send_message, owner, text, parse_mode="Markdown", label=f"review to owner {owner}")
+    digest.review_added()
     log_event(bot, "review", f"Review received from user {message.from_user.id}.", user=message.from_user)
 
+@conversation.handler("report")
 def process_report(bot, message):
     """
-    Process a report from the user and forward it to the owners.
+    Store a report from the user as a ticket and forward it to the owners.
     This function supports text reports as well as media (photo or document) with captions.
     """
     # Combine caption and text if available.
@@ -42,95 +56,156 @@ def process_report(bot, message):
         else:
             report_text = message.text
 
+    media_type, file_id = None, None
+    if message.content_type == "photo":
+        # Use highest-resolution photo.
+        media_type, file_id = "photo", message.photo[-1].file_id
+    elif message.content_type == "document":
+        media_type, file_id = "document", message.document.file_id
+
     user = message.from_user
+    report_id = create_report(str(user.id), str(message.chat.id), report_text, media_type, file_id)
     username = user.username if user.username else user.first_name
-    report_header = f"Report from {username} ({user.id}):\n\n"
+    report_header = f"Report #{report_id} from {username} ({user.id}):\n\n"
+    markup = report_markup(report_id, "open")
 
-    # Add buttons for claim and close functionality.
-    markup = telebot.types.InlineKeyboardMarkup(row_width=2)
-    markup.add(
-        telebot.types.InlineKeyboardButton("✅ Claim Report", callback_data=f"claim_report_{message.message_id}"),
-        telebot.types.InlineKeyboardButton("❌ Close Report", callback_data=f"close_report_{message.message_id}")
-    )
+    bot.send_message(message.chat.id, f"✅ Your report #{report_id} has been submitted. Thank you!")
 
-    # Send report to all owners with buttons
+    # Send report to all owners with buttons in the background, remembering
+    # each copy so replies and claims can find the ticket. Media is copied
+    # from the user's message, so Telegram reuses the file instead of a re-upload.
     for owner in config.OWNERS:
+        def remember(sent, owner=owner):
+            add_report_messages(report_id, [(owner, sent.message_id)])
+        if media_type:
+            notify.deliver(bot.copy_message, owner, message.chat.id, message.message_id,
+                           caption=report_header + report_text, parse_mode="HTML", reply_markup=markup,
+                           on_sent=remember, label=f"report #{report_id} to owner {owner}")
+        else:
+            notify.deliver(bot.send_message, owner, report_header + report_text, parse_mode="HTML",
+                           reply_markup=markup, on_sent=remember, label=f"report #{report_id} to owner {owner}")
+
+def report_markup(report_id, status):
+    """
+    Buttons for a report: Claim and Close while open, Close once claimed.
+    """
+    markup = telebot.types.InlineKeyboardMarkup(row_width=2)
+    buttons = []
+    if status == "open":
+        buttons.append(telebot.types.InlineKeyboardButton("✅ Claim Report", callback_data=f"claim_report_{report_id}"))
+    if status in ("open", "claimed"):
+        buttons.append(telebot.types.InlineKeyboardButton("❌ Close Report", callback_data=f"close_report_{report_id}"))
+    if buttons:
+        markup.add(*buttons)
+    return markup
+
+def update_report_copies(bot, report_id, status):
+    """
+    Refresh the buttons on every owner's copy of the report.
+    """
+    markup = report_markup(report_id, status)
+    for chat_id, message_id in get_report_messages(report_id):
         try:
-            if message.content_type == "photo":
-                # Use highest-resolution photo.
-                photo_id = message.photo[-1].file_id
-                bot.send_photo(owner, photo_id, caption=report_header + report_text, parse_mode="HTML", reply_markup=markup)
-            elif message.content_type == "document":
-                bot.send_document(owner, message.document.file_id, caption=report_header + report_text, parse_mode="HTML", reply_markup=markup)
-            else:
-                bot.send_message(owner, report_header + report_text, parse_mode="HTML", reply_markup=markup)
-        except Exception as e:
-            print(f"Error sending report to owner {owner}: {e}")
-
-    bot.send_message(message.chat.id, "✅ Your report has been submitted. Thank you!")
+            bot.edit_message_reply_markup(chat_id, message_id, reply_markup=markup)
+        except Exception:
+            pass  # the reply prompt has no buttons, or the markup is unchanged
 
 def handle_claim_report(bot, call):
     """
-    Handle when an admin claims a report.
+    Handle when an admin claims a report. Only the first claim wins.
     """
-    report_id = call.data.split("_")[2]  # Extract report ID from callback
-    report = get_report_by_id(report_id)  # Fetch report from the DB
-
-    if report and not report.get('claimed'):
-        claim_report_by_admin(call.from_user.id, report_id)  # Mark as claimed
-        bot.answer_callback_query(call.id, "Report claimed successfully!")
-        bot.send_message(call.message.chat.id, f"Your report has been claimed by {call.from_user.username}.")
-        bot.send_message(report['user_id'], f"Your report has been claimed by {call.from_user.username}.")
+    report_id = int(call.data.rsplit("_", 1)[1])
+    if not claim_report_by_admin(call.from_user.id, report_id):
+        callbacks.answer(bot, call, "This report has already been claimed or closed.")
+        return
+    report = get_report_by_id(report_id)
+    claimer = call.from_user.username or call.from_user.first_name
+    callbacks.answer(bot, call, "Report claimed successfully!")
+    update_report_copies(bot, report_id, "claimed")
+    bot.send_message(report["chat_id"], f"Your report #{report_id} has been claimed by {claimer}.")
 
-        # Send report details to the owner/admin
-        bot.send_message(call.from_user.id, f"Report claimed: {report['text']}")
-        
-        # Allow the admin to send messages to the user after claiming the report.
-        bot.send_message(call.from_user.id, "You can now reply to this message, and the response will be sent to the user.")
-    else:
-        bot.answer_callback_query(call.id, "This report has already been claimed or closed.")
+    # Allow the admin to send messages to the user by replying to this message.
+    msg = bot.send_message(call.from_user.id,
+                           f"Report #{report_id} claimed:\n\n{report['text']}\n\n"
+                           "Reply to this message and the response will be sent to the user.")
+    add_report_messages(report_id, [(call.from_user.id, msg.message_id)])
 
 def handle_close_report(bot, call):
     """
     Handle when an admin closes a report.
     """
-    report_id = call.data.split("_")[2]  # Extract report ID from callback
+    report_id = int(call.data.rsplit("_", 1)[1])
+    if not close_report_in_db(report_id):
+        callbacks.answer(bot, call, "This report is already closed.")
+        return
     report = get_report_by_id(report_id)
+    callbacks.answer(bot, call, "Report has been closed.")
+    update_report_copies(bot, report_id, "closed")
+    bot.send_message(report["chat_id"], f"Your report #{report_id} has been closed by the admin.")
 
-    if report:
-        close_report_in_db(report_id)  # Close the report in the DB
-        bot.answer_callback_query(call.id, "Report has been closed.")
-        bot.send_message(call.message.chat.id, "The report has been closed.")
-        bot.send_message(report['user_id'], "Your report has been closed by the admin.")
-
-        # Prevent further actions on the closed report
-        bot.send_message(call.from_user.id, f"Report {report_id} has been closed.")
+def is_report_reply(message):
+    """
+    True for an owner's reply to one of the bot's report messages.
+    """
+    return (message.reply_to_message is not None
+            and str(message.from_user.id) in config.OWNERS
+            and get_report_id_for_message(message.chat.id, message.reply_to_message.message_id) is not None)
 
 def handle_admin_reply_to_report(bot, message):
     """
     Handle when an admin replies to a report's message.
     The message is sent to the user who reported the issue.
     """
-    # Check if the message is a reply to a report
-    if not message.reply_to_message or not message.reply_to_message.text.startswith("Report:"):
-        return  # Ignore if it's not a reply to a report
-
-    report_id = extract_report_id_from_reply(message.reply_to_message)  # Extract report ID
-    if is_report_claimed(report_id):
-        # Get report details and send it to the user
-        report = get_report_by_id(report_id)
-        bot.send_message(report['user_id'], f"Admin replied to your report: {message.text}")
+    report_id = get_report_id_for_message(message.chat.id, message.reply_to_message.message_id)
+    report = get_report_by_id(report_id) if report_id else None
+    if not report:
+        return
+    if report["status"] != "claimed" or report["claimed_by"] != str(message.from_user.id):
+        bot.reply_to(message, "Only the owner who claimed this report can reply while it is open.")
+        return
+    if message.content_type == "text":
+        bot.send_message(report["chat_id"], f"Admin replied to your report #{report_id}: {message.text}")
     else:
-        bot.send_message(message.chat.id, "This report is not claimed or has been closed.")
+        bot.send_message(report["chat_id"], f"Admin replied to your report #{report_id}:")
+        bot.copy_message(report["chat_id"], message.chat.id, message.message_id)
+    bot.reply_to(message, "✅ Sent to the user.")
 
-def extract_report_id_from_reply(message):
-    """Helper function to extract the report ID from the reply message."""
-    # Assumes the report text includes an identifiable format (e.g., report ID in the text)
-    if message.text and message.text.startswith("Report:"):
-        return message.text.split("ID: ")[1]  # Extract report ID from the message
-    return None
+# ----------------- REPORT QUEUES -----------------
+
+REPORTS_PAGE_SIZE = 10
+
+def send_report_queue(bot, call, status, after_id=None):
+    """
+    Show one page of open or claimed reports, oldest first.
+    """
+    reports, has_next = get_reports_page(status, after_id, limit=REPORTS_PAGE_SIZE)
+    markup = telebot.types.InlineKeyboardMarkup(row_width=2)
+    for report in reports:
+        preview = (report["text"] or report["media_type"] or "").replace("\n", " ")[:30]
+        markup.add(telebot.types.InlineKeyboardButton(f"#{report['id']} {preview}", callback_data=f"report_view_{report['id']}"))
+    if has_next:
+        markup.add(telebot.types.InlineKeyboardButton("Next ➡️", callback_data=f"reports_{status}_next_{reports[-1]['id']}"))
+    markup.row(
+        telebot.types.InlineKeyboardButton("📥 Open", callback_data="reports_open"),
+        telebot.types.InlineKeyboardButton("🛠 Claimed", callback_data="reports_claimed")
+    )
+    markup.add(telebot.types.InlineKeyboardButton("🔙 Back", callback_data="menu_admin"))
+    text = f"📋 {status.title()} reports" + ("" if reports else "\n\nNothing here.")
+    bot.edit_message_text(text, chat_id=call.message.chat.id, message_id=call.message.message_id, reply_markup=markup)
 
-def is_report_claimed(report_id):
-    """Check if the report has been claimed by an admin."""
+def send_report_detail(bot, call, report_id):
     report = get_report_by_id(report_id)
-    return report and report.get("claimed")
+    if not report:
+        callbacks.answer(bot, call, "Report not found.")
+        return
+    text = (f"Report #{report['id']}\n\n"
+            f"From: {report['user_id']}\n"
+            f"Status: {report['status']}"
+            + (f" by {report['claimed_by']}" if report["claimed_by"] else "") + "\n"
+            f"Created: {report['created_at']}\n\n"
+            f"{report['text'] or '(' + (report['media_type'] or 'empty') + ')'}")
+    markup = report_markup(report_id, report["status"])
+    markup.add(telebot.types.InlineKeyboardButton("🧾 Reporter's claims", callback_data=f"admin_claims_{report['user_id']}"))
+    back = "reports_claimed" if report["status"] == "claimed" else "reports_open"
+    markup.add(telebot.types.InlineKeyboardButton("🔙 Back", callback_data=back))
+    bot.edit_message_text(text, chat_id=call.message.chat.id, message_id=call.message.message_id, reply_markup=markup)
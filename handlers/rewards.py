@@ -2,44 +2,48 @@ import telebot
 from telebot import types
 import random
 import config
-import json
 import sqlite3
-from db import get_user, update_user_points, get_account_claim_cost, get_platforms
+import threading
+from db import get_user, get_account_claim_cost, get_platforms, get_stock_count
 from handlers.logs import log_event
+import navigation
+import reservoir
+import claimqueue
+import conversation
+from render import versioned
 
-def send_rewards_menu(bot, message):
+BULK_CLAIM_SIZES = (5, 10)
+MAX_BULK_CLAIM = 50
+
+@versioned("platforms")
+def rewards_keyboard():
+    """
+    The platform list with stock and prices, or None if there are no platforms.
+    """
     platforms = get_platforms()
     if not platforms:
-        bot.send_message(
-            message.chat.id,
-            "😢 No platforms available at the moment.",
-            reply_to_message_id=message.message_id
-        )
-        return
+        return None
+    default_price = get_account_claim_cost()
     markup = types.InlineKeyboardMarkup(row_width=1)
     for platform in platforms:
         platform_name = platform.get("platform_name")
-        stock = json.loads(platform.get("stock") or "[]")
-        price = platform.get("price") or get_account_claim_cost()
-        btn_text = f"{platform_name} | Stock: {len(stock)} | Price: {price} pts"
+        price = platform.get("price") or default_price
+        btn_text = f"{platform_name} | Stock: {platform.get('stock_count')} | Price: {price} pts"
         markup.add(types.InlineKeyboardButton(btn_text, callback_data=f"reward_{platform_name}"))
     markup.add(types.InlineKeyboardButton("🔙 Back", callback_data="back_main"))
-    try:
-        bot.edit_message_text(
-            "<b>⚡ 𝗔𝘃𝗮𝗶𝗹𝗮𝗯𝗹𝗲 𝗣𝗹𝗮𝘁𝗳𝗼𝗿𝗺𝘀 ⚡</b>",
-            chat_id=message.chat.id,
-            message_id=message.message_id,
-            parse_mode="HTML",
-            reply_markup=markup
-        )
-    except Exception:
+    return markup
+
+def send_rewards_menu(bot, message):
+    markup = rewards_keyboard()
+    if markup is None:
         bot.send_message(
             message.chat.id,
-            "<b>⚡ 𝗔𝘃𝗮𝗶𝗹𝗮𝗯𝗹𝗲 𝗣𝗹𝗮𝘁𝗳𝗼𝗿𝗺𝘀 ⚡</b>",
-            parse_mode="HTML",
-            reply_markup=markup,
+            "😢 No platforms available at the moment.",
             reply_to_message_id=message.message_id
         )
+        return
+    navigation.show(bot, message.chat.id, "<b>⚡ 𝗔𝘃𝗮𝗶𝗹𝗮𝗯𝗹𝗲 𝗣𝗹𝗮𝘁𝗳𝗼𝗿𝗺𝘀 ⚡</b>", markup,
+                    message_id=message.message_id, parse_mode="HTML")
 
 def handle_platform_selection(bot, call, platform_name):
     conn = __import__('db').get_connection()
@@ -57,12 +61,17 @@ def handle_platform_selection(bot, call, platform_name):
         )
         return
     platform = dict(platform)
-    stock = json.loads(platform["stock"] or "[]")
+    stock = get_stock_count(platform_name)
     price = platform["price"] or get_account_claim_cost()
     if stock:
-        text = f"<b>{platform_name}</b>:\n✅ Accounts Available: {len(stock)}\nPrice: {price} pts per account"
+        text = f"<b>{platform_name}</b>:\n✅ Accounts Available: {stock}\nPrice: {price} pts per account"
         markup = types.InlineKeyboardMarkup(row_width=1)
         markup.add(types.InlineKeyboardButton("🎁 Claim Account", callback_data=f"claim_{platform_name}"))
+        if stock > 1:
+            bulk = [types.InlineKeyboardButton(f"🎁 x{n}", callback_data=f"claimx_{n}_{platform_name}")
+                    for n in BULK_CLAIM_SIZES if n <= stock]
+            bulk.append(types.InlineKeyboardButton("🎁 Custom amount", callback_data=f"claimx_custom_{platform_name}"))
+            markup.row(*bulk)
     else:
         text = f"<b>{platform_name}</b>:\n😞 No accounts available at the moment.\nPrice: {price} pts per account"
         markup = types.InlineKeyboardMarkup()
@@ -87,19 +96,22 @@ def handle_platform_selection(bot, call, platform_name):
 def send_premium_account_info(bot, chat_id, platform_name, account_info):
     """
     If the claimed account is a cookie account (i.e. account_info is a dict with key 'type' == 'cookie'),
-    create an in-memory text file (with header) and send it as a document.
+    decompress its file behind a header and send it as a document.
     Otherwise, send the account details as a text message.
     """
     import io
+    import zlib
     if isinstance(account_info, dict) and account_info.get("type") == "cookie":
-        cookie_content = account_info.get("content", "No details found")
         header = (
             "━━━━━━━━━━━━━━━━━━━━━━\n"
             "🎁 Here Is Your Cookie For: " + platform_name + "\n"
             "━━━━━━━━━━━━━━━━━━━━━━\n\n"
         )
-        full_text = header + cookie_content
-        file_stream = io.BytesIO(full_text.encode('utf-8'))
+        file_stream = io.BytesIO()
+        file_stream.write(header.encode("utf-8"))
+        data = account_info.get("data")
+        file_stream.write(zlib.decompress(data) if data else b"No details found")
+        file_stream.seek(0)
         file_stream.name = f"{platform_name}_cookie.txt"
         bot.send_document(chat_id, file_stream, caption="Your cookie file has been sent.")
     else:
@@ -119,107 +131,140 @@ How to login:
 By @shadowsquad0"""
         bot.send_message(chat_id, text, parse_mode="HTML")
 
-def claim_account(bot, call, platform_name):
-    user_id = str(call.from_user.id)
-    user = get_user(user_id)
-    if user is None:
-        bot.send_message(
-            call.message.chat.id,
-            "User not found. Please /start the bot first.",
-            reply_to_message_id=call.message.message_id
+def send_bulk_accounts(bot, chat_id, platform_name, accounts):
+    """
+    Send several claimed items as one document: a .txt with one account per
+    line, or a ZIP when there are cookie files among them.
+    """
+    import io
+    import zlib
+    from zipfile import ZipFile, ZIP_DEFLATED
+    logins = [a for a in accounts if not (isinstance(a, dict) and a.get("type") == "cookie")]
+    cookies = [a for a in accounts if isinstance(a, dict) and a.get("type") == "cookie"]
+    file_stream = io.BytesIO()
+    if cookies:
+        with ZipFile(file_stream, "w", ZIP_DEFLATED) as zip_file:
+            for i, cookie in enumerate(cookies, 1):
+                data = cookie.get("data")
+                zip_file.writestr(f"{platform_name}_cookie_{i}.txt", zlib.decompress(data) if data else b"No details found")
+            if logins:
+                zip_file.writestr(f"{platform_name}_accounts.txt", "\n".join(map(str, logins)) + "\n")
+        file_stream.name = f"{platform_name}_x{len(accounts)}.zip"
+    else:
+        header = (
+            "━━━━━━━━━━━━━━━━━━━━━━\n"
+            f"🎁 Your {len(accounts)} accounts for: {platform_name}\n"
+            "━━━━━━━━━━━━━━━━━━━━━━\n\n"
         )
+        file_stream.write((header + "\n".join(map(str, logins)) + "\n").encode("utf-8"))
+        file_stream.name = f"{platform_name}_x{len(accounts)}.txt"
+    file_stream.seek(0)
+    bot.send_document(chat_id, file_stream,
+                      caption=f"Your {len(accounts)} {platform_name} accounts.\n"
+                              "❌ Account not working? Report below to get a refund of your points!")
+
+def claim_account(bot, call, platform_name, count=1):
+    deliver_claim(bot, call.message, call.from_user, platform_name, count)
+
+def deliver_claim(bot, message, from_user, platform_name, count=1):
+    """
+    Claim `count` items in one transaction and deliver them: a single item as
+    before, several as one document. Platforms in queued mode go through
+    claimqueue instead.
+    """
+    user_id = str(from_user.id)
+    if claimqueue.is_queued(platform_name):
+        if get_user(user_id) is None:
+            bot.send_message(
+                message.chat.id,
+                "User not found. Please /start the bot first.",
+                reply_to_message_id=message.message_id
+            )
+            return
+        queue_claim(bot, message, from_user, platform_name, count)
         return
-    conn = __import__('db').get_connection()
-    conn.row_factory = sqlite3.Row
-    c = conn.cursor()
-    c.execute("SELECT * FROM platforms WHERE platform_name = ?", (platform_name,))
-    platform = c.fetchone()
-    c.close()
-    conn.close()
-    if not platform:
-        bot.send_message(
-            call.message.chat.id,
-            "Platform not found.",
-            reply_to_message_id=call.message.message_id
-        )
+    # No user lookup here: the claim transaction checks the user, and a
+    # sold-out platform is turned away by its reservoir without a DB call.
+    accounts, result = reservoir.claim(user_id, platform_name, count)
+    send_claim_result(bot, message, from_user, platform_name, count, accounts, result)
+
+def queue_claim(bot, message, from_user, platform_name, count):
+    """
+    Join the platform's claim line and show the user their position; that
+    message is edited with the outcome once the claim has been served.
+    """
+    status = {}
+    posted = threading.Event()
+
+    def on_done(accounts, result):
+        posted.wait(10)
+        send_claim_result(bot, message, from_user, platform_name, count, accounts, result,
+                          status_message_id=status.get("message_id"))
+
+    position, error = claimqueue.submit(str(from_user.id), platform_name, count, on_done)
+    if error:
+        bot.send_message(message.chat.id, error, reply_to_message_id=message.message_id)
         return
-    platform = dict(platform)
-    stock = json.loads(platform["stock"] or "[]")
-    price = platform["price"] or get_account_claim_cost()
     try:
-        current_points = int(user.get("points", 0))
-    except Exception as e:
-        bot.send_message(
-            call.message.chat.id,
-            f"Error reading your points: {e}",
-            reply_to_message_id=call.message.message_id
-        )
-        return
-    if current_points < price:
-        bot.send_message(
-            call.message.chat.id,
-            f"Insufficient points (each account costs {price} pts). Earn more via referrals or keys.",
-            reply_to_message_id=call.message.message_id
-        )
-        return
-    if not stock:
-        bot.send_message(
-            call.message.chat.id,
-            "No accounts available.",
-            reply_to_message_id=call.message.message_id
+        msg = bot.send_message(
+            message.chat.id,
+            f"⏳ You're #{position} in line for {platform_name}. Hang on, your claim will be processed shortly.",
+            reply_to_message_id=message.message_id
         )
+        status["message_id"] = msg.message_id
+    finally:
+        posted.set()
+
+def send_claim_result(bot, message, from_user, platform_name, count, accounts, result, status_message_id=None):
+    """
+    Deliver a finished claim, or tell the user why it failed. With
+    status_message_id, that message is edited with the outcome.
+    """
+    def reply(text):
+        if status_message_id:
+            try:
+                bot.edit_message_text(text, chat_id=message.chat.id, message_id=status_message_id)
+                return
+            except Exception:
+                pass
+        bot.send_message(message.chat.id, text, reply_to_message_id=message.message_id)
+
+    if accounts is None:
+        reply(result)
         return
-    index = random.randint(0, len(stock) - 1)
-    account = stock.pop(index)
-    from db import update_stock_for_platform, update_user_points
-    update_stock_for_platform(platform_name, stock)
-    new_points = current_points - price
-    update_user_points(user_id, new_points)
+    user_id = str(from_user.id)
+    new_points = result
+    what = "an account" if count == 1 else f"{count} accounts"
     log_event(
         bot,
         "account_claim",
-        f"User {user_id} claimed an account from {platform_name}. New balance: {new_points} pts."
+        f"User {user_id} claimed {what} from {platform_name}. New balance: {new_points} pts."
     )
     # If claim is from a group chat, send the account info to the user's private chat.
-    target_chat_id = call.message.chat.id
-    if call.message.chat.type in ["group", "supergroup"]:
-        target_chat_id = call.from_user.id
-    send_premium_account_info(bot, target_chat_id, platform_name, account)
-    bot.send_message(
+    target_chat_id = message.chat.id
+    if message.chat.type in ["group", "supergroup"]:
+        target_chat_id = from_user.id
+    if count == 1:
+        send_premium_account_info(bot, target_chat_id, platform_name, accounts[0])
+    else:
+        send_bulk_accounts(bot, target_chat_id, platform_name, accounts)
+    reply("✅ Your account details have been sent via DM! Check your messages.")
+
+def prompt_bulk_claim(bot, call, platform_name):
+    msg = bot.send_message(
         call.message.chat.id,
-        "✅ Your account details have been sent via DM! Check your messages.",
+        f"How many {platform_name} accounts do you want to claim? (1-{MAX_BULK_CLAIM})",
         reply_to_message_id=call.message.message_id
     )
+    conversation.expect(msg, "bulk_claim_count", platform_name=platform_name)
 
-def get_leaderboard(limit=10):
-    """
-    Fetch the points leaderboard.
-    """
-    conn = get_connection()
-    conn.row_factory = sqlite3.Row
-    c = conn.cursor()
-    c.execute("SELECT telegram_id, username, points FROM users ORDER BY points DESC LIMIT ?", (limit,))
-    leaderboard = c.fetchall()
-    c.close()
-    conn.close()
-    return [dict(row) for row in leaderboard]
-
-def get_referral_leaderboard(limit=10):
-    """
-    Fetch the referral leaderboard.
-    """
-    conn = get_connection()
-    conn.row_factory = sqlite3.Row
-    c = conn.cursor()
-    c.execute("""
-        SELECT u.telegram_id, u.username, COUNT(r.referred_id) AS referrals
-        FROM users u
-        LEFT JOIN referrals r ON u.telegram_id = r.user_id
-        GROUP BY u.telegram_id
-        ORDER BY referrals DESC
-        LIMIT ?
-    """, (limit,))
-    leaderboard = c.fetchall()
-    c.close()
-    conn.close()
-    return [dict(row) for row in leaderboard]
+@conversation.handler("bulk_claim_count")
+def process_bulk_claim_count(bot, message, platform_name):
+    try:
+        count = int((message.text or "").strip())
+    except ValueError:
+        count = 0
+    if not 1 <= count <= MAX_BULK_CLAIM:
+        bot.reply_to(message, f"Please send a number from 1 to {MAX_BULK_CLAIM}.")
+        return
+    deliver_claim(bot, message, message.from_user, platform_name, count)
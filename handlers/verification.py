@@ -3,6 +3,7 @@ from telebot import types
 import config
 from handlers.admin import is_admin
 from handlers.main_menu import send_main_menu
+import callbacks
 
 def check_channel_membership(bot, user_id):
     """
@@ -58,7 +59,7 @@ def handle_verification_callback(bot, call):
     Rechecks channel membership and shows the main menu if verified.
     """
     if check_channel_membership(bot, call.from_user.id):
-        bot.answer_callback_query(call.id, "✅ Verification successful! 🎉")
-        send_main_menu(bot, call.message)
+        callbacks.answer(bot, call, "✅ Verification successful! 🎉")
+        send_main_menu(bot, call)
     else:
-        bot.answer_callback_query(call.id, "🚫 Verification failed. Please join all channels and try again.")
+        callbacks.answer(bot, call, "🚫 Verification failed. Please join all channels and try again.")
@@ -0,0 +1,239 @@
+import heapq
+import threading
+import time
+from array import array
+from bisect import bisect_right, insort
+import db
+
+class TopK:
+    """
+    In-memory top-K for one users column, kept current from db score changes.
+
+    It holds the best `k + slack` users. Every user outside that buffer has a
+    score <= self.floor, so a change can be applied without touching the DB:
+    users rising above the floor join the buffer, buffered users falling
+    below it leave. The buffer is only reloaded (one indexed LIMIT query)
+    when it shrinks below k.
+    """
+
+    def __init__(self, board, loader, k=10, slack=20):
+        self.board = board
+        self.loader = loader  # loader(limit) -> [{"telegram_id", "username", board}, ...] best first
+        self.k = k
+        self.capacity = k + slack
+        self._lock = threading.Lock()
+        self._entries = None  # telegram_id -> (username, score); None until loaded
+        self.floor = None     # None means every user is in the buffer
+        self._top = []
+        self._text = None
+
+    def _load(self):
+        rows = self.loader(self.capacity)
+        self._entries = {r["telegram_id"]: (r["username"], r[self.board]) for r in rows}
+        self.floor = rows[-1][self.board] if len(rows) == self.capacity else None
+        self._refresh_top()
+
+    def _refresh_top(self):
+        best = heapq.nlargest(self.k, self._entries.items(), key=lambda item: item[1][1])
+        top = [{"telegram_id": uid, "username": name, self.board: score} for uid, (name, score) in best]
+        if top != self._top:
+            self._top = top
+            self._text = None
+
+    def update(self, telegram_id, username, old_score, new_score):
+        with self._lock:
+            if self._entries is None:
+                return
+            if telegram_id in self._entries:
+                if self.floor is not None and new_score < self.floor:
+                    del self._entries[telegram_id]
+                else:
+                    self._entries[telegram_id] = (username, new_score)
+            elif self.floor is None or new_score > self.floor:
+                self._entries[telegram_id] = (username, new_score)
+            else:
+                return
+            if len(self._entries) > self.capacity:
+                ranked = sorted(self._entries.items(), key=lambda item: item[1][1], reverse=True)
+                dropped = ranked[self.capacity:]
+                self._entries = dict(ranked[:self.capacity])
+                best_dropped = dropped[0][1][1]
+                self.floor = best_dropped if self.floor is None else max(self.floor, best_dropped)
+            if len(self._entries) < self.k and self.floor is not None:
+                # Someone outside the buffer may now belong in the top K.
+                self._entries = None
+                return
+            self._refresh_top()
+
+    def top(self):
+        """
+        Return the current top K as a list of dicts, best first.
+        """
+        with self._lock:
+            if self._entries is None:
+                self._load()
+            return list(self._top)
+
+    def text(self, render):
+        """
+        Return render(top) from cache; it is re-rendered only after the top K
+        (its members or their scores) has changed.
+        """
+        with self._lock:
+            if self._entries is None:
+                self._load()
+            if self._text is None:
+                self._text = render(self._top)
+            return self._text
+
+    def reset(self):
+        with self._lock:
+            self._entries = None
+
+class RankIndex:
+    """
+    Exact "my rank" lookups for one users column in O(log n).
+
+    Keeps a sorted snapshot of every user's score plus two small sorted lists
+    of scores added and removed since the snapshot, so
+        rank = 1 + (users with a strictly higher score)
+    is three bisects. The snapshot is rebuilt in the background once the
+    pending lists grow past max_pending, and periodically by start_rank_rebuilder().
+    """
+
+    def __init__(self, board, max_pending=5000):
+        self.board = board
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        self._base = None      # array('q') snapshot, ascending
+        self._added = []
+        self._removed = []
+        self._since_rebuild = None  # (added, removed) recorded since the rebuild's snapshot
+        self._rebuilding = False
+        self._ready = threading.Event()
+
+    @staticmethod
+    def _count_above(scores, score):
+        return len(scores) - bisect_right(scores, score)
+
+    def rank(self, score):
+        """
+        Return 1 + the number of users with a strictly higher score, or None
+        if the snapshot could not be built.
+        """
+        if self._base is None:
+            self.rebuild()
+            self._ready.wait(30)
+            if self._base is None:
+                return None
+        with self._lock:
+            above = (self._count_above(self._base, score)
+                     + self._count_above(self._added, score)
+                     - self._count_above(self._removed, score))
+            return above + 1
+
+    def update(self, telegram_id, username, old_score, new_score):
+        with self._lock:
+            # Before the first snapshot there's nothing to adjust, unless
+            # one is being read right now and needs to hear about this.
+            targets = []
+            if self._base is not None:
+                targets.append((self._added, self._removed))
+            if self._since_rebuild is not None:
+                targets.append(self._since_rebuild)
+            if not targets:
+                return
+            for added, removed in targets:
+                if old_score is not None:
+                    insort(removed, old_score)
+                insort(added, new_score)
+            start = self._base is not None and len(self._added) > self.max_pending and not self._rebuilding
+        if start:
+            threading.Thread(target=self.rebuild, name=f"rank-rebuild-{self.board}", daemon=True).start()
+
+    def rebuild(self):
+        with self._lock:
+            if self._rebuilding:
+                return
+            self._rebuilding = True
+
+        def start_recording():
+            with self._lock:
+                self._since_rebuild = ([], [])
+
+        try:
+            base = array("q", db.get_sorted_scores(self.board, on_snapshot=start_recording))
+        except Exception:
+            with self._lock:
+                self._since_rebuild = None
+                self._rebuilding = False
+            raise
+        with self._lock:
+            # Changes committed while the snapshot was being read stay pending.
+            self._base = base
+            self._added, self._removed = self._since_rebuild
+            self._since_rebuild = None
+            self._rebuilding = False
+        self._ready.set()
+
+points_board = TopK("points", db.get_leaderboard)
+referral_board = TopK("referrals", db.get_referral_leaderboard)
+
+points_rank = RankIndex("points")
+referral_rank = RankIndex("referrals")
+
+BOARDS = {board.board: board for board in (points_board, referral_board)}
+RANKS = {index.board: index for index in (points_rank, referral_rank)}
+
+def _on_score_change(board, telegram_id, username, old_score, new_score):
+    if board in BOARDS:
+        BOARDS[board].update(telegram_id, username, old_score, new_score)
+    if board in RANKS:
+        RANKS[board].update(telegram_id, username, old_score, new_score)
+
+db.add_score_listener(_on_score_change)
+
+def get_leaderboard(limit=10):
+    """
+    Fetch the points leaderboard from memory.
+    """
+    return points_board.top()[:limit]
+
+def get_referral_leaderboard(limit=10):
+    """
+    Fetch the referral leaderboard from memory.
+    """
+    return referral_board.top()[:limit]
+
+def get_user_ranks(user):
+    """
+    Return (points_rank, referral_rank) for a user record from db.get_user().
+    """
+    return points_rank.rank(user.get("points") or 0), referral_rank.rank(user.get("referrals") or 0)
+
+def start_rank_rebuilder(interval=900):
+    """
+    Rebuild both rank snapshots now and then every `interval` seconds in a
+    daemon thread, which also picks up any change made outside db.py.
+    """
+    def loop():
+        while True:
+            for index in RANKS.values():
+                try:
+                    index.rebuild()
+                except Exception as e:
+                    print(f"Error rebuilding {index.board} rank index: {e}")
+            time.sleep(interval)
+    thread = threading.Thread(target=loop, name="rank-rebuilder", daemon=True)
+    thread.start()
+    return thread
+
+def reload():
+    """
+    Drop the cached boards and rebuild the rank snapshots, e.g. after the DB
+    was restored from a backup.
+    """
+    for board in BOARDS.values():
+        board.reset()
+    for index in RANKS.values():
+        index.rebuild()
@@ -1,27 +1,68 @@
 import telebot
 import config
 import os
+import signal
+import sys
 from datetime import datetime
-from db import init_db, add_user, get_user, claim_key_in_db, DATABASE
+from db import init_db, add_user, get_user, is_user_banned, claim_key_in_db, start_ledger_reconciler, rebuild_stats_counters, start_read_replica
 from handlers.verification import send_verification_message, handle_verification_callback, check_channel_membership
-from handlers.main_menu import send_main_menu
+from handlers.main_menu import send_main_menu, leaderboard_menu, points_leaderboard, referral_leaderboard
 from handlers.referral import extract_referral_code, process_verified_referral, send_referral_menu, get_referral_link
-from handlers.rewards import send_rewards_menu, handle_platform_selection, claim_account
-from handlers.review import prompt_review, process_report
-from handlers.account_info import send_account_info
+from handlers.rewards import send_rewards_menu, handle_platform_selection, claim_account, prompt_bulk_claim
+from handlers.review import (
+    prompt_review,
+    handle_claim_report,
+    handle_close_report,
+    is_report_reply,
+    handle_admin_reply_to_report,
+    send_report_queue,
+    send_report_detail,
+)
+from handlers.account_info import send_account_info, send_my_claims
 from handlers.admin import (
     send_admin_menu, admin_callback_handler, is_admin, lend_points, 
     update_account_claim_cost, update_referral_bonus, 
     generate_normal_key, generate_premium_key, add_key
 )
 from handlers.logs import log_event
-
-bot = telebot.TeleBot(config.TOKEN, parse_mode="HTML")
+from leaderboard import start_rank_rebuilder, reload as reload_leaderboards
+from backup import compressed_snapshot, restore, start_backup_scheduler
+import conversation
+import gateway
+import callbacks
+import navigation
+from digest import start_review_digest, get_review_mode, set_review_mode, REVIEW_MODES
+
+gateway.install()
+bot = telebot.TeleBot(config.TOKEN, parse_mode="HTML", num_threads=8)
+callbacks.install(bot)
+navigation.install(bot)
+# These handlers report results (verification, bans, refunds, access
+# denied...) as toasts, so they answer their queries themselves.
+callbacks.answers_itself("verify", "admin", "claim_report_", "close_report_", "reports_", "report_view_")
 init_db()
+start_ledger_reconciler()
+start_rank_rebuilder()
+start_backup_scheduler()
+conversation.start_state_expiry()
+start_review_digest(bot)
+if config.READ_REPLICA_INTERVAL:
+    start_read_replica(config.READ_REPLICA_INTERVAL)
+# Exit normally on SIGTERM so queued DB writes are flushed at exit.
+signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+# Registered first so a chat waiting on a prompt gets its answer handled
+# before any command or other message handler sees it.
+@bot.message_handler(func=conversation.is_waiting, content_types=conversation.CONTENT_TYPES)
+def conversation_step(message):
+    conversation.dispatch(bot, message)
+
+@bot.message_handler(func=is_report_reply, content_types=conversation.CONTENT_TYPES)
+def report_reply(message):
+    handle_admin_reply_to_report(bot, message)
 
 def check_if_banned(message):
-    user = get_user(str(message.from_user.id))
-    if user and user.get("banned", 0):
+    if is_user_banned(str(message.from_user.id)):
         bot.send_message(message.chat.id, "🚫 You are banned and cannot use this bot.", reply_to_message_id=message.message_id)
         return True
     return False
@@ -121,7 +162,7 @@ def report_command(message):
     if check_if_banned(message):
         return
     msg = bot.send_message(message.chat.id, "📝 Please type your report message (you may attach a photo or document):", reply_to_message_id=message.message_id)
-    bot.register_next_step_handler(msg, lambda m: process_report(bot, m))
+    conversation.expect(msg, "report")
 
 
 @bot.message_handler(commands=["tutorial"])
@@ -214,9 +255,12 @@ def recover_command(message):
     try:
         file_info = bot.get_file(message.reply_to_message.document.file_id)
         downloaded_file = bot.download_file(file_info.file_path)
-        with open(DATABASE, "wb") as f:
-            f.write(downloaded_file)
-        bot.reply_to(message, "✅ Database recovered successfully.", reply_to_message_id=message.message_id)
+        ok, detail = restore(downloaded_file)
+        if not ok:
+            bot.reply_to(message, f"❌ Not recovered: {detail}", reply_to_message_id=message.message_id)
+            return
+        reload_leaderboards()
+        bot.reply_to(message, f"✅ Database recovered successfully. {detail}", reply_to_message_id=message.message_id)
     except Exception as e:
         bot.reply_to(message, f"Error recovering database: {e}", reply_to_message_id=message.message_id)
 
@@ -227,12 +271,39 @@ def get_command(message):
         bot.reply_to(message, "🚫 You are not authorized.", reply_to_message_id=message.message_id)
         return
     try:
-        with open(DATABASE, "rb") as f:
-            bot.send_document(message.chat.id, f, reply_to_message_id=message.message_id)
+        data = compressed_snapshot()
+        name = f"bot-{datetime.now().strftime('%Y%m%d-%H%M%S')}.db.gz"
+        bot.send_document(message.chat.id, data, visible_file_name=name, reply_to_message_id=message.message_id)
     except Exception as e:
         bot.reply_to(message, f"Error sending database file: {e}", reply_to_message_id=message.message_id)
 
 
+@bot.message_handler(commands=["reviewmode"])
+def review_mode_command(message):
+    owner_id = str(message.from_user.id)
+    if owner_id not in config.OWNERS:
+        bot.reply_to(message, "🚫 You are not authorized.", reply_to_message_id=message.message_id)
+        return
+    parts = message.text.split()
+    if len(parts) < 2 or parts[1] not in REVIEW_MODES:
+        bot.reply_to(message, f"Review delivery: {get_review_mode(owner_id)}\nUsage: /reviewmode instant|digest",
+                     reply_to_message_id=message.message_id)
+        return
+    set_review_mode(owner_id, parts[1])
+    bot.reply_to(message, f"✅ Review delivery set to {parts[1]}.", reply_to_message_id=message.message_id)
+
+
+@bot.message_handler(commands=["rebuildstats"])
+def rebuild_stats_command(message):
+    if str(message.from_user.id) not in config.OWNERS:
+        bot.reply_to(message, "🚫 You are not authorized.", reply_to_message_id=message.message_id)
+        return
+    stats = rebuild_stats_counters()
+    text = "✅ Dashboard counters rebuilt:\n" + "\n".join(f"{name}: {value}" for name, value in stats.items())
+    bot.reply_to(message, text, reply_to_message_id=message.message_id)
+    log_event(bot, "stats", "Dashboard counters rebuilt.", user=message.from_user)
+
+
 @bot.message_handler(commands=["broadcast"])
 def broadcast_command(message):
     if str(message.from_user.id) not in config.OWNERS:
@@ -245,38 +316,40 @@ def broadcast_command(message):
     broadcast_text = parts[1]
     from db import get_connection
     conn = get_connection()
-    conn.row_factory = sqlite3.Row
     c = conn.cursor()
     c.execute("SELECT telegram_id FROM users")
     rows = c.fetchall()
     c.close()
     conn.close()
     count = 0
-    for row in rows:
-        user_id = row["telegram_id"]
-        try:
-            bot.send_message(user_id, broadcast_text)
-            count += 1
-        except Exception as e:
-            print(f"Failed to broadcast to {user_id}: {e}")
+    # Lowest priority, so user replies sent meanwhile are not held up behind it.
+    with gateway.priority(gateway.LOW):
+        for (user_id,) in rows:
+            try:
+                bot.send_message(user_id, broadcast_text)
+                count += 1
+            except Exception as e:
+                print(f"Failed to broadcast to {user_id}: {e}")
     bot.reply_to(message, f"Broadcast sent to {count} users.", reply_to_message_id=message.message_id)
 
 
 @bot.callback_query_handler(func=lambda call: call.data == "back_main")
 def callback_back_main(call):
-    try:
-        bot.delete_message(call.message.chat.id, call.message.message_id)
-    except Exception as e:
-        print("Error deleting message:", e)
-    send_main_menu(bot, call.message)
+    send_main_menu(bot, call)
 
 @bot.callback_query_handler(func=lambda call: call.data.startswith("verify"))
 def callback_verify(call):
-    handle_verification_callback(bot, call)
+    try:
+        handle_verification_callback(bot, call)
+    finally:
+        callbacks.finish(bot, call)
 
 @bot.callback_query_handler(func=lambda call: call.data.startswith("admin"))
 def callback_admin(call):
-    admin_callback_handler(bot, call)
+    try:
+        admin_callback_handler(bot, call)
+    finally:
+        callbacks.finish(bot, call)
 
 @bot.callback_query_handler(func=lambda call: call.data.startswith("menu_"))
 def callback_menu(call):
@@ -285,24 +358,79 @@ def callback_menu(call):
     elif call.data == "menu_info":
         send_account_info(bot, call)
     elif call.data == "menu_referral":
-        send_referral_menu(bot, call.message)
+        send_referral_menu(bot, call)
     elif call.data == "menu_review":
         prompt_review(bot, call.message)
     elif call.data == "menu_report":
         msg = bot.send_message(call.message.chat.id, "📝 Please type your report message (you may attach a photo or document):", reply_to_message_id=call.message.message_id)
-        bot.register_next_step_handler(msg, lambda m: process_report(bot, m))
+        conversation.expect(msg, "report")
     elif call.data == "menu_support":
         from handlers.support import send_support_message
         send_support_message(bot, call.message)
     elif call.data == "menu_admin":
-        send_admin_menu(bot, call.message)
+        send_admin_menu(bot, call)
+    elif call.data == "menu_leaderboard":
+        leaderboard_menu(call)
+    elif call.data == "menu_claims":
+        send_my_claims(bot, call)
+    elif call.data.startswith("menu_claims_"):
+        # menu_claims_<claimed_at>_<id> of the last claim on the previous page
+        claimed_at, claim_id = call.data[len("menu_claims_"):].split("_")
+        send_my_claims(bot, call, (int(claimed_at), int(claim_id)))
+    else:
+        callbacks.answer(bot, call, "Unknown menu command.")
+
+@bot.callback_query_handler(func=lambda call: call.data.startswith("leaderboard_"))
+def callback_leaderboard(call):
+    if call.data == "leaderboard_points":
+        points_leaderboard(call)
+    elif call.data == "leaderboard_referral":
+        referral_leaderboard(call)
+
+@bot.callback_query_handler(func=lambda call: call.data.startswith(("claim_report_", "close_report_", "reports_", "report_view_")))
+def callback_reports(call):
+    try:
+        handle_reports_callback(call)
+    finally:
+        callbacks.finish(bot, call)
+
+def handle_reports_callback(call):
+    if str(call.from_user.id) not in config.OWNERS:
+        callbacks.answer(bot, call, "Access prohibited.")
+        return
+    data = call.data
+    if data.startswith("claim_report_"):
+        handle_claim_report(bot, call)
+    elif data.startswith("close_report_"):
+        handle_close_report(bot, call)
+    elif data.startswith("report_view_"):
+        send_report_detail(bot, call, int(data.split("report_view_")[1]))
+    else:
+        # reports_<status> or reports_<status>_next_<last id>
+        parts = data.split("_")
+        status = parts[1] if parts[1] in ("open", "claimed") else "open"
+        after_id = int(parts[3]) if len(parts) > 3 else None
+        send_report_queue(bot, call, status, after_id)
+
+@bot.callback_query_handler(func=lambda call: call.data.startswith(("reward_", "claim_", "claimx_"))
+                            and not call.data.startswith("claim_report_"))
+def callback_rewards(call):
+    data = call.data
+    if data.startswith("reward_"):
+        handle_platform_selection(bot, call, data[len("reward_"):])
+    elif data.startswith("claim_"):
+        claim_account(bot, call, data[len("claim_"):])
     else:
-        bot.answer_callback_query(call.id, "Unknown menu command.")
+        # claimx_<count>_<platform> or claimx_custom_<platform>
+        amount, platform_name = data[len("claimx_"):].split("_", 1)
+        if amount == "custom":
+            prompt_bulk_claim(bot, call, platform_name)
+        else:
+            claim_account(bot, call, platform_name, int(amount))
 
 @bot.callback_query_handler(func=lambda call: call.data == "get_ref_link")
 def callback_get_ref_link(call):
     referral_link = get_referral_link(str(call.from_user.id))
-    bot.answer_callback_query(call.id, "Referral link generated!")
     bot.send_message(
         call.message.chat.id,
         f"Your referral link:\n{referral_link}",
@@ -0,0 +1,105 @@
+import functools
+import threading
+from collections import OrderedDict
+
+# Edit-in-place menu navigation. Each chat has one active menu message, and
+# moving between screens edits it rather than sending a new message. What
+# was last rendered into it is remembered, so showing the same screen again
+# costs no API call at all. A new message is sent only when there is nothing
+# to edit or the edit fails (message too old, deleted, or a media message).
+# install() makes the bot drop that memory whenever a handler edits or
+# deletes the menu message itself, so the next show() really edits it.
+
+MAX_CHATS = 10000
+
+_menus = OrderedDict()  # chat id -> (message id, rendered content)
+_lock = threading.Lock()
+_local = threading.local()
+
+# Bot methods that change a message behind show()'s back, with the
+# positions of their chat_id and message_id arguments.
+EDIT_METHODS = {
+    "edit_message_text": (1, 2),
+    "edit_message_caption": (1, 2),
+    "edit_message_media": (1, 2),
+    "edit_message_reply_markup": (0, 1),
+    "delete_message": (0, 1),
+}
+
+def _content(text, markup, parse_mode):
+    return (text, markup.to_json() if markup is not None else None, parse_mode)
+
+def _remember(chat_id, message_id, content):
+    with _lock:
+        _menus[chat_id] = (message_id, content)
+        _menus.move_to_end(chat_id)
+        while len(_menus) > MAX_CHATS:
+            _menus.popitem(last=False)
+
+def active_menu(chat_id):
+    """
+    Return the message id of the chat's active menu, or None.
+    """
+    entry = _menus.get(chat_id)
+    return entry[0] if entry else None
+
+def forget(chat_id):
+    with _lock:
+        _menus.pop(chat_id, None)
+
+def _invalidate(chat_id, message_id, deleted=False):
+    with _lock:
+        entry = _menus.get(chat_id)
+        if entry and entry[0] == message_id:
+            if deleted:
+                del _menus[chat_id]
+            else:
+                _menus[chat_id] = (message_id, None)
+
+def _tracking(name, method):
+    chat_pos, message_pos = EDIT_METHODS[name]
+
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        if not getattr(_local, "showing", False):
+            chat_id = kwargs.get("chat_id", args[chat_pos] if len(args) > chat_pos else None)
+            message_id = kwargs.get("message_id", args[message_pos] if len(args) > message_pos else None)
+            if chat_id is not None:
+                _invalidate(chat_id, message_id, deleted=name == "delete_message")
+        return method(*args, **kwargs)
+    return wrapper
+
+def install(bot):
+    """
+    Notice edits and deletions of menu messages made outside show().
+    """
+    for name in EDIT_METHODS:
+        setattr(bot, name, _tracking(name, getattr(bot, name)))
+
+def show(bot, chat_id, text, markup=None, message_id=None, parse_mode=None, new=False):
+    """
+    Show a menu screen in chat_id and return its message id.
+
+    message_id is the message to edit, normally the one whose button was
+    tapped; it defaults to the chat's active menu. new=True always sends a
+    fresh message, e.g. for a typed command.
+    """
+    content = _content(text, markup, parse_mode)
+    target = None if new else (message_id or active_menu(chat_id))
+    if target is not None:
+        if _menus.get(chat_id) == (target, content):
+            return target
+        _local.showing = True
+        try:
+            bot.edit_message_text(text, chat_id=chat_id, message_id=target, reply_markup=markup, parse_mode=parse_mode)
+            _remember(chat_id, target, content)
+            return target
+        except Exception as e:
+            if "message is not modified" in str(e):
+                _remember(chat_id, target, content)
+                return target
+        finally:
+            _local.showing = False
+    msg = bot.send_message(chat_id, text, reply_markup=markup, parse_mode=parse_mode)
+    _remember(chat_id, msg.message_id, content)
+    return msg.message_id
@@ -0,0 +1,87 @@
+import atexit
+import queue
+import random
+import threading
+import time
+import gateway
+
+# Background delivery for messages nobody is waiting on, such as owner
+# notifications. A small pool of sender threads works through a bounded
+# queue, so a handler can answer its user right after the DB write.
+
+SENDER_THREADS = 4
+MAX_ATTEMPTS = 5
+
+_queue = queue.Queue(maxsize=5000)
+_senders = []
+_start_lock = threading.Lock()
+
+def _retry_delay(error, attempt):
+    """
+    Seconds to wait before retrying after `error`, or None if retrying is
+    pointless (bad request, bot blocked, chat not found...) or unsafe: a
+    network error after the request reached Telegram may mean it was
+    delivered, and sending it again would duplicate it.
+    """
+    code = getattr(error, "error_code", None)
+    if code == 429:
+        parameters = (getattr(error, "result_json", None) or {}).get("parameters") or {}
+        return parameters.get("retry_after", 1)
+    if code is not None:
+        return None if code < 500 else min(2 ** attempt, 30) + random.random()
+    if isinstance(error, gateway.CircuitOpenError) or gateway._never_sent(error):
+        return min(2 ** attempt, 30) + random.random()
+    return None
+
+def _run():
+    with gateway.priority(gateway.NORMAL):
+        _work()
+
+def _work():
+    while True:
+        fn, args, kwargs, on_sent, label = _queue.get()
+        try:
+            for attempt in range(MAX_ATTEMPTS):
+                try:
+                    result = fn(*args, **kwargs)
+                except Exception as e:
+                    delay = _retry_delay(e, attempt)
+                    if delay is None or attempt == MAX_ATTEMPTS - 1:
+                        print(f"Error delivering {label}: {e}")
+                        break
+                    time.sleep(delay)
+                else:
+                    if on_sent:
+                        try:
+                            on_sent(result)
+                        except Exception as e:
+                            print(f"Error after delivering {label}: {e}")
+                    break
+        finally:
+            _queue.task_done()
+
+def _ensure_started():
+    with _start_lock:
+        while len(_senders) < SENDER_THREADS:
+            thread = threading.Thread(target=_run, name=f"notify-{len(_senders)}", daemon=True)
+            thread.start()
+            _senders.append(thread)
+
+def deliver(fn, *args, on_sent=None, label="message", **kwargs):
+    """
+    Queue fn(*args, **kwargs), e.g. bot.send_message, for a sender thread.
+    Failures are retried with backoff, honouring Telegram's retry_after.
+    on_sent(result) is called from the sender thread after a success.
+    """
+    _ensure_started()
+    _queue.put((fn, args, kwargs, on_sent, label))
+
+def flush(timeout=10):
+    """
+    Wait up to `timeout` seconds for queued deliveries to finish.
+    """
+    deadline = time.monotonic() + timeout
+    while _queue.unfinished_tasks and time.monotonic() < deadline:
+        time.sleep(0.05)
+
+atexit.register(flush)
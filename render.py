@@ -0,0 +1,141 @@
+import functools
+import threading
+from telebot import types
+import db
+
+# Prebuilt keyboards. Static menus are built and serialized to JSON once;
+# menus that list DB content are cached per content version (see
+# db.content_version) and rebuilt only after that content changes.
+# `python render.py bench` prints the per-render cost of each approach.
+
+class FrozenKeyboard(types.InlineKeyboardMarkup):
+    """
+    An inline keyboard whose JSON is computed once. Instances are shared
+    between requests, so they can't be changed after they are built.
+    """
+
+    def __init__(self, markup):
+        super().__init__()
+        # Take over the built rows whatever this telebot version calls them.
+        self.__dict__.update(markup.__dict__)
+        self._json = markup.to_json()
+
+    def to_json(self):
+        return self._json
+
+    def add(self, *args, **kwargs):
+        raise TypeError("FrozenKeyboard can't be changed; build a new markup instead.")
+
+    row = add
+
+def freeze(markup):
+    return markup if markup is None or isinstance(markup, FrozenKeyboard) else FrozenKeyboard(markup)
+
+def static_keyboard(build):
+    """
+    Cache build(*args) as a FrozenKeyboard, once per distinct args.
+    """
+    cache = {}
+    lock = threading.Lock()
+
+    @functools.wraps(build)
+    def wrapper(*args):
+        markup = cache.get(args)
+        if markup is None:
+            with lock:
+                markup = cache.get(args)
+                if markup is None:
+                    markup = cache[args] = freeze(build(*args))
+        return markup
+    return wrapper
+
+def versioned(kind, maxsize=256):
+    """
+    Cache render(*args) until db.content_version(kind) changes. The render
+    function returns a markup or a (text, markup) tuple; markups are frozen.
+    """
+    def decorator(render):
+        cache = {}
+        state = {"version": None}
+        lock = threading.Lock()
+
+        @functools.wraps(render)
+        def wrapper(*args):
+            version = db.content_version(kind)
+            with lock:
+                if state["version"] != version:
+                    cache.clear()
+                    state["version"] = version
+                if args in cache:
+                    return cache[args]
+            result = render(*args)
+            if isinstance(result, tuple):
+                result = tuple(freeze(part) if isinstance(part, types.InlineKeyboardMarkup) else part for part in result)
+            elif isinstance(result, types.InlineKeyboardMarkup):
+                result = freeze(result)
+            with lock:
+                # Don't store a render that started before a concurrent change.
+                if state["version"] == version == db.content_version(kind):
+                    if len(cache) >= maxsize:
+                        cache.clear()
+                    cache[args] = result
+            return result
+        wrapper.cache_clear = cache.clear
+        return wrapper
+    return decorator
+
+def _bench():
+    import timeit
+
+    def build_menu():
+        markup = types.InlineKeyboardMarkup(row_width=3)
+        markup.add(
+            types.InlineKeyboardButton("🎉 Rewards", callback_data="menu_rewards"),
+            types.InlineKeyboardButton("👥 Info", callback_data="menu_info"),
+            types.InlineKeyboardButton("🤝 Referral", callback_data="menu_referral"),
+            types.InlineKeyboardButton("🏆 Leaderboard", callback_data="menu_leaderboard")
+        )
+        markup.add(
+            types.InlineKeyboardButton("📠 Review", callback_data="menu_review"),
+            types.InlineKeyboardButton("📣 Report", callback_data="menu_report"),
+            types.InlineKeyboardButton("💬 Support", callback_data="menu_support")
+        )
+        return markup
+
+    platforms = [(f"Platform {i}", 25, 40 + i) for i in range(20)]
+
+    def build_platforms():
+        markup = types.InlineKeyboardMarkup(row_width=1)
+        for name, stock, price in platforms:
+            markup.add(types.InlineKeyboardButton(f"{name} | Stock: {stock} | Price: {price} pts",
+                                                  callback_data=f"reward_{name}"))
+        return markup
+
+    frozen_menu = static_keyboard(build_menu)
+    frozen_platforms = versioned("platforms")(build_platforms)
+    values = dict(username="someone", telegram_id="123456789", balance=120, referrals=3)
+    template = "┃ ✧ Username: {username}\n┃ ✧ User ID: {telegram_id}\n┃ ✧ Balance: {balance} pts\n┃ ✧ Total Referrals: {referrals}\n"
+
+    def fstring(username, telegram_id, balance, referrals):
+        return (f"┃ ✧ Username: {username}\n┃ ✧ User ID: {telegram_id}\n"
+                f"┃ ✧ Balance: {balance} pts\n┃ ✧ Total Referrals: {referrals}\n")
+
+    cases = [
+        ("main menu: build + to_json", lambda: build_menu().to_json()),
+        ("main menu: static_keyboard", lambda: frozen_menu().to_json()),
+        ("20 platforms: build + to_json", lambda: build_platforms().to_json()),
+        ("20 platforms: versioned hit", lambda: frozen_platforms().to_json()),
+        ("text: f-string", lambda: fstring(**values)),
+        ("text: str.format_map", lambda: template.format_map(values)),
+    ]
+    for name, fn in cases:
+        number = 20000
+        best = min(timeit.repeat(fn, number=number, repeat=5)) / number
+        print(f"{name:32} {best * 1e6:8.2f} µs")
+
+if __name__ == "__main__":
+    import sys
+    if sys.argv[1:] == ["bench"]:
+        _bench()
+    else:
+        print("Usage: python render.py bench")
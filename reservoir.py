@@ -0,0 +1,131 @@
+import random
+import threading
+from collections import deque
+import db
+
+# Per-platform claim reservoirs. Each platform keeps a queue of stock item ids
+# prefetched from the DB; a claim pops its ids locally and its transaction
+# deletes only those rows (db.claim_stock_items), so concurrent claims during
+# a drop don't queue up behind one another picking items. The queue is
+# refilled in the background when it runs low, and once the DB has nothing
+# left a claim is turned away without touching it until the platform is
+# restocked (db.content_version("stock") moves).
+
+BATCH_SIZE = 200
+LOW_WATER = 50
+MAX_ATTEMPTS = 3
+
+class _Reservoir:
+
+    def __init__(self, platform_name):
+        self.platform_name = platform_name
+        self.lock = threading.Lock()
+        self.fetch_lock = threading.Lock()  # one DB fetch at a time, so batches don't overlap
+        self.generation = 0  # bumped on every reset, so a fetch started before one is dropped
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self._reset()
+
+    def _reset(self):
+        self.ids = deque()
+        self.after_id = 0  # highest id fetched so far
+        self.exhausted = False
+        self.refilling = False
+        self.version = db.content_version("stock")
+        self.generation += 1
+
+    def take(self, count):
+        """
+        Pop `count` item ids. Returns (ids, None), (None, available) if
+        the platform has fewer than `count` items left, or (None, None) if
+        the stock couldn't be read.
+        """
+        while True:
+            with self.lock:
+                if self.version != db.content_version("stock"):
+                    self._reset()
+                if len(self.ids) >= count:
+                    ids = [self.ids.popleft() for _ in range(count)]
+                    refill = not self.exhausted and not self.refilling and len(self.ids) < LOW_WATER
+                    if refill:
+                        self.refilling = True
+                    break
+                if self.exhausted:
+                    return None, len(self.ids)
+            if not self.fetch():
+                return None, None
+        if refill:
+            threading.Thread(target=self.fetch, daemon=True).start()
+        return ids, None
+
+    def put_back(self, ids):
+        with self.lock:
+            self.ids.extendleft(reversed(ids))
+
+    def fetch(self):
+        """
+        Append the next batch of ids from the DB to the queue. Returns
+        False if the DB couldn't be read.
+        """
+        with self.fetch_lock:
+            with self.lock:
+                after_id = self.after_id
+                generation = self.generation
+            try:
+                ids = db.get_stock_item_ids(self.platform_name, after_id, BATCH_SIZE)
+            except Exception as e:
+                print(f"Error refilling stock reservoir for {self.platform_name}: {e}")
+                with self.lock:
+                    self.refilling = False
+                return False
+            with self.lock:
+                self.refilling = False
+                if generation != self.generation:
+                    # Reset meanwhile; the next take fetches again.
+                    return True
+                # Shuffled, so claimers don't all get the oldest uploads.
+                random.shuffle(ids)
+                self.ids.extend(ids)
+                if ids:
+                    self.after_id = max(ids)
+                if len(ids) < BATCH_SIZE:
+                    self.exhausted = True
+                return True
+
+_reservoirs = {}
+_lock = threading.Lock()
+
+def _reservoir(platform_name):
+    reservoir = _reservoirs.get(platform_name)
+    if reservoir is None:
+        with _lock:
+            reservoir = _reservoirs.setdefault(platform_name, _Reservoir(platform_name))
+    return reservoir
+
+def claim(telegram_id, platform_name, count=1):
+    """
+    Claim `count` items from a platform through its reservoir. Same results
+    as db.claim_stock_items: (accounts, new_balance) or (None, error_message).
+    """
+    reservoir = _reservoir(platform_name)
+    for _ in range(MAX_ATTEMPTS):
+        ids, available = reservoir.take(count)
+        if ids is None and available is None:
+            return None, "Couldn't check the stock right now, please try again."
+        if ids is None:
+            return None, f"Only {available} accounts available." if available else "No accounts available."
+        try:
+            accounts, result = db.claim_stock_items(telegram_id, platform_name, ids)
+        except db.StockGone:
+            # Items were taken outside this reservoir; start over from the DB.
+            reservoir.reset()
+            continue
+        except Exception:
+            reservoir.put_back(ids)
+            raise
+        if accounts is None:
+            reservoir.put_back(ids)
+        return accounts, result
+    return None, "Stock is changing right now, please try again."